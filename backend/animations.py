@@ -0,0 +1,203 @@
+# Text animation engine (MoviePy path).
+# The old per-clip lambdas re-ran resize()/rotate() on the caption bitmap for
+# every frame, forever. Here each animation is a transform table over the
+# output frame grid: (dx, dy, scale, angle, fade). Only the few distinct
+# (scale, angle) bitmaps are resampled (and cached); once an animation settles
+# the layer is the base bitmap with a plain translate.
+import math
+import zlib
+import random
+import itertools
+import threading
+from collections import OrderedDict
+
+from render_timeline import FPS, DEFAULT_CANVAS
+
+FADE_SECONDS = 0.3
+POP_SECONDS = 0.25
+SWING_ANGLE_STEP = 0.5 # Degrees. Swing angles are quantized so rotated bitmaps repeat
+BITMAP_CACHE_BYTES = 128 * 1024 * 1024 # Per render: shared by its animated layers, freed with its composite
+GRID_TOLERANCE = 1e-6
+
+
+def animation_seed(text, start):
+    # Stable across processes (parallel slices must jitter identically)
+    return zlib.crc32(f"{text}|{start}".encode("utf-8"))
+
+
+def text_transform(anim_type, ct, seed=0, px=1.0, fps=FPS):
+    """
+    (dx, dy, scale, angle, fade) of a text layer at clip time ct, relative to its
+    resting top-left position. Same curves as the original MoviePy lambdas.
+    px: canvas scale for the pixel offsets (see render_timeline.Canvas).
+    fps: canvas frame rate (glitch jitter is drawn per output frame).
+    """
+    dx, dy, scale, angle, fade = 0.0, 0.0, 1.0, 0.0, 1.0
+
+    if anim_type == 'slide_up':
+        # Slide from 50px below combined with Fade
+        dy = 50 * px * max(0, 1 - ct / FADE_SECONDS)
+        if ct < FADE_SECONDS: fade = ct / FADE_SECONDS
+
+    elif anim_type == 'fade':
+        if ct < FADE_SECONDS: fade = ct / FADE_SECONDS
+
+    elif anim_type == 'pop' or anim_type == 'typewriter':
+        # Pop: Scale 0 -> 1 over 0.25s (Simulating pop)
+        # (Typewriter mapped to Pop for now as v1 fallback for single-image clips)
+        if ct < POP_SECONDS: scale = ct / POP_SECONDS
+
+    elif anim_type == 'bounce':
+        # Bounce: y(t) = final_y - 80 * |sin(3*t)|  (Bounces up)
+        dy = -80 * px * abs(math.sin(3 * ct))
+
+    elif anim_type == 'shake':
+        # Shake: Fast horizontal oscillation
+        dx = 20 * px * math.sin(20 * ct)
+
+    elif anim_type == 'swing':
+        # Swing: Pendulum rotation, angle(t) = 15 * sin(2*t)
+        angle = round(15 * math.sin(2 * ct) / SWING_ANGLE_STEP) * SWING_ANGLE_STEP
+
+    elif anim_type == 'glitch':
+        # Glitch: Jumps every 0.1s - seeded per frame so renders are repeatable
+        if int(ct * 10) % 5 == 0:
+            rng = random.Random(seed * 1000003 + int(round(ct * fps)))
+            dx, dy = rng.randint(-20, 20) * px, rng.randint(-10, 10) * px
+
+    return dx, dy, scale, angle, fade
+
+
+class BitmapLRU:
+    # (layer, scale, angle) -> (rgb, mask), bounded by total bytes. One per render
+    # (see moviepy_engine.build_composite): layer ids never repeat, so an entry only
+    # serves its own layer and has no use once that render is done
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None: self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = value[0].nbytes + value[1].nbytes
+        with self.lock:
+            if key in self.items: return
+            self.items[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.items) > 1:
+                _, (rgb, mask) = self.items.popitem(last=False)
+                self.bytes -= rgb.nbytes + mask.nbytes
+
+
+_layer_ids = itertools.count() # Cache keys (never reused, unlike id())
+
+
+class TextAnimation:
+    """
+    Per-frame transforms for one text layer. rgba: uint8 (H, W, 4) caption bitmap.
+    final_x/final_y: resting top-left position on the canvas.
+    """
+
+    def __init__(self, rgba, anim_type, start, duration, final_x, final_y, seed=0, canvas=DEFAULT_CANVAS, bitmaps=None):
+        import numpy as np
+
+        self.anim_type = anim_type
+        self.start = float(start)
+        self.duration = float(duration)
+        self.final_x = final_x
+        self.final_y = final_y
+        self.seed = seed
+        self.fps = canvas.fps
+        self.px = canvas.scale
+        # Same split as ImageClip(rgba): colour + float alpha mask
+        self.rgb = np.ascontiguousarray(rgba[:, :, :3])
+        self.mask = 1.0 * rgba[:, :, 3] / 255
+        self.h, self.w = self.rgb.shape[:2]
+        self.layer_id = next(_layer_ids)
+        self.bitmaps = bitmaps if bitmaps is not None else BitmapLRU(BITMAP_CACHE_BYTES)
+        self._empty = (np.zeros((1, 1, 3), dtype=np.uint8), np.zeros((1, 1)))
+
+        # Transform table over the output frame grid (t = n / fps)
+        fps = self.fps
+        self.first_frame = int(math.ceil(self.start * fps - GRID_TOLERANCE))
+        last_frame = int(math.ceil((self.start + self.duration) * fps - GRID_TOLERANCE))
+        self.table = [
+            text_transform(anim_type, n / fps - self.start, seed, self.px, fps)
+            for n in range(self.first_frame, last_frame)
+        ]
+
+    def transform(self, ct):
+        n = int(round((ct + self.start) * self.fps))
+        i = n - self.first_frame
+        if 0 <= i < len(self.table) and abs(n / self.fps - self.start - ct) < GRID_TOLERANCE:
+            return self.table[i]
+        return text_transform(self.anim_type, ct, self.seed, self.px, self.fps) # Off-grid time (e.g. clip setup)
+
+    def _resampled(self, scale, angle):
+        if scale == 1 and angle == 0:
+            return self.rgb, self.mask # Settled: plain translate of the base bitmap
+
+        key = (self.layer_id, scale, angle)
+        cached = self.bitmaps.get(key)
+        if cached is not None:
+            return cached
+
+        from PIL import Image
+        from moviepy.video.fx.resize import resizer
+        from moviepy.video.fx.rotate import pil_rotater
+
+        rgb, mask = self.rgb, self.mask
+        if scale != 1:
+            # Same resampling as clip.resize(): mask goes through uint8
+            newsize = [self.w * scale, self.h * scale]
+            if int(newsize[0]) < 1 or int(newsize[1]) < 1:
+                return self._empty
+            rgb = resizer(rgb, newsize)
+            mask = 1.0 * resizer((255 * mask).astype('uint8'), newsize) / 255
+        if angle != 0:
+            # Same as clip.rotate(angle) (bicubic, expand)
+            rgb = pil_rotater(rgb, angle, resample=Image.BICUBIC, expand=True)
+            mask = pil_rotater(mask, angle, resample=Image.BICUBIC, expand=True)
+
+        self.bitmaps.put(key, (rgb, mask))
+        return rgb, mask
+
+    def frame(self, ct):
+        _, _, scale, angle, fade = self.transform(ct)
+        rgb = self._resampled(scale, angle)[0]
+        if fade < 1:
+            return fade * rgb # fadein: colour from black, mask untouched
+        return rgb
+
+    def mask_frame(self, ct):
+        _, _, scale, angle, _ = self.transform(ct)
+        return self._resampled(scale, angle)[1]
+
+    def position(self, ct):
+        dx, dy, scale, _, _ = self.transform(ct)
+        if scale != 1:
+            # Centered Resize Logic (Compensate for top-left anchor)
+            return (
+                self.final_x + (self.w - self.w * scale) / 2,
+                self.final_y + (self.h - self.h * scale) / 2
+            )
+        return (self.final_x + dx, self.final_y + dy)
+
+
+def animated_text_clip(rgba, anim_type, start, duration, final_x, final_y, seed=0, canvas=DEFAULT_CANVAS, bitmaps=None):
+    """
+    MoviePy clip (with mask) drawing rgba with the given animation, already placed at start.
+    bitmaps: the render's BitmapLRU for resampled frames (default: one for this layer).
+    """
+    from moviepy.video.VideoClip import VideoClip
+
+    anim = TextAnimation(rgba, anim_type, start, duration, final_x, final_y, seed, canvas, bitmaps)
+    mask = VideoClip(anim.mask_frame, ismask=True, duration=anim.duration)
+    clip = VideoClip(anim.frame, duration=anim.duration).set_mask(mask)
+    return clip.set_position(anim.position).set_start(anim.start).set_duration(anim.duration)
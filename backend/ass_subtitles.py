@@ -0,0 +1,227 @@
+# Caption burn-in through one ASS script (libass), the alternative to the bitmap
+# path where every text track is a Pillow PNG composited as its own layer.
+# The whole text_tracks list becomes one script, drawn by ffmpeg's `ass` filter in
+# the encode pass, so hundreds of word-level captions cost about one filter.
+# Style mapping mirrors text_raster: same font files (font map + weight rules),
+# size, colours, stroke, uppercase, line breaks (wrap_text) and centre anchor
+# (render_timeline.text_anchor). Animations:
+#   fade / slide_up / pop / typewriter  ASS tags (\t colour from black, \move, \t scale),
+#                                       the same linear curves as animations.text_transform
+#   bounce / shake / swing / glitch     one event per output frame, positioned from
+#                                       animations.text_transform (same jitter seeds)
+# libass draws with FreeType, so glyphs are close to but not bit-identical with Pillow's.
+import os
+import math
+import subprocess
+from functools import lru_cache
+
+from render_timeline import text_anchor
+from text_raster import resolve_text_style, wrap_text, load_font, FONT_DIR
+from animations import text_transform, animation_seed, FADE_SECONDS, POP_SECONDS
+
+CAPTION_MODES = ('bitmap', 'ass')
+TAG_ANIMATIONS = ('fade', 'slide_up', 'pop', 'typewriter') # Everything else animated is keyframed per frame
+SLIDE_PX = 50 # slide_up start offset (Studio px), as in animations.text_transform
+
+SCRIPT_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {w}
+PlayResY: {h}
+WrapStyle: 2
+ScaledBorderAndShadow: yes
+YCbCr Matrix: None
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,60,&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,0,0,5,0,0,0,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+@lru_cache(maxsize=1)
+def ass_available():
+    """True if this ffmpeg build has the libass `ass` filter."""
+    try:
+        out = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True, text=True, timeout=30).stdout
+    except Exception:
+        return False
+    return any(line.split()[1:2] == ['ass'] for line in out.splitlines())
+
+
+def caption_mode(requested):
+    """'ass' when requested and available, else 'bitmap' (the Pillow overlay path)."""
+    if requested == 'ass':
+        if ass_available():
+            return 'ass'
+        print("Captions: ffmpeg has no libass, using bitmap captions")
+    return 'bitmap'
+
+
+def _win_height(font_path):
+    # (usWinAscent + usWinDescent) / unitsPerEm from the OS/2 and head tables, or None
+    import struct
+    try:
+        with open(font_path, "rb") as f:
+            data = f.read()
+        tables = {}
+        for i in range(struct.unpack(">H", data[4:6])[0]):
+            tag, _, offset, _ = struct.unpack(">4sIII", data[12 + 16 * i:28 + 16 * i])
+            tables[tag] = offset
+        units_per_em = struct.unpack(">H", data[tables[b'head'] + 18:tables[b'head'] + 20])[0]
+        win_ascent, win_descent = struct.unpack(">HH", data[tables[b'OS/2'] + 74:tables[b'OS/2'] + 78])
+        return (win_ascent + win_descent) / units_per_em
+    except (OSError, KeyError, struct.error, ZeroDivisionError):
+        return None
+
+
+@lru_cache(maxsize=64)
+def font_face(font_path):
+    """
+    (family, bold, size_ratio) of the font the bitmap path would draw with. libass
+    (like VSFilter) sizes a font by its Windows ascent + descent where Pillow uses
+    the em size, so an ASS \\fs of em_px * size_ratio draws glyphs as large as Pillow's em_px.
+    """
+    font = load_font(font_path, 1000) # Falls back to the system font like the bitmap path
+    try:
+        family, style = font.getname()
+        ascent, descent = font.getmetrics()
+    except Exception:
+        return "Liberation Sans", True, 1.15 # Pillow's bitmap default: nothing better to ask libass for
+    bold = any(word in (style or "") for word in ("Bold", "Black", "Heavy"))
+    ratio = _win_height(getattr(font, 'path', None) or font_path) or (ascent + descent) / 1000.0
+    return family, bold, ratio
+
+
+def _ass_color(color, default):
+    # (colour, alpha) override values: &HBBGGRR& and &HAA& (alpha 00 = opaque)
+    from PIL import ImageColor
+    try:
+        rgba = tuple(color) if isinstance(color, (tuple, list)) else ImageColor.getrgb(str(color))
+    except (ValueError, TypeError):
+        rgba = default
+    r, g, b = (int(v) for v in rgba[:3])
+    a = 255 - int(rgba[3]) if len(rgba) > 3 else 0
+    return f"&H{b:02X}{g:02X}{r:02X}&", f"&H{a:02X}&"
+
+
+def _time(seconds):
+    # h:mm:ss.cc (ASS has centisecond resolution)
+    cs = max(0, int(round(seconds * 100)))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+
+def _escape(text):
+    # Braces open override blocks and "\N"-style sequences are escapes: keep them literal
+    return text.replace("\\", "\\⁠").replace("{", "\\{").replace("}", "\\}")
+
+
+def _num(val):
+    return f"{float(val):.2f}".rstrip('0').rstrip('.')
+
+
+def _dialogue(layer, start, end, tags, text):
+    return f"Dialogue: {layer},{_time(start)},{_time(end)},Default,,0,0,0,,{{{tags}}}{text}\n"
+
+
+def track_events(track, layer, canvas, window=None):
+    """ASS Dialogue lines for one text track (timeline time), [] if empty or outside window."""
+    spec = resolve_text_style(track, canvas)
+    if not spec:
+        return []
+    start = float(spec['start'])
+    end = start + float(spec['duration'])
+    if window is not None and (end <= window[0] or start >= window[1]):
+        return []
+
+    family, bold, size_ratio = font_face(spec['font'])
+    scale = canvas.scale
+    lines = wrap_text(spec['text'], spec['font'], spec['font_size'], spec['stroke_width'], spec['max_width'])
+    text = "\\N".join(_escape(line) for line in lines)
+    primary, primary_alpha = _ass_color(spec['color'], (255, 255, 255))
+    outline, outline_alpha = _ass_color(spec['stroke_color'], (0, 0, 0))
+    colors = f"\\1c{primary}\\3c{outline}"
+    base = (
+        f"\\an5\\fn{family}\\b{1 if bold else 0}\\fs{_num(spec['font_size'] * scale * size_ratio)}"
+        f"{colors}\\1a{primary_alpha}\\3a{outline_alpha}"
+        f"\\bord{_num(spec['stroke_width'] * scale)}\\shad0"
+    )
+
+    pos_x, pos_y = text_anchor(track, spec['style'])
+    x, y = pos_x * canvas.w, pos_y * canvas.h
+    anim = spec['animation']
+
+    if not anim or anim == 'none' or anim in TAG_ANIMATIONS:
+        tags = base
+        if anim in ('fade', 'slide_up'):
+            # MoviePy fadein: colour rises from black, the outline too, coverage unchanged
+            ms = int(FADE_SECONDS * 1000)
+            tags += f"\\1c&H000000&\\3c&H000000&\\t(0,{ms},{colors})"
+        if anim == 'slide_up':
+            ms = int(FADE_SECONDS * 1000)
+            tags += f"\\move({_num(x)},{_num(y + SLIDE_PX * scale)},{_num(x)},{_num(y)},0,{ms})"
+        else:
+            tags += f"\\pos({_num(x)},{_num(y)})"
+        if anim in ('pop', 'typewriter'):
+            tags += f"\\fscx0\\fscy0\\t(0,{int(POP_SECONDS * 1000)},\\fscx100\\fscy100)"
+        return [_dialogue(layer, start, end, tags, text)]
+
+    # Continuous motion: keyframe every output frame the caption is on screen
+    fps = canvas.fps
+    seed = animation_seed(spec['text'], start)
+    lo, hi = (start, end) if window is None else (max(start, window[0]), min(end, window[1]))
+    first = int(math.ceil(lo * fps - 1e-6))
+    last = int(math.ceil(hi * fps - 1e-6))
+    events = []
+    for n in range(first, last):
+        t = n / fps
+        dx, dy, _, angle, _ = text_transform(anim, t - start, seed, scale, fps)
+        # Each event covers its frame time with half a frame either side
+        ev_start = max(start, t - 0.5 / fps)
+        ev_end = min(end, t + 0.5 / fps)
+        tags = base + f"\\pos({_num(x + dx)},{_num(y + dy)})" + (f"\\frz{_num(angle)}" if angle else "")
+        events.append(_dialogue(layer, ev_start, ev_end, tags, text))
+    return events
+
+
+def build_script(text_tracks, canvas, window=None):
+    """
+    The ASS script drawing every text track on canvas (times are timeline seconds).
+    Later tracks are drawn on top, as in the bitmap path. Returns (script, event count).
+    """
+    events = []
+    for layer, track in enumerate(text_tracks):
+        try:
+            events.extend(track_events(track, layer, canvas, window))
+        except Exception as e:
+            print(f"Failed to convert text track to ASS: {e}")
+    return SCRIPT_HEADER.format(w=canvas.w, h=canvas.h) + "".join(events), len(events)
+
+
+def _filter_arg(value):
+    # Filter option value escaping (paths may hold ':' or quotes)
+    return value.replace("\\", "\\\\").replace(":", "\\:").replace("'", "\\'")
+
+
+def caption_filter(text_tracks, canvas, work_dir, name="captions", window=None):
+    """
+    Writes the script for canvas and returns the filter chain that burns it into a
+    stream whose time 0 is timeline time window[0], or None if no caption is visible.
+    """
+    script, count = build_script(text_tracks, canvas, window)
+    if not count:
+        return None
+    path = os.path.join(work_dir, f"{name}.ass")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(script)
+    print(f"Captions: {count} ASS events for {len(text_tracks)} text tracks ({canvas.w}x{canvas.h})")
+
+    chain = f"ass=filename={_filter_arg(path)}"
+    if os.path.isdir(FONT_DIR):
+        chain += f":fontsdir={_filter_arg(FONT_DIR)}"
+    t0 = window[0] if window else 0
+    if t0 > 0:
+        # Script times are timeline times: shift the frames there and back
+        chain = f"setpts=PTS+{t0:.6f}/TB,{chain},setpts=PTS-{t0:.6f}/TB"
+    return chain
@@ -0,0 +1,198 @@
+# Content-addressed asset cache shared by every container (Modal Volume).
+# Layout under CACHE_ROOT:
+#   blobs/{sha256}{ext}   - file bodies, named by sha256(normalized url + ETag) or sha256(content)
+#   blobs/{name}          - derived files stored by name (get_blob/put_blob), e.g. rendered segments
+#   urls/{sha256}.json    - normalized url -> {blob, etag, size}
+#   tmp/                  - in-flight writes (same filesystem, so os.replace is atomic)
+# Entries with an ETag are revalidated with If-None-Match (a 304 costs no body).
+# Blob mtime doubles as "last used" for LRU eviction by total size.
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CACHE_MOUNT = "/cache"
+CACHE_ROOT = "/cache/assets"
+MAX_CACHE_BYTES = 40 * 1024 ** 3 # Evict least recently used blobs above this
+EVICT_TO_RATIO = 0.9 # ...down to 90% so we don't evict on every job
+TMP_MAX_AGE = 6 * 3600 # Orphaned partial writes from crashed containers
+
+# Presigned URL params change on every request but don't change the object
+SIGNATURE_PARAMS = ('x-amz-', 'signature', 'expires', 'awsaccesskeyid')
+
+# One volume per container, but possibly several jobs (concurrent inputs) syncing it
+_volume_lock = threading.Lock()
+
+
+def normalize_url(url):
+    """Lowercase scheme/host, drop fragment and signature params, sort the remaining query."""
+    parts = urlsplit(url.strip())
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(SIGNATURE_PARAMS)
+    ]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(sorted(query)), ''))
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class AssetCache:
+    def __init__(self, root=CACHE_ROOT, max_bytes=MAX_CACHE_BYTES, volume=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.volume = volume # modal.Volume (optional): reload before reads, commit after writes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.url_dir = os.path.join(root, "urls")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self._dirty = False
+        self._lock = threading.Lock()
+        for d in (self.blob_dir, self.url_dir, self.tmp_dir):
+            os.makedirs(d, exist_ok=True)
+
+    def reload(self):
+        # Pick up blobs committed by other containers since this one started
+        if self.volume is None: return
+        try:
+            with _volume_lock:
+                self.volume.reload()
+        except Exception as e:
+            print(f"Asset cache reload failed: {e}")
+
+    def commit(self):
+        """Evicts if over budget and persists this container's writes for everyone else."""
+        with self._lock:
+            if not self._dirty: return
+            self._dirty = False
+        self.evict()
+        if self.volume is None: return
+        try:
+            with _volume_lock:
+                self.volume.commit()
+        except Exception as e:
+            print(f"Asset cache commit failed: {e}")
+
+    def tmp_path(self):
+        # Downloads land here first so the final rename never crosses filesystems
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def _url_entry_path(self, url):
+        return os.path.join(self.url_dir, _sha256(normalize_url(url)) + ".json")
+
+    def lookup(self, url):
+        """Returns {blob, etag, size, path} for a cached url, or None."""
+        try:
+            with open(self._url_entry_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = os.path.join(self.blob_dir, entry.get('blob', ''))
+        if not entry.get('blob') or not os.path.exists(path):
+            return None # Blob was evicted
+        entry['path'] = path
+        return entry
+
+    def store(self, url, tmp_path, etag, ext):
+        """Moves a finished download into the cache (atomic rename) and indexes it. Returns the blob path."""
+        if etag:
+            key = _sha256(normalize_url(url) + "\n" + etag)
+        else:
+            # No validator: key by content, so identical files are still stored once
+            key = _file_sha256(tmp_path)
+        blob = key + ext
+        blob_path = os.path.join(self.blob_dir, blob)
+        size = os.path.getsize(tmp_path)
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+            self.touch(blob_path)
+        else:
+            os.replace(tmp_path, blob_path)
+
+        entry_tmp = self.tmp_path()
+        with open(entry_tmp, "w") as f:
+            json.dump({"url": normalize_url(url), "blob": blob, "etag": etag, "size": size, "stored": time.time()}, f)
+        os.replace(entry_tmp, self._url_entry_path(url))
+        self._dirty = True
+        return blob_path
+
+    def get_blob(self, blob):
+        """Path of a blob stored by name (put_blob), or None if it was never stored / got evicted."""
+        path = os.path.join(self.blob_dir, blob)
+        if not os.path.exists(path):
+            return None
+        self.touch(path)
+        return path
+
+    def put_blob(self, blob, src_path):
+        """Stores a file under a caller-derived name (e.g. a hash of what produced it). Returns the blob path."""
+        tmp = self.tmp_path()
+        shutil.copyfile(src_path, tmp)
+        path = os.path.join(self.blob_dir, blob)
+        os.replace(tmp, path)
+        self._dirty = True
+        return path
+
+    def touch(self, blob_path):
+        # LRU bookkeeping: mtime = last use
+        try:
+            os.utime(blob_path, None)
+            self._dirty = True
+        except OSError:
+            pass
+
+    def materialize(self, blob_path, dest_path):
+        """Copies a blob to a job-local path (write-then-rename, so readers never see half a file)."""
+        tmp_dest = f"{dest_path}.part"
+        shutil.copyfile(blob_path, tmp_dest)
+        os.replace(tmp_dest, dest_path)
+        self.touch(blob_path)
+        return os.path.getsize(dest_path)
+
+    def evict(self):
+        """Deletes least recently used blobs until the cache fits in max_bytes * EVICT_TO_RATIO."""
+        now = time.time()
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if now - os.path.getmtime(path) > TMP_MAX_AGE: os.remove(path)
+            except OSError:
+                pass
+
+        blobs = []
+        total = 0
+        for name in os.listdir(self.blob_dir):
+            path = os.path.join(self.blob_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            blobs.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * EVICT_TO_RATIO
+        evicted = 0
+        for _, size, path in sorted(blobs):
+            if total <= target: break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+        # url entries pointing at evicted blobs are treated as misses by lookup()
+        print(f"Asset cache: evicted {evicted} blobs, {total} bytes remain")
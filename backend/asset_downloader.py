@@ -0,0 +1,243 @@
+# Shared asset downloader for render / subtitle workers.
+# - One keep-alive connection pool per host (shared requests.Session)
+# - Bounded thread pool: every track starts downloading before any clip is loaded
+# - 1MB reads + large buffered writes, atomic .part -> final rename
+# - HTTP Range: resume after a dropped connection, parallel chunks for big files
+# - Manifest of bytes/timings per asset for the job result
+# - Optional AssetCache (Modal Volume): fetched once per URL+ETag across containers
+# - Tracks sharing a URL (split-screen crops of one source) share one download and local file
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from render_timeline import outside_window
+from asset_cache import normalize_url
+
+MAX_WORKERS = 8 # Concurrent assets per job
+CHUNK_SIZE = 1024 * 1024 # 1MB reads (was 8KB)
+WRITE_BUFFER = 8 * 1024 * 1024
+PARALLEL_THRESHOLD = 32 * 1024 * 1024 # Split files bigger than this into ranges
+RANGE_PARTS = 4
+MAX_RETRIES = 3
+TIMEOUT = (10, 60) # (connect, read)
+
+_session = None
+_session_lock = threading.Lock()
+_range_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS * RANGE_PARTS, thread_name_prefix="asset-range")
+
+
+def get_session():
+    # Pooled keep-alive connections, reused across assets (and jobs in a warm container)
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=MAX_WORKERS * RANGE_PARTS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _asset_filename(url, prefix):
+    # Infer extension
+    ext = ".mp4"
+    if "." in url.split("/")[-1]:
+         possible_ext = "." + url.split("/")[-1].split(".")[-1].split("?")[0]
+         if len(possible_ext) < 5: ext = possible_ext
+    return f"{prefix}{ext}"
+
+
+def _stream_to(response, f):
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        if chunk:
+            f.write(chunk)
+
+
+def _fetch_range(url, path, start, end, stats):
+    """Downloads bytes [start, end] into an already allocated file, resuming on dropped connections."""
+    pos = start
+    for attempt in range(MAX_RETRIES):
+        try:
+            with get_session().get(url, stream=True, timeout=TIMEOUT, headers={"Range": f"bytes={pos}-{end}"}) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RuntimeError(f"Range not honoured (HTTP {r.status_code})")
+                with open(path, "r+b", buffering=WRITE_BUFFER) as f:
+                    f.seek(pos)
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            pos += len(chunk)
+            if pos > end:
+                return
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1: raise
+            stats['resumes'] += 1
+            print(f"Range {start}-{end} dropped at {pos}: {e}. Resuming...")
+    raise RuntimeError(f"Range {start}-{end} incomplete ({pos - start} bytes)")
+
+
+def _fetch(url, tmp_path, stats, etag=None):
+    """
+    GETs url into tmp_path. Big range-capable files are split into parallel chunks.
+    With etag, sends If-None-Match and returns None on 304 (cached copy still valid).
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    with get_session().get(url, stream=True, timeout=TIMEOUT, headers=headers) as r:
+        if r.status_code == 304:
+            return None
+        r.raise_for_status()
+        stats['etag'] = r.headers.get("ETag")
+        total = int(r.headers.get("Content-Length") or 0)
+        ranged = r.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+        if ranged and total > PARALLEL_THRESHOLD:
+            # Parallel chunking: drop this stream and fetch RANGE_PARTS ranges concurrently
+            r.close()
+            with open(tmp_path, "wb") as f:
+                f.truncate(total)
+            part = -(-total // RANGE_PARTS)
+            stats['parts'] = RANGE_PARTS
+            futures = [
+                _range_pool.submit(_fetch_range, url, tmp_path, s, min(s + part, total) - 1, stats)
+                for s in range(0, total, part)
+            ]
+            for fut in futures: fut.result()
+            return total
+
+        try:
+            with open(tmp_path, "wb", buffering=WRITE_BUFFER) as f:
+                _stream_to(r, f)
+        except Exception as e:
+            if not (ranged and total):
+                raise
+            print(f"Download dropped at {os.path.getsize(tmp_path)}/{total}: {e}. Resuming with Range...")
+
+    written = os.path.getsize(tmp_path)
+
+    if total and written < total:
+        # Resume from where the stream died
+        stats['resumes'] += 1
+        _fetch_range(url, tmp_path, written, total - 1, stats)
+        written = total
+    return written
+
+
+def download_asset(url, prefix, local_assets_dir, manifest=None, cache=None):
+    """
+    Downloads url to {local_assets_dir}/{prefix}{ext}. Returns the local path or None.
+    With cache (AssetCache), a valid cached copy is reused and fresh downloads are stored.
+    Appends a {url, file, bytes, seconds, ...} entry to manifest (if given).
+    """
+    filename = _asset_filename(url, prefix)
+    path = os.path.join(local_assets_dir, filename)
+    stats = {"url": url.split("?")[0], "file": filename, "bytes": 0, "seconds": 0.0,
+             "cached": False, "etag": None, "parts": 1, "resumes": 0, "error": None}
+    if manifest is not None:
+        manifest.append(stats)
+
+    # NOTE: never trust an existing {prefix}{ext} file - a warm container may
+    # have it from a previous job with a different URL at the same index.
+    started = time.time()
+    entry = cache.lookup(url) if cache else None
+    tmp_path = cache.tmp_path() if cache else f"{path}.part"
+    # Entries without an ETag can't be revalidated: fetch again (still stored once, by content hash)
+    etag = entry.get('etag') if entry else None
+    try:
+        print(f"Downloading {url} to {filename}...")
+        size = _fetch(url, tmp_path, stats, etag=etag)
+
+        if size is None:
+            # 304 Not Modified: copy from the shared cache
+            stats['cached'] = True
+            stats['etag'] = etag
+            stats['bytes'] = cache.materialize(entry['path'], path)
+            stats['seconds'] = round(time.time() - started, 3)
+            print(f"Cache hit {filename}: {stats['bytes']} bytes in {stats['seconds']}s")
+            return path
+
+        stats['bytes'] = size
+        stats['seconds'] = round(time.time() - started, 3)
+        print(f"Downloaded {filename}: {size} bytes in {stats['seconds']}s")
+        if size == 0:
+            print(f"WARNING: Downloaded empty file: {url}")
+            stats['error'] = "empty"
+            return None
+
+        if cache:
+            try:
+                blob_path = cache.store(url, tmp_path, stats.get('etag'), os.path.splitext(filename)[1])
+                cache.materialize(blob_path, path)
+                return path
+            except Exception as e:
+                print(f"Asset cache store failed for {filename}: {e}")
+                if not os.path.exists(tmp_path): raise
+        shutil.move(tmp_path, path) # Cache tmp dir may be on another filesystem
+        return path
+    except Exception as e:
+        stats['seconds'] = round(time.time() - started, 3)
+        stats['error'] = str(e)
+        print(f"Failed to download {url}: {e}")
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def download_tracks(video_tracks, audio_tracks, local_assets_dir, window=None, cache=None):
+    """
+    Downloads every track asset concurrently. video_tracks must already be in
+    their final order (files are named by position: vid_0, vid_1, aud_0...).
+    Tracks with the same (normalized) URL get the same local file.
+    window: (t0, t1) to skip video tracks that can't be visible in that time range.
+    cache: optional AssetCache shared across containers.
+    Returns (video_items, audio_items, manifest); items are [(track_data, local_path)].
+    """
+    os.makedirs(local_assets_dir, exist_ok=True)
+    manifest = []
+
+    jobs = [] # (url, prefix), one per distinct asset
+    job_index = {} # normalized url -> index in jobs
+    tracks = [] # (kind, track_data, index in jobs), in track order
+
+    def add(kind, track_data, url, prefix):
+        key = normalize_url(url)
+        if key not in job_index:
+            job_index[key] = len(jobs)
+            jobs.append((url, prefix))
+        tracks.append((kind, track_data, job_index[key]))
+
+    for idx, track_data in enumerate(video_tracks):
+        url = track_data.get('url') or track_data.get('src')
+        if not url or outside_window(track_data, window): continue
+        add('video', track_data, url, f"vid_{idx}")
+    for idx, track_data in enumerate(audio_tracks):
+        url = track_data.get('url') or track_data.get('src')
+        if not url: continue
+        add('audio', track_data, url, f"aud_{idx}")
+
+    started = time.time()
+    if cache: cache.reload()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="asset-dl") as pool:
+        futures = [pool.submit(download_asset, url, prefix, local_assets_dir, manifest, cache) for url, prefix in jobs]
+        paths = [fut.result() for fut in futures]
+    if cache: cache.commit()
+
+    video_items, audio_items = [], []
+    for kind, track_data, job in tracks:
+        local_path = paths[job]
+        if not local_path: continue
+        (video_items if kind == 'video' else audio_items).append((track_data, local_path))
+
+    if len(tracks) > len(jobs):
+        print(f"{len(tracks) - len(jobs)} tracks reuse another track's download")
+    total_bytes = sum(m['bytes'] for m in manifest if not m['cached'])
+    hits = sum(1 for m in manifest if m['cached'])
+    print(f"Downloaded {len(jobs)} assets ({total_bytes} bytes, {hits} cache hits) in {time.time() - started:.2f}s")
+    return video_items, audio_items, manifest
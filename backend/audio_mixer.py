@@ -0,0 +1,148 @@
+# Timeline audio mixer shared by both render engines, slice/segment renders and subtitles.
+# Every audible source (audio tracks + the soundtrack of video tracks) is decoded
+# ONCE by ffmpeg to float PCM at the mix rate - only the part that lands in the
+# requested window - then placed at a sample-accurate offset, scaled by its
+# volume and summed in NumPy (tracks playing the same file range - split-screen
+# copies of one source - share one decode). The mix is encoded in one pass and muxed under the
+# video as-is (no per-chunk Python evaluation like MoviePy's CompositeAudioClip,
+# no millisecond-rounded adelay).
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from render_timeline import is_image_track, video_clip_span, track_offset, track_volume
+from media_probe import probe_media
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+MAX_DECODERS = 4 # Concurrent ffmpeg decodes
+AAC_ARGS = ['-c:a', 'aac', '-ar', str(SAMPLE_RATE)] # Same as the engines' video audio
+
+
+def audio_sources(video_items, audio_items, errors=None):
+    """
+    [(track_data, local_path, duration)] for everything audible. Video audio is
+    trimmed like the picture; duration 0 plays to the end of the source.
+    errors: optional list collecting per-source problems.
+    """
+    sources = []
+
+    # 1. Video audio
+    for track_data, local_path in video_items:
+        if is_image_track(track_data, local_path): continue
+        span = video_clip_span(track_data, local_path)
+        if span is None or not probe_media(local_path)['has_audio']: continue
+        sources.append((track_data, local_path, span[1] - span[0]))
+
+    # 2. Audio Tracks
+    for track_data, local_path in audio_items:
+        if not probe_media(local_path)['has_audio']:
+            print(f"Failed to load audio {local_path}: no audio stream")
+            if errors is not None: errors.append(f"No audio stream in {local_path}")
+            continue
+        sources.append((track_data, local_path, float(track_data.get('duration', 0) or 0)))
+    return sources
+
+
+def decode_pcm(local_path, offset=0.0, duration=0.0, sample_rate=SAMPLE_RATE):
+    """Decodes [offset, offset + duration) of a file's audio to float32 PCM (samples, CHANNELS)."""
+    import numpy as np
+
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    if offset > 0:
+        cmd += ['-ss', f"{offset:.6f}"]
+    cmd += ['-i', local_path, '-vn', '-sn']
+    if duration > 0:
+        cmd += ['-t', f"{duration:.6f}"]
+    cmd += ['-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(sample_rate), '-']
+
+    proc = subprocess.run(cmd, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Audio decode of {local_path} failed: {proc.stderr.decode(errors='replace')[-1000:]}")
+    pcm = np.frombuffer(proc.stdout, dtype=np.float32)
+    return pcm[:len(pcm) - len(pcm) % CHANNELS].reshape(-1, CHANNELS)
+
+
+def mix(video_items, audio_items, duration=None, window=None, sample_rate=SAMPLE_RATE, errors=None):
+    """
+    Sums the timeline's audio into float32 PCM (samples, CHANNELS) covering
+    window (t0, t1), or [0, duration) (default: until the last source ends).
+    Returns None if nothing is audible.
+    """
+    import numpy as np
+
+    sources = audio_sources(video_items, audio_items, errors)
+    if not sources:
+        return None
+
+    if window is None:
+        if duration is None:
+            ends = []
+            for track_data, local_path, src_duration in sources:
+                if src_duration <= 0:
+                    src_duration = (probe_media(local_path)['duration'] or 0) - track_offset(track_data)
+                ends.append(float(track_data.get('start', 0) or 0) + max(0.0, src_duration))
+            duration = max(ends)
+        window = (0, duration)
+    t0, t1 = window
+    first_sample = int(round(t0 * sample_rate))
+    out = np.zeros((max(0, int(round(t1 * sample_rate)) - first_sample), CHANNELS), dtype=np.float32)
+
+    def plan(source):
+        # The part of the source that lands inside the window: (pos, decode args) or None
+        track_data, local_path, src_duration = source
+        start = float(track_data.get('start', 0) or 0)
+        end = start + src_duration if src_duration > 0 else None
+        if start >= t1 or (end is not None and end <= t0):
+            return None
+        skip = max(0.0, t0 - start)
+        length = (min(end, t1) if end is not None else t1) - (start + skip)
+        decode = (os.path.realpath(local_path), round(track_offset(track_data) + skip, 6), round(length, 6))
+        return int(round((start + skip) * sample_rate)) - first_sample, decode
+
+    plans = [(source, plan(source)) for source in sources]
+    with ThreadPoolExecutor(max_workers=MAX_DECODERS, thread_name_prefix="audio-decode") as pool:
+        decodes = {}
+        for _, placed in plans:
+            if placed is not None and placed[1] not in decodes:
+                path, offset, length = placed[1]
+                decodes[placed[1]] = pool.submit(decode_pcm, path, offset, length, sample_rate)
+        for (track_data, local_path, _), placed in plans:
+            if placed is None: continue
+            try:
+                pcm = decodes[placed[1]].result()
+            except Exception as e:
+                print(f"Failed to load audio {local_path}: {e}")
+                if errors is not None: errors.append(str(e))
+                continue
+            pos = placed[0]
+            n = min(len(pcm), len(out) - pos)
+            if n <= 0: continue
+            vol = track_volume(track_data)
+            if vol == 1.0:
+                out[pos:pos + n] += pcm[:n]
+            else:
+                out[pos:pos + n] += pcm[:n] * np.float32(vol)
+    return out
+
+
+def write_audio(pcm, output_path, codec_args=AAC_ARGS, sample_rate=SAMPLE_RATE):
+    """Encodes float PCM to output_path in one ffmpeg pass (samples clipped to [-1, 1])."""
+    import numpy as np
+
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(CHANNELS), '-i', '-'
+    ] + list(codec_args) + [output_path]
+    proc = subprocess.run(cmd, input=np.clip(pcm, -1.0, 1.0).tobytes(), capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Audio encode failed: {proc.stderr.decode(errors='replace')[-2000:]}")
+
+
+def render_audio(video_items, audio_items, output_path, duration=None, window=None, codec_args=AAC_ARGS, sample_rate=SAMPLE_RATE, errors=None):
+    """Mixes the timeline (or window) and encodes it to output_path. Returns False if the timeline is silent."""
+    pcm = mix(video_items, audio_items, duration=duration, window=window, sample_rate=sample_rate, errors=errors)
+    if pcm is None or len(pcm) == 0:
+        return False
+    write_audio(pcm, output_path, codec_args, sample_rate)
+    return True
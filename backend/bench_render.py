@@ -0,0 +1,372 @@
+# Offline render benchmark.
+# Builds a synthetic timeline from ffmpeg-generated test media (lavfi sources):
+# background clips, one subtitle per text animation, images/bubbles and several
+# audio tracks. The media is served by a local HTTP server and render_video_logic
+# runs on this machine with R2 replaced by a directory (LocalR2). Every run
+# happens in a fresh process so peak memory is per run. Reports fps, the job's
+# per-stage trace (see tracing.py) and peak RSS.
+#
+#   python backend/bench_render.py                     # ffmpeg vs moviepy on the default timeline
+#   python backend/bench_render.py --clips 4 --subs 16 --images 3 --audio 3 --duration 30 \
+#       --engines ffmpeg --repeat 3 --json bench.json
+#
+# Needs ffmpeg and the backend requirements; no Modal account or R2 credentials.
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import resource
+import functools
+import threading
+import subprocess
+import http.server
+import multiprocessing
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+
+# Every text animation the Studio offers (None = static)
+ANIMATIONS = (None, 'fade', 'slide_up', 'pop', 'typewriter', 'bounce', 'shake', 'swing', 'glitch')
+MEDIA_VERSION = 1 # Bump when the generated media changes
+
+
+class LocalR2:
+    """The boto3 S3 calls the render path makes, backed by a directory ({root}/{key})."""
+
+    def __init__(self, root):
+        self.root = root
+        self.uploads = {}
+
+    def _path(self, key):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with open(self._path(Key), "wb") as f:
+            f.write(Body.encode("utf-8") if isinstance(Body, str) else Body)
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        shutil.copyfile(Filename, self._path(Key))
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        with open(self._path(Key), "wb") as f:
+            shutil.copyfileobj(Fileobj, f)
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        shutil.copyfile(self._path(CopySource['Key']), self._path(Key))
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        with open(self._path(Key), "wb") as f:
+            for part in MultipartUpload['Parts']:
+                f.write(parts[part['PartNumber']])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+    def read_json(self, key):
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+def _ffmpeg(args):
+    proc = subprocess.run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error'] + args, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg {' '.join(args)} failed: {proc.stderr[-1000:]}")
+
+
+def build_media(media_dir, clips, images, audio, duration, width, height):
+    """Generates the test media once per shape. Returns {name: path} relative to media_dir."""
+    os.makedirs(media_dir, exist_ok=True)
+    files = {}
+    clip_seconds = duration / clips
+
+    def make(name, args):
+        path = os.path.join(media_dir, name)
+        if not os.path.exists(path):
+            tmp = path + ".tmp" + os.path.splitext(name)[1]
+            _ffmpeg(args + [tmp])
+            os.replace(tmp, path)
+        files[name] = path
+
+    for n in range(clips):
+        # Moving test pattern + tone; a different pattern per clip so every decode is real work
+        source = ('testsrc2', 'smptehdbars', 'testsrc', 'rgbtestsrc')[n % 4]
+        make(f"clip_{n}_{width}x{height}_{clip_seconds:.2f}s_v{MEDIA_VERSION}.mp4", [
+            '-f', 'lavfi', '-i', f"{source}=size={width}x{height}:rate=30:duration={clip_seconds:.3f}",
+            '-f', 'lavfi', '-i', f"sine=frequency={220 * (n + 1)}:sample_rate=44100:duration={clip_seconds:.3f}",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-g', '60', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest'
+        ])
+    for n in range(images):
+        if n % 2 == 0:
+            # Opaque photo-like image
+            make(f"image_{n}_v{MEDIA_VERSION}.jpg", [
+                '-f', 'lavfi', '-i', f"gradients=size=800x600:seed={n}", '-frames:v', '1'
+            ])
+        else:
+            # Speech bubble: RGBA with transparent margins
+            make(f"bubble_{n}_v{MEDIA_VERSION}.png", [
+                '-f', 'lavfi', '-i', "color=c=black@0.0:size=480x280,format=rgba,"
+                "drawbox=x=20:y=20:w=440:h=200:color=white@0.95:t=fill,drawbox=x=60:y=220:w=60:h=40:color=white@0.95:t=fill",
+                '-frames:v', '1'
+            ])
+    for n in range(audio):
+        make(f"audio_{n}_{duration:.2f}s_v{MEDIA_VERSION}.mp3", [
+            '-f', 'lavfi', '-i', f"sine=frequency={330 + 110 * n}:sample_rate=44100:duration={duration:.3f}",
+            '-c:a', 'libmp3lame', '-q:a', '4'
+        ])
+    return files
+
+
+def build_timeline(files, base_url, args, run_tag):
+    """Render request for the generated media. run_tag makes every URL new (cold asset cache)."""
+    def url(name):
+        return f"{base_url}{name}" + (f"?run={run_tag}" if run_tag else "")
+
+    clips = sorted(n for n in files if n.startswith("clip_"))
+    images = sorted(n for n in files if n.startswith(("image_", "bubble_")))
+    audio = sorted(n for n in files if n.startswith("audio_"))
+    clip_seconds = args.duration / len(clips)
+    # --trim: each clip plays from `offset` on, so cuts start between keyframes
+    trim = min(max(0.0, args.trim), clip_seconds / 2)
+    cut_seconds = clip_seconds - trim
+    video_end = len(clips) * cut_seconds
+
+    video_tracks = []
+    for n, name in enumerate(clips):
+        video_tracks.append({
+            "type": "video", "url": url(name), "trackIndex": 0,
+            "start": n * cut_seconds, "duration": cut_seconds, "volume": 0.6
+        })
+        if trim:
+            video_tracks[-1]["offset"] = trim
+    for n, name in enumerate(images):
+        # Staggered overlays on the layer above the backgrounds
+        start = (n * video_end / max(1, len(images))) % video_end
+        track = {
+            "type": "image", "url": url(name), "trackIndex": 1,
+            "start": start, "duration": min(3.0, video_end - start)
+        }
+        if name.startswith("bubble_"):
+            track.update({"x": "10%", "y": "15%", "width": "60%"})
+        else:
+            track.update({"width": "80%", "x": "10%", "y": "5%"})
+        video_tracks.append(track)
+
+    animations = ANIMATIONS
+    if args.animations == 'graph':
+        # Only the effects the FFmpeg graph can draw, so engine=ffmpeg never falls back
+        from ffmpeg_engine import GRAPH_ANIMATIONS
+        animations = tuple(a for a in ANIMATIONS if a in GRAPH_ANIMATIONS)
+    sub_seconds = video_end / max(1, args.subs)
+    text_tracks = []
+    for n in range(args.subs):
+        animation = animations[n % len(animations)]
+        style = {"fontSize": 80, "color": "white", "stroke": "black", "strokeWidth": 4}
+        if animation:
+            style["animation"] = animation
+        text_tracks.append({
+            "text": f"Benchmark {animation or 'static'} {n + 1}", "start": n * sub_seconds,
+            "duration": sub_seconds * 0.9, "style": style
+        })
+
+    audio_tracks = [
+        {"url": url(name), "start": n * 0.5, "duration": video_end - n * 0.5, "volume": 0.5}
+        for n, name in enumerate(audio)
+    ]
+
+    request = {
+        "video_tracks": video_tracks, "audio_tracks": audio_tracks, "text_tracks": text_tracks,
+        "script": [], "output_key": f"bench/{run_tag or 'warm'}_{uuid.uuid4().hex[:8]}.mp4",
+        "width": args.width, "height": args.height, "preview": args.preview,
+        "stream_upload": args.stream_upload, "segment_cache": args.segment_cache, "captions": args.captions,
+        "stream_copy": not args.no_stream_copy,
+        "formats": [{"width": int(w), "height": int(h)} for w, h in (f.split("x") for f in args.formats)]
+    }
+    return request
+
+
+def isolate(r2_root, log_path=None, preload="render"):
+    """
+    Sets up a fresh benchmark process: logs to log_path, backend importable, R2 -> LocalR2,
+    and main.py's preload group of the function under test (as its image sets it). Returns the LocalR2.
+    """
+    import types
+    if log_path:
+        # The render's prints and ffmpeg's stderr go to the run log, not the report
+        fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        sys.stdout.flush(); sys.stderr.flush()
+        os.dup2(fd, 1); os.dup2(fd, 2)
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(REPO_DIR) # main.py resolves backend/fonts/... from the repo root
+    # No local-module scan per @app.function (deploy-time only; containers never do it)
+    os.environ["MODAL_AUTOMOUNT"] = "0"
+    if preload:
+        os.environ["SHORTSALPHA_PRELOAD"] = preload
+
+    r2 = LocalR2(r2_root)
+    boto3 = types.ModuleType("boto3")
+    boto3.client = lambda *args, **kwargs: r2
+    sys.modules['boto3'] = boto3
+    return r2
+
+
+CREDS = {"account_id": "local", "access_key_id": "local", "secret_access_key": "local", "bucket_name": "bench"}
+
+
+def run_case(request, engine, r2_root, log_path=None):
+    """Runs one render in this (fresh) process. Returns the measurements."""
+    r2 = isolate(r2_root, log_path)
+
+    import main
+    from media_probe import probe_media
+    from render_timeline import render_canvases
+
+    request = dict(request, engine=engine)
+    started = time.perf_counter()
+    response = main.render_video_logic.get_raw_f()(request, CREDS)
+    wall = time.perf_counter() - started
+
+    result = r2.read_json(f"{request['output_key']}_result.json") or {}
+    status = r2.read_json(f"{request['output_key']}_status.json") or {}
+    trace = result.get('trace') or status.get('trace') or {}
+    canvas = render_canvases(request)[0]
+    output = os.path.join(r2_root, request['output_key'])
+    duration = probe_media(output)['duration'] if os.path.exists(output) else 0
+    frames = int(round((duration or 0) * canvas.fps))
+    stages = [s for s in trace.get('stages', []) if s.get('depth', 0) == 0]
+    encode_wall = sum(s['wall_s'] for s in stages if s['name'] in ('render', 'render_upload'))
+
+    return {
+        "engine_requested": engine,
+        "engine": result.get('engine'),
+        "status": response.get('status'),
+        "error": response.get('error'),
+        "wall_s": round(wall, 3),
+        "frames": frames,
+        "renditions": len(result.get('renditions') or []),
+        "fps": round(frames / wall, 2) if wall else 0,
+        "encode_fps": round(frames / encode_wall, 2) if encode_wall else None,
+        "output_bytes": os.path.getsize(output) if os.path.exists(output) else 0,
+        # Fresh process: lifetime peaks are this run's peaks
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "child_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "stages": {s['name']: s['wall_s'] for s in stages},
+        "trace": trace
+    }
+
+
+def _serve(directory):
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _print_report(runs):
+    stage_names = []
+    for run in runs:
+        for name in run['stages']:
+            if name not in stage_names: stage_names.append(name)
+    header = ["engine", "status", "wall_s", "frames", "fps", "encode_fps", "peak_rss_mb", "child_peak_rss_mb"] + stage_names
+    rows = []
+    for run in runs:
+        engine = run['engine_requested'] + (f"->{run['engine']}" if run['engine'] and run['engine'] != run['engine_requested'] else "")
+        rows.append([engine, run['status'], run['wall_s'], run['frames'], run['fps'], run['encode_fps'],
+                     run['peak_rss_mb'], run['child_peak_rss_mb']] + [run['stages'].get(n, "") for n in stage_names])
+    widths = [max(len(str(v)) for v in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+    for run in runs:
+        if run['error']:
+            print(f"{run['engine_requested']}: {run['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of render_video_logic on synthetic timelines.")
+    parser.add_argument("--clips", type=int, default=2, help="background video clips (played back to back)")
+    parser.add_argument("--subs", type=int, default=len(ANIMATIONS), help="subtitle tracks, cycling through the animations")
+    parser.add_argument("--images", type=int, default=2, help="image overlays (alternating photo / transparent bubble)")
+    parser.add_argument("--audio", type=int, default=2, help="audio tracks mixed over the clips' own audio")
+    parser.add_argument("--duration", type=float, default=12.0, help="timeline seconds (minus --trim per clip)")
+    parser.add_argument("--trim", type=float, default=0.0,
+                        help="source seconds skipped at the start of each clip; with --subs 0 --images 0 the timeline is cut-only (stream copy)")
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=1920)
+    parser.add_argument("--engines", nargs="+", default=["ffmpeg", "moviepy"], choices=["auto", "ffmpeg", "moviepy"])
+    parser.add_argument("--animations", choices=["all", "graph"], default="all",
+                        help="all: every animation (engine=ffmpeg falls back to MoviePy); graph: only FFmpeg-graph animations")
+    parser.add_argument("--captions", choices=["bitmap", "ass"], default="bitmap",
+                        help="bitmap: a Pillow layer per subtitle; ass: one libass script burned in while encoding")
+    parser.add_argument("--no-stream-copy", action="store_true", help="render cut-only timelines instead of stream-copying them")
+    parser.add_argument("--formats", nargs="*", default=[], help="extra renditions, e.g. 1080x1080 1920x1080")
+    parser.add_argument("--preview", action="store_true")
+    parser.add_argument("--stream-upload", action="store_true")
+    parser.add_argument("--segment-cache", action="store_true")
+    parser.add_argument("--warm-cache", action="store_true", help="reuse asset URLs between runs (asset cache hits after the first)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--work-dir", default="/tmp/shortsalpha_bench")
+    parser.add_argument("--json", help="write every run (with its full trace) to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the render logs instead of writing them to {work-dir}/logs")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    media_dir = os.path.join(args.work_dir, "media")
+    print(f"Generating test media in {media_dir}...")
+    files = build_media(media_dir, max(1, args.clips), args.images, args.audio, args.duration, args.width, args.height)
+    server = _serve(media_dir)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    log_dir = os.path.join(args.work_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    runs = []
+    # spawn: a clean interpreter per run (no shared caches, honest peak RSS)
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for repeat in range(args.repeat):
+            for engine in args.engines:
+                request = build_timeline(files, base_url, args, None if args.warm_cache else uuid.uuid4().hex[:12])
+                print(f"Run {repeat + 1}/{args.repeat}: engine={engine}, {len(request['video_tracks'])} video, "
+                      f"{len(request['text_tracks'])} text, {len(request['audio_tracks'])} audio tracks, {args.duration}s")
+                log_path = None if args.verbose else os.path.join(log_dir, f"run_{repeat}_{engine}.log")
+                with ctx.Pool(1) as pool:
+                    run = pool.apply(run_case, (request, engine, os.path.join(args.work_dir, "r2"), log_path))
+                run['repeat'] = repeat
+                run['log'] = log_path
+                runs.append(run)
+    finally:
+        server.shutdown()
+
+    print()
+    _print_report(runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": runs}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# Offline cold-start benchmark.
+# Every run is a fresh interpreter (like a new container) that imports main.py and
+# calls one Modal function's body as its first job. Columns:
+#   python_s     spawn -> interpreter running our code
+#   import_s     `import main`, including the function's image.imports() preloads. This is the
+#                part a memory snapshot restores instead of re-running.
+#   first_s      spawn -> the function's first useful output:
+#                  render_video_logic   first encoded frame (trace mark "first_frame")
+#                  render_slice_logic   first slice returned
+#                  everything else      its own imports done (the work needs Gemini/TTS/uploads)
+#   done_s       spawn -> the call returned (renders only)
+# Renders use bench_render's synthetic media, a local HTTP server and LocalR2.
+#
+#   python backend/bench_startup.py
+#   python backend/bench_startup.py --functions render_video_logic --engines ffmpeg moviepy --repeat 3
+#
+# Needs ffmpeg and the backend requirements; modules missing locally are reported, not faked.
+import os
+import json
+import time
+import uuid
+import argparse
+import importlib
+import multiprocessing
+
+import bench_render
+
+# Modules each function imports on entry, beyond what main.py preloads
+HANDLER_IMPORTS = {
+    "generate_speech": ("edge_tts", "media_probe", "tracing", "workspace"),
+    "generate_subtitles_logic": ("google.generativeai", "asset_downloader", "asset_cache", "audio_mixer", "tracing", "workspace"),
+    "process_video_logic": ("ffmpeg", "boto3", "google.generativeai", "asset_downloader", "asset_cache", "tracing", "workspace"),
+    "analyze_faces": ("cv2", "mediapipe", "tracing")
+}
+# main.py preload group of each function's image (none: imports everything on entry)
+PRELOADS = {"generate_speech": "ai", "generate_subtitles_logic": "ai", "process_video_logic": None, "analyze_faces": None}
+RENDER_FUNCTIONS = ("render_video_logic", "render_slice_logic")
+FUNCTIONS = RENDER_FUNCTIONS + tuple(HANDLER_IMPORTS)
+SLICE_SECONDS = 2.0 # Window rendered by the render_slice_logic run
+
+
+def cold_start(function, engine, request, r2_root, spawned, log_path=None):
+    """First job of a fresh process. Returns the measurements."""
+    entered = time.time()
+    r2 = bench_render.isolate(r2_root, log_path, PRELOADS.get(function, "render"))
+    run = {"function": function, "engine": engine, "status": "ok", "error": None,
+           "python_s": round(entered - spawned, 3), "import_s": None, "first_s": None, "done_s": None}
+
+    started = time.perf_counter()
+    import main
+    run['import_s'] = round(time.perf_counter() - started, 3)
+
+    if function == "render_video_logic":
+        called = time.time()
+        response = main.render_video_logic.get_raw_f()(dict(request, engine=engine), bench_render.CREDS)
+        run['done_s'] = round(time.time() - spawned, 3)
+        run['status'] = response.get('status')
+        run['error'] = response.get('error')
+        trace = (r2.read_json(f"{request['output_key']}_result.json") or {}).get('trace') or {}
+        first_frame = (trace.get('marks') or {}).get('first_frame')
+        if first_frame is not None:
+            # Trace time starts a few ms after the call (R2 client setup)
+            run['first_s'] = round(called - spawned + first_frame, 3)
+        run['cold'] = trace.get('cold')
+    elif function == "render_slice_logic":
+        window = [0.0, min(SLICE_SECONDS, max(t['start'] + t['duration'] for t in request['video_tracks']))]
+        try:
+            main.render_slice_logic.get_raw_f()(window, request, engine)
+            run['first_s'] = run['done_s'] = round(time.time() - spawned, 3)
+        except Exception as e:
+            run['status'], run['error'] = "failed", str(e)
+    else:
+        missing = []
+        for module in HANDLER_IMPORTS[function]:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                missing.append(module)
+        run['first_s'] = round(time.time() - spawned, 3)
+        if missing:
+            run['status'], run['error'] = "incomplete", f"not installed here: {', '.join(missing)}"
+    return run
+
+
+def _print_report(runs):
+    header = ["function", "engine", "status", "python_s", "import_s", "first_s", "done_s"]
+    rows = [[run['function'], run['engine'] or "", run['status'], run['python_s'], run['import_s'],
+             "" if run['first_s'] is None else run['first_s'], "" if run['done_s'] is None else run['done_s']] for run in runs]
+    widths = [max(len(str(v)) for v in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+    for run in runs:
+        if run['error']:
+            print(f"{run['function']}: {run['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline cold-start benchmark: fresh process -> first output, per Modal function.")
+    parser.add_argument("--functions", nargs="+", default=list(FUNCTIONS), choices=FUNCTIONS)
+    parser.add_argument("--engines", nargs="+", default=["ffmpeg"], choices=["auto", "ffmpeg", "moviepy"], help="for the render functions")
+    parser.add_argument("--duration", type=float, default=6.0, help="timeline seconds of the render runs")
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=1920)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--work-dir", default="/tmp/shortsalpha_bench")
+    parser.add_argument("--json", help="write every run to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the job logs instead of writing them to {work-dir}/logs")
+    args = parser.parse_args()
+
+    # A small timeline with only graph animations: the point is start-up, not encoding
+    timeline_args = argparse.Namespace(
+        duration=args.duration, subs=2, animations="graph", preview=False, stream_upload=False,
+        segment_cache=False, captions="bitmap", trim=0.0, no_stream_copy=False, formats=[], width=args.width, height=args.height
+    )
+    media_dir = os.path.join(args.work_dir, "media")
+    print(f"Generating test media in {media_dir}...")
+    files = bench_render.build_media(media_dir, 1, 1, 1, args.duration, args.width, args.height)
+    server = bench_render._serve(media_dir)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    log_dir = os.path.join(args.work_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    runs = []
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for repeat in range(args.repeat):
+            for function in args.functions:
+                for engine in (args.engines if function in RENDER_FUNCTIONS else [None]):
+                    # New URLs every run: a cold container also starts with a cold asset cache
+                    request = bench_render.build_timeline(files, base_url, timeline_args, uuid.uuid4().hex[:12])
+                    print(f"Run {repeat + 1}/{args.repeat}: {function}" + (f" engine={engine}" if engine else ""))
+                    log_path = None if args.verbose else os.path.join(log_dir, f"startup_{repeat}_{function}_{engine}.log")
+                    spawned = time.time()
+                    with ctx.Pool(1) as pool:
+                        run = pool.apply(cold_start, (function, engine, request, os.path.join(args.work_dir, "r2"), spawned, log_path))
+                    run['repeat'] = repeat
+                    run['log'] = log_path
+                    runs.append(run)
+    finally:
+        server.shutdown()
+
+    print()
+    _print_report(runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": runs}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
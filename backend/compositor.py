@@ -0,0 +1,193 @@
+# Frame compositing helpers for the MoviePy engine.
+# MoviePy's CompositeVideoClip checks clip.is_playing(t) for EVERY layer on
+# EVERY frame. Word-by-word captions put hundreds of layers on a timeline while
+# only a few are visible at once, so the active set is precomputed here.
+from bisect import bisect_left, bisect_right
+
+
+class ClipIntervalIndex:
+    """
+    Active-clip lookup over [start, end) intervals (MoviePy is_playing semantics).
+    The timeline is cut at every clip start/end into elementary intervals; each
+    interval stores the clips playing in it, in the original (draw) order.
+    Lookup is one bisect per frame.
+    """
+
+    def __init__(self, clips):
+        bounds = sorted({c.start for c in clips} | {c.end for c in clips if c.end is not None})
+        active = [[] for _ in bounds]
+        for clip in clips: # List order = layering order, keep it
+            lo = bisect_left(bounds, clip.start)
+            hi = len(bounds) if clip.end is None else bisect_left(bounds, clip.end)
+            for i in range(lo, hi):
+                active[i].append(clip)
+        self.bounds = bounds
+        self.active = active
+
+    def playing(self, t):
+        i = bisect_right(self.bounds, t) - 1
+        return self.active[i] if i >= 0 else []
+
+
+def index_composite(composite):
+    """
+    Swaps a CompositeVideoClip's per-frame linear scan for a ClipIntervalIndex.
+    Its make_frame calls self.playing_clips(t), so an instance attribute is enough.
+    """
+    index = ClipIntervalIndex(composite.clips)
+    scan = composite.playing_clips
+
+    def playing_clips(t=0):
+        if not isinstance(t, (int, float)):
+            return scan(t) # Vectorized t (numpy array): keep MoviePy's behaviour
+        return index.playing(t)
+
+    composite.playing_clips = playing_clips
+    print(f"Compositor index: {len(composite.clips)} layers, {len(index.bounds)} boundaries, "
+          f"max {max((len(a) for a in index.active), default=0)} active")
+    return composite
+
+
+# --- FRAME WRITER ---
+# MoviePy's blit copies the whole canvas (+im2) and allocates float masks for
+# every layer on every frame. FrameCompositor keeps one uint8 canvas and one
+# float32 scratch frame, blends each layer only inside its bounding rectangle,
+# and the canvas goes straight into ffmpeg's stdin as rawvideo.
+
+POSITION_SHORTCUTS = {
+    'center': ['center', 'center'],
+    'left': ['left', 'center'],
+    'right': ['right', 'center'],
+    'top': ['center', 'top'],
+    'bottom': ['center', 'bottom']
+}
+
+
+def layer_position(clip, ct, frame_w, frame_h, img_w, img_h):
+    # Same resolution rules as MoviePy's VideoClip.blit_on (incl. int() truncation)
+    pos = clip.pos(ct)
+    pos = list(POSITION_SHORTCUTS[pos]) if isinstance(pos, str) else list(pos)
+
+    if clip.relative_pos:
+        for i, dim in enumerate([frame_w, frame_h]):
+            if not isinstance(pos[i], str):
+                pos[i] = dim * pos[i]
+
+    if isinstance(pos[0], str):
+        pos[0] = {'left': 0, 'center': (frame_w - img_w) / 2, 'right': frame_w - img_w}[pos[0]]
+    if isinstance(pos[1], str):
+        pos[1] = {'top': 0, 'center': (frame_h - img_h) / 2, 'bottom': frame_h - img_h}[pos[1]]
+    return int(pos[0]), int(pos[1])
+
+
+class FrameCompositor:
+    """Composites a CompositeVideoClip's layers into a reused canvas (same math as MoviePy's blit)."""
+
+    def __init__(self, composite):
+        import numpy as np
+
+        self.np = np
+        self.composite = composite
+        w, h = composite.size
+        self.size = (w, h)
+        self.canvas = np.zeros((h, w, 3), dtype=np.uint8)
+        self.scratch = np.empty((h, w, 3), dtype=np.float32)
+
+    def frame(self, t):
+        """Returns the canvas with the frame at time t. The same array is reused for every frame."""
+        np = self.np
+        np.copyto(self.canvas, self.composite.bg.get_frame(t), casting='unsafe')
+        for clip in self.composite.playing_clips(t):
+            self._blend(clip, t)
+        return self.canvas
+
+    def _blend(self, clip, t):
+        np = self.np
+        frame_w, frame_h = self.size
+        ct = t - clip.start # clip time
+
+        img = clip.get_frame(ct)
+        mask = clip.mask.get_frame(ct) if clip.mask else None
+        if mask is not None and img.shape[:2] != mask.shape[:2]:
+            img = clip.fill_array(img, mask.shape)
+
+        img_h, img_w = img.shape[:2]
+        xp, yp = layer_position(clip, ct, frame_w, frame_h, img_w, img_h)
+
+        # Clip the layer rectangle to the canvas
+        x1, y1 = max(0, -xp), max(0, -yp)
+        xp1, yp1 = max(0, xp), max(0, yp)
+        xp2, yp2 = min(frame_w, xp + img_w), min(frame_h, yp + img_h)
+        if xp1 >= xp2 or yp1 >= yp2:
+            return
+        x2, y2 = x1 + (xp2 - xp1), y1 + (yp2 - yp1)
+
+        region = self.canvas[yp1:yp2, xp1:xp2]
+        src = img[y1:y2, x1:x2]
+        if img.ndim == 2:
+            src = src[:, :, None]
+
+        if mask is None:
+            np.copyto(region, src, casting='unsafe')
+            return
+
+        # region = region + mask * (src - region), truncated to uint8 like MoviePy
+        blend = self.scratch[:yp2 - yp1, :xp2 - xp1]
+        np.subtract(src, region, out=blend, dtype=np.float32)
+        blend *= mask[y1:y2, x1:x2, None]
+        blend += region
+        np.copyto(region, blend, casting='unsafe')
+
+
+def write_composite(composite, output_path, fps, ffmpeg_params, window=None, audio_path=None, progress=None, clock=None):
+    """
+    Encodes a CompositeVideoClip through FrameCompositor into an ffmpeg rawvideo pipe
+    (same encoder command MoviePy's write_videofile builds).
+    window: (t0, t1) renders only that part; audio_path (encoded soundtrack) is already cut to it.
+    progress: optional progress(frames_done, total_frames), called after every frame.
+    clock: optional clock(t) called before every frame (video_readers.DecoderPool.advance).
+    """
+    import subprocess
+    import numpy as np
+
+    t0, t1 = window if window is not None else (0, composite.duration)
+    # Same frame times as MoviePy's iter_frames on (a subclip of) the composite
+    times = np.arange(0, t1 - t0, 1.0 / fps) + t0
+
+    compositor = FrameCompositor(composite)
+    w, h = compositor.size
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-vcodec', 'rawvideo', '-s', f'{w}x{h}', '-pix_fmt', 'rgb24',
+        '-r', '%.02f' % fps, '-an', '-i', '-'
+    ]
+    if audio_path:
+        cmd += ['-i', audio_path, '-acodec', 'copy']
+    cmd += ['-vcodec', 'libx264', '-preset', 'ultrafast'] + list(ffmpeg_params) + ['-threads', '16']
+    if w % 2 == 0 and h % 2 == 0:
+        cmd += ['-pix_fmt', 'yuv420p']
+    cmd.append(output_path)
+
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for n, t in enumerate(times):
+            if clock is not None:
+                clock(t)
+            proc.stdin.write(compositor.frame(t))
+            if progress is not None:
+                progress(n + 1, len(times))
+    except BrokenPipeError:
+        pass # ffmpeg died - its stderr says why
+    except Exception:
+        proc.kill()
+        raise
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = proc.stderr.read()
+        proc.wait()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg rawvideo encode failed: {stderr.decode(errors='replace')[-2000:]}")
@@ -0,0 +1,464 @@
+# FFmpeg filter-graph render engine.
+# Compiles the RenderRequest timeline into ONE filter_complex (scale/crop/overlay
+# with enable windows) so decoding, compositing and encoding all run inside
+# ffmpeg's multithreaded pipeline instead of MoviePy's per-frame Python loop.
+# The soundtrack is mixed beforehand by audio_mixer and muxed in as-is.
+# Layout rules mirror moviepy_engine exactly (see render_timeline).
+import os
+import math
+import shutil
+import subprocess
+import tempfile
+
+from render_timeline import DEFAULT_CANVAS, is_image_track, has_custom_layout, resolve_custom_layout, text_anchor, video_clip_span, timeline_duration, background_video_filter, track_offset
+from text_raster import resolve_text_style, render_text_png
+from media_probe import probe_media
+from ass_subtitles import caption_filter
+from animations import text_transform, animation_seed
+import audio_mixer
+
+# Animations the graph can express with overlay/fade expressions.
+# pop/typewriter (per-frame resample) and swing (per-frame rotate + expand) stay on MoviePy.
+GRAPH_ANIMATIONS = (None, '', 'none', 'fade', 'slide_up', 'bounce', 'shake', 'glitch')
+
+# Same encoder settings as the MoviePy path (Maximum iOS Compatibility)
+VIDEO_ENCODE_ARGS = [
+    '-c:v', 'libx264', '-preset', 'ultrafast',
+    '-pix_fmt', 'yuv420p', '-profile:v', 'baseline', '-level', '3.0',
+    '-movflags', '+faststart'
+] # + ['-r', canvas fps] (see build_command)
+
+
+class GraphUnsupported(Exception):
+    """Raised when a timeline needs an effect only the MoviePy engine can render."""
+
+
+def unsupported_features(video_items, text_tracks, captions='bitmap'):
+    """Returns human readable reasons why this timeline can't be compiled to a graph ([] = supported)."""
+    reasons = []
+    # ASS captions animate inside libass, whatever the animation
+    for track in (text_tracks if captions != 'ass' else []):
+        style = track.get('style', {}) or {}
+        anim = style.get('animation')
+        if anim not in GRAPH_ANIMATIONS:
+            reasons.append(f"text animation '{anim}'")
+    for track_data, local_path in video_items:
+        if not is_image_track(track_data, local_path) and not probe_media(local_path)['has_video']:
+            reasons.append(f"unreadable video {os.path.basename(local_path)}")
+    return sorted(set(reasons))
+
+
+def _num(val):
+    # Compact float formatting for filter expressions
+    return f"{float(val):.4f}".rstrip('0').rstrip('.')
+
+
+def _position_exprs(position):
+    # MoviePy semantics: numbers are the top-left corner, "center" centers on the canvas
+    pos_x, pos_y = position
+    x = "(main_w-overlay_w)/2" if pos_x == "center" else str(int(pos_x))
+    y = "(main_h-overlay_h)/2" if pos_y == "center" else str(int(pos_y))
+    return x, y
+
+
+def _prepare_image(track_data, local_path, work_dir, idx, canvas):
+    """
+    Applies the static layout (resize + rotation) to an image ONCE with Pillow,
+    so the graph only has to overlay it instead of rescaling every frame.
+    """
+    from PIL import Image
+
+    layout = resolve_custom_layout(track_data, canvas)
+    img = Image.open(local_path).convert('RGBA')
+
+    size = layout['size']
+    if size is not None:
+        w, h = img.size
+        if size[0] == 'box':
+            new_size = (int(size[1]), int(size[2]))
+        elif size[0] == 'width':
+            new_size = (int(size[1]), int(h * size[1] / w))
+        elif size[0] == 'height':
+            new_size = (int(w * size[1] / h), int(size[1]))
+        else:
+            new_size = (int(w * size[1]), int(h * size[1]))
+        img = img.resize((max(1, new_size[0]), max(1, new_size[1])), Image.LANCZOS)
+
+    if layout['rotation'] != 0:
+        img = img.rotate(layout['rotation'], expand=True, resample=Image.BICUBIC)
+
+    out_path = os.path.join(work_dir, f"layer_{idx}.png")
+    img.save(out_path)
+    return out_path, layout['position']
+
+
+def _video_geometry(track_data, canvas):
+    """Returns (filter chain, position) for a video layer."""
+    if not has_custom_layout(track_data, False):
+        # BACKGROUND VIDEO SPECS: cover-scale to fill the canvas, crop centered horizontally, top aligned
+        return background_video_filter(canvas), (0, 0)
+
+    layout = resolve_custom_layout(track_data, canvas)
+    filters = []
+    size = layout['size']
+    if size is not None:
+        if size[0] == 'box':
+            filters.append(f"scale={int(size[1])}:{int(size[2])}")
+        elif size[0] == 'width':
+            filters.append(f"scale={int(size[1])}:-1")
+        elif size[0] == 'height':
+            filters.append(f"scale=-1:{int(size[1])}")
+        else:
+            filters.append(f"scale=iw*{_num(size[1])}:ih*{_num(size[1])}")
+
+    if layout['rotation'] != 0:
+        # MoviePy rotates counter-clockwise, ffmpeg clockwise
+        angle = f"{_num(-float(layout['rotation']))}*PI/180"
+        filters.append(f"format=rgba,rotate={angle}:ow=rotw({angle}):oh=roth({angle}):c=none")
+
+    filters.append("setsar=1")
+    return ",".join(filters), layout['position']
+
+
+def _glitch_jumps(start, visible, seed, canvas):
+    # {timeline frame: (dx, dy)} of the visible frames where animations.text_transform jumps
+    fps = canvas.fps
+    first = int(math.ceil(visible[0] * fps - 1e-6))
+    last = int(math.ceil(visible[1] * fps - 1e-6))
+    jumps = {}
+    for n in range(first, last):
+        dx, dy = text_transform('glitch', n / fps - start, seed, canvas.scale, fps)[:2]
+        if dx or dy:
+            jumps[n] = (dx, dy)
+    return jumps
+
+
+def _text_position_exprs(anim, pos_x, pos_y, start, canvas, t0=0.0, seed=0, visible=None):
+    """
+    Overlay x/y expressions replicating moviepy_engine text animations (t is output time, start = clip start in output time).
+    Pixel offsets are scaled with the canvas (see animations.text_transform).
+    t0: timeline time of output time 0; visible: (start, end) timeline span drawn (glitch only).
+    """
+    fx = f"{_num(pos_x * canvas.w)}-overlay_w/2"
+    fy = f"{_num(pos_y * canvas.h)}-overlay_h/2"
+    lt = f"(t-({_num(start)}))" # clip-local time
+    px = lambda val: _num(val * canvas.scale)
+
+    if anim == 'slide_up':
+        return fx, f"{fy}+{px(50)}*max(0,1-{lt}/0.3)"
+    if anim == 'bounce':
+        return fx, f"{fy}-{px(80)}*abs(sin(3*{lt}))"
+    if anim == 'shake':
+        return f"{fx}+{px(20)}*sin(20*{lt})", fy
+    if anim == 'glitch':
+        # Jump every 0.1s. The offsets are the MoviePy ones (seeded per track and timeline
+        # frame), looked up by timeline frame: any window, slice or segment draws the same
+        # frames (ffmpeg's random() restarts with every process)
+        frame = f"round((t+{_num(t0)})*{_num(canvas.fps)})"
+        jumps = _glitch_jumps(start + t0, visible or (start + t0, start + t0), seed, canvas)
+        x_terms = "".join(f"+eq({frame},{n})*({_num(dx)})" for n, (dx, _) in jumps.items() if dx)
+        y_terms = "".join(f"+eq({frame},{n})*({_num(dy)})" for n, (_, dy) in jumps.items() if dy)
+        return fx + x_terms, fy + y_terms
+    return fx, fy
+
+
+def shared_decodes(video_items, window):
+    """
+    Video tracks that can share one decode: same file, same source/timeline alignment
+    (offset - start) and overlapping visible spans (split-screen crops of one source).
+    Returns {idx: (leader_idx, union_start, union_end, members, rank)} for groups of 2+;
+    the leader is the group's first track, rank is the track's position in the group.
+    """
+    t0, t1 = window
+    groups = {}
+    for idx, (track_data, local_path) in enumerate(video_items):
+        if is_image_track(track_data, local_path): continue
+        span = video_clip_span(track_data, local_path)
+        if span is None: continue
+        vis_start, vis_end = max(span[0], t0), min(span[1], t1)
+        if vis_end <= vis_start: continue
+        key = (os.path.realpath(local_path), round(track_offset(track_data) - span[0], 6))
+        groups.setdefault(key, []).append((vis_start, vis_end, idx))
+
+    shared = {}
+    for spans in groups.values():
+        clusters = [] # [union_start, union_end, [idx...]]
+        for vis_start, vis_end, idx in sorted(spans):
+            if clusters and vis_start < clusters[-1][1]:
+                clusters[-1][1] = max(clusters[-1][1], vis_end)
+                clusters[-1][2].append(idx)
+            else:
+                clusters.append([vis_start, vis_end, [idx]])
+        for union_start, union_end, members in clusters:
+            if len(members) < 2: continue
+            members = sorted(members)
+            for rank, idx in enumerate(members):
+                shared[idx] = (members[0], union_start, union_end, len(members), rank)
+    return shared
+
+
+def build_video_graph(video_items, text_tracks, work_dir, window, canvases=(DEFAULT_CANVAS,), captions='bitmap'):
+    """
+    Compiles the visual layers into filter_complex statements, restricted to
+    window = (t0, t1) of the timeline. Output time 0 == timeline time t0.
+    canvases: one render_timeline.Canvas per rendition. Every video source is
+    decoded ONCE and split into a scale/crop/overlay branch per canvas - and per
+    track, when several tracks show the same source at once (see shared_decodes).
+    captions: 'bitmap' overlays a Pillow PNG per text track, 'ass' burns one
+    ASS script per canvas on top of the composite (see ass_subtitles).
+    Returns (inputs, graph, out_labels) with one label per canvas.
+    Raises GraphUnsupported if a layer can't be expressed.
+    """
+    t0, t1 = window
+    inputs = []   # one ffmpeg arg list per input
+    chains = []   # filter_complex statements producing overlay layers
+    overlays = [[] for _ in canvases] # per canvas: (label, x, y, start, end) in output time
+
+    def add_input(args):
+        inputs.append(args)
+        return len(inputs) - 1
+
+    def clip_to_window(start, end):
+        # Visible part of [start, end) inside the window, or None
+        vis_start, vis_end = max(start, t0), min(end, t1)
+        return (vis_start, vis_end) if vis_end > vis_start else None
+
+    shared = shared_decodes(video_items, window)
+    if shared:
+        print(f"Shared decodes: {len(shared)} video tracks on {len({g[0] for g in shared.values()})} sources")
+
+    # 1. Video / Image Tracks (already layer-sorted)
+    for idx, (track_data, local_path) in enumerate(video_items):
+        span = video_clip_span(track_data, local_path)
+        if span is None:
+            print(f"Failed to load clip {local_path}: no video stream")
+            continue
+        start = span[0]
+        visible = clip_to_window(*span)
+        if visible is None: continue
+        vis_start, vis_end = visible
+
+        if is_image_track(track_data, local_path):
+            # Stills are cheap: one prepared PNG per canvas
+            try:
+                prepared = [_prepare_image(track_data, local_path, work_dir, f"{idx}_{c}", canvas) for c, canvas in enumerate(canvases)]
+            except Exception as e:
+                print(f"Failed to load clip {local_path}: {e}")
+                continue
+            for c, (canvas, (img_path, position)) in enumerate(zip(canvases, prepared)):
+                label = f"v{idx}_{c}"
+                i = add_input(['-loop', '1', '-framerate', str(canvas.fps), '-t', _num(vis_end - vis_start), '-i', img_path])
+                chains.append(f"[{i}:v]format=rgba,setpts=PTS-STARTPTS+{_num(vis_start - t0)}/TB[{label}]")
+                x, y = _position_exprs(position)
+                overlays[c].append((label, x, y, vis_start - t0, vis_end - t0))
+        elif idx in shared:
+            # One decode of the group's union span, split into a branch per track and canvas;
+            # each branch cuts its own part and applies its own geometry
+            leader, union_start, union_end, members, rank = shared[idx]
+            if idx == leader:
+                seek_to = track_offset(track_data) + (union_start - start)
+                seek = ['-ss', _num(seek_to)] if seek_to > 0 else []
+                i = add_input(seek + ['-i', local_path])
+                n = members * len(canvases)
+                chains.append(
+                    f"[{i}:v]trim=duration={_num(union_end - union_start)},setpts=PTS-STARTPTS,split={n}"
+                    + "".join(f"[sh{leader}_{k}]" for k in range(n))
+                )
+            cut = ""
+            if vis_start > union_start or vis_end < union_end:
+                cut = f"trim=start={_num(vis_start - union_start)}:duration={_num(vis_end - vis_start)},setpts=PTS-STARTPTS,"
+            for c, canvas in enumerate(canvases):
+                label = f"v{idx}_{c}"
+                geometry, position = _video_geometry(track_data, canvas)
+                chains.append(f"[sh{leader}_{rank * len(canvases) + c}]{cut}{geometry},setpts=PTS+{_num(vis_start - t0)}/TB[{label}]")
+                x, y = _position_exprs(position)
+                overlays[c].append((label, x, y, vis_start - t0, vis_end - t0))
+        else:
+            # Input seek (nearest keyframe, then decode-and-discard) straight to the
+            # first visible source frame: track offset + part hidden before the window
+            seek_to = track_offset(track_data) + (vis_start - start)
+            seek = ['-ss', _num(seek_to)] if seek_to > 0 else []
+            i = add_input(seek + ['-i', local_path])
+            decoded = f"[{i}:v]trim=duration={_num(vis_end - vis_start)},setpts=PTS-STARTPTS"
+            if len(canvases) == 1:
+                branches = [decoded]
+            else:
+                chains.append(f"{decoded},split={len(canvases)}" + "".join(f"[s{idx}_{c}]" for c in range(len(canvases))))
+                branches = [f"[s{idx}_{c}]" for c in range(len(canvases))]
+            for c, canvas in enumerate(canvases):
+                label = f"v{idx}_{c}"
+                geometry, position = _video_geometry(track_data, canvas)
+                sep = "," if len(canvases) == 1 else ""
+                chains.append(f"{branches[c]}{sep}{geometry},setpts=PTS+{_num(vis_start - t0)}/TB[{label}]")
+                x, y = _position_exprs(position)
+                overlays[c].append((label, x, y, vis_start - t0, vis_end - t0))
+
+    # 2. Text Tracks (Pillow PNGs overlaid with animated positions; ASS captions are added in 3.)
+    for t_idx, track in enumerate(text_tracks if captions != 'ass' else []):
+        for c, canvas in enumerate(canvases):
+            spec = resolve_text_style(track, canvas)
+            if not spec: break
+
+            start = float(spec['start'])
+            visible = clip_to_window(start, start + float(spec['duration']))
+            if visible is None: break
+            vis_start, vis_end = visible
+
+            img_path = render_text_png(spec, work_dir)
+            if not img_path or not os.path.exists(img_path):
+                raise GraphUnsupported("Pillow text rendering failed (needs MoviePy caption fallback)")
+
+            anim = spec['animation']
+            label = f"t{t_idx}_{c}"
+
+            i = add_input(['-loop', '1', '-framerate', str(canvas.fps), '-t', _num(vis_end - vis_start), '-i', img_path])
+            # Fade runs in clip-local time (it fades colour from black, like MoviePy fadein),
+            # then the layer is shifted to output time.
+            fade = ",fade=t=in:st=0:d=0.3" if anim in ('fade', 'slide_up') else ""
+            chains.append(
+                f"[{i}:v]format=rgba,setpts=PTS-STARTPTS+{_num(vis_start - start)}/TB{fade},"
+                f"setpts=PTS+({_num(start - t0)})/TB[{label}]"
+            )
+
+            pos_x, pos_y = text_anchor(track, spec['style'])
+            x, y = _text_position_exprs(anim, pos_x, pos_y, start - t0, canvas, t0,
+                                        animation_seed(spec['text'], start), (vis_start, vis_end))
+            overlays[c].append((label, x, y, vis_start - t0, vis_end - t0))
+
+    # Nothing visual on the whole timeline -> red placeholder (same as MoviePy path)
+    has_visuals = any(video_clip_span(t, p) for t, p in video_items) or any(t.get('text') for t in text_tracks)
+    if not has_visuals:
+        print("WARNING: No video clips were loaded! Creating a placeholder.")
+    base_color = "black" if has_visuals else "red"
+
+    # 3. Compose (one overlay chain per canvas)
+    graph = [
+        f"color=c={base_color}:s={canvas.w}x{canvas.h}:r={canvas.fps}:d={_num(t1 - t0)},format=yuv420p[base{c}]"
+        for c, canvas in enumerate(canvases)
+    ]
+    graph.extend(chains)
+
+    out_labels = []
+    for c in range(len(canvases)):
+        current = f"base{c}"
+        for n, (label, x, y, start, end) in enumerate(overlays[c]):
+            out = f"o{c}_{n}"
+            graph.append(
+                f"[{current}][{label}]overlay=x='{x}':y='{y}':eof_action=pass:"
+                f"enable='between(t,{_num(start)},{_num(end)})'[{out}]"
+            )
+            current = out
+        if captions == 'ass':
+            chain = caption_filter(text_tracks, canvases[c], work_dir, f"captions{c}", window)
+            if chain:
+                graph.append(f"[{current}]{chain}[cap{c}]")
+                current = f"cap{c}"
+        out_labels.append(current)
+
+    return inputs, graph, out_labels
+
+
+def _write_script(work_dir, name, graph):
+    # Filter graphs with hundreds of layers exceed sane argv sizes -> script file
+    script_path = os.path.join(work_dir, name)
+    with open(script_path, "w") as f:
+        f.write(";\n".join(graph))
+    return script_path
+
+
+def build_command(video_items, audio_items, text_tracks, outputs, work_dir, window=None, audio_path=None, extra_video_args=None, captions='bitmap'):
+    """
+    Compiles the timeline into ONE ffmpeg command with an output file per rendition.
+    outputs: [(canvas, output_path)] (render_timeline.Canvas per rendition).
+    window: (t0, t1) to render only part of the timeline (default: everything).
+    audio_path: the window's premixed soundtrack (audio_mixer), stream-copied into every output.
+    Returns (cmd, duration). Raises GraphUnsupported if a layer can't be expressed.
+    """
+    if window is None:
+        window = (0, timeline_duration(video_items, audio_items, text_tracks))
+    duration = window[1] - window[0]
+    canvases = [canvas for canvas, _ in outputs]
+
+    inputs, graph, v_labels = build_video_graph(video_items, text_tracks, work_dir, window, canvases, captions)
+    audio_map = []
+    if audio_path:
+        # Encoded once by the mixer, copied into each rendition
+        inputs.append(['-i', audio_path])
+        audio_map = ['-map', f"{len(inputs) - 1}:a", '-c:a', 'copy']
+
+    script_path = _write_script(work_dir, "graph.txt", graph)
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error'] + [a for args in inputs for a in args] + \
+          ['-filter_complex_script', script_path]
+    for (canvas, output_path), v_label in zip(outputs, v_labels):
+        # Per-output options go right before each output file
+        cmd += ['-map', f"[{v_label}]"] + \
+               VIDEO_ENCODE_ARGS + ['-r', str(canvas.fps)] + (extra_video_args or []) + \
+               (audio_map or ['-an']) + \
+               ['-t', _num(duration), '-threads', '0', output_path]
+    return cmd, duration
+
+
+def run_ffmpeg(cmd, what="ffmpeg graph render", progress=None, total_frames=0):
+    """
+    Runs an ffmpeg command, raising with the tail of stderr on failure.
+    progress: optional progress(frames_done, total_frames), fed from ffmpeg's -progress key=value stream.
+    """
+    if progress is None:
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{what} failed: {proc.stderr[-2000:]}")
+        return
+
+    # stderr goes to a file: only stdout (progress) is read while ffmpeg runs, so no pipe can fill up
+    with tempfile.TemporaryFile(mode="w+") as err:
+        proc = subprocess.Popen(cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:],
+                                stdout=subprocess.PIPE, stderr=err, text=True)
+        for line in proc.stdout:
+            if line.startswith('frame='):
+                try:
+                    progress(int(line[6:]), total_frames)
+                except ValueError:
+                    pass
+        proc.wait()
+        if proc.returncode != 0:
+            err.seek(0)
+            raise RuntimeError(f"{what} failed: {err.read()[-2000:]}")
+
+
+def render(video_items, audio_items, text_tracks, output_path, update_status, window=None, include_audio=True, extra_video_args=None, canvas=DEFAULT_CANVAS, progress=None, captions='bitmap', work_dir=None):
+    """
+    Renders the timeline with a single ffmpeg process.
+    video_items / audio_items: [(track_data, local_path)] (video_items already layer-sorted).
+    """
+    render_renditions(video_items, audio_items, text_tracks, [(canvas, output_path)], update_status,
+                      window=window, include_audio=include_audio, extra_video_args=extra_video_args, progress=progress,
+                      captions=captions, work_dir=work_dir)
+
+
+def render_renditions(video_items, audio_items, text_tracks, outputs, update_status, window=None, include_audio=True, extra_video_args=None, progress=None, captions='bitmap', work_dir=None):
+    """
+    Renders every rendition in outputs = [(canvas, output_path)] with a single ffmpeg
+    process: sources are decoded once, each canvas gets its own overlay + encode branch.
+    progress: optional progress(frames_done, total_frames) while encoding (renditions advance together).
+    work_dir: where the render's scratch directory goes (the job's workspace; default: the system temp dir).
+    """
+    scratch_dir = tempfile.mkdtemp(prefix="ffgraph_", dir=work_dir)
+    try:
+        if window is None:
+            window = (0, timeline_duration(video_items, audio_items, text_tracks))
+        audio_path = None
+        if include_audio:
+            update_status("Mixing audio...", 55)
+            audio_path = os.path.join(scratch_dir, "audio.m4a")
+            if not audio_mixer.render_audio(video_items, audio_items, audio_path, window=window):
+                audio_path = None
+
+        update_status("Compiling render graph...", 60)
+        cmd, duration = build_command(video_items, audio_items, text_tracks, outputs, scratch_dir,
+                                      window=window, audio_path=audio_path, extra_video_args=extra_video_args, captions=captions)
+        print(f"FFmpeg Graph Engine: {len(cmd)} args, duration {duration:.2f}s, {len(outputs)} rendition(s)")
+
+        update_status("Encoding final video (this may take a while)...", 75)
+        run_ffmpeg(cmd, progress=progress, total_frames=int(round(duration * outputs[0][0].fps)))
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
@@ -8,29 +8,74 @@ from fastapi import UploadFile, File, Form
 
 # Modal Image Definition
 # We use standard system fonts for image build, but EMBED custom fonts explicitly.
-# ORDER MATTERS: run_commands must happen BEFORE add_local_file
-image = modal.Image.debian_slim() \
+# ORDER MATTERS: no build step (run_commands, env...) can follow an add_local_* layer unless its
+# files are copied into the image (copy=True). The fonts are copied; the backend sources are
+# mounted, so they go last on every image derived from base_image (see BACKEND_MODULES).
+base_image = modal.Image.debian_slim() \
     .apt_install("ffmpeg", "imagemagick", "fonts-liberation", "fonts-dejavu", "fontconfig", "fonts-freefont-ttf", "fonts-roboto", "fonts-lato", "fonts-open-sans", "wget", "curl", "ca-certificates") \
     .pip_install("google-generativeai", "requests", "ffmpeg-python", "fastapi", "boto3", "moviepy==1.0.3", "imageio==2.33.1", "opencv-python-headless", "numpy<2", "mediapipe", "edge-tts", "python-multipart") \
     .run_commands(
         "sed -i 's/rights=\"none\" pattern=\"@\\*\"/rights=\"read|write\" pattern=\"@*\"/' /etc/ImageMagick-6/policy.xml",
         "wget -O /root/haarcascade_frontalface_default.xml https://raw.githubusercontent.com/opencv/opencv/master/data/haarcascades/haarcascade_frontalface_default.xml"
     ) \
-    .add_local_file("backend/fonts/Anton-Regular.ttf", "/root/fonts/Anton-Regular.ttf") \
-    .add_local_file("backend/fonts/BebasNeue-Regular.ttf", "/root/fonts/BebasNeue-Regular.ttf") \
-    .add_local_file("backend/fonts/Montserrat-Bold.ttf", "/root/fonts/Montserrat-Bold.ttf") \
-    .add_local_file("backend/fonts/Montserrat-Black.ttf", "/root/fonts/Montserrat-Black.ttf") \
-    .add_local_file("backend/fonts/Poppins-Bold.ttf", "/root/fonts/Poppins-Bold.ttf") \
-    .add_local_file("backend/fonts/Lato-Bold.ttf", "/root/fonts/Lato-Bold.ttf") \
-    .add_local_file("backend/fonts/Oswald-Bold.ttf", "/root/fonts/Oswald-Bold.ttf") \
-    .add_local_file("backend/fonts/Raleway-Bold.ttf", "/root/fonts/Raleway-Bold.ttf")
-
-
-
+    .add_local_file("backend/fonts/Anton-Regular.ttf", "/root/fonts/Anton-Regular.ttf", copy=True) \
+    .add_local_file("backend/fonts/BebasNeue-Regular.ttf", "/root/fonts/BebasNeue-Regular.ttf", copy=True) \
+    .add_local_file("backend/fonts/Montserrat-Bold.ttf", "/root/fonts/Montserrat-Bold.ttf", copy=True) \
+    .add_local_file("backend/fonts/Montserrat-Black.ttf", "/root/fonts/Montserrat-Black.ttf", copy=True) \
+    .add_local_file("backend/fonts/Poppins-Bold.ttf", "/root/fonts/Poppins-Bold.ttf", copy=True) \
+    .add_local_file("backend/fonts/Lato-Bold.ttf", "/root/fonts/Lato-Bold.ttf", copy=True) \
+    .add_local_file("backend/fonts/Oswald-Bold.ttf", "/root/fonts/Oswald-Bold.ttf", copy=True) \
+    .add_local_file("backend/fonts/Raleway-Bold.ttf", "/root/fonts/Raleway-Bold.ttf", copy=True) \
+    .run_commands(
+        # Font cache baked into the image (was fc-cache on every fresh container): the custom
+        # fonts are copied in above, linked where fontconfig looks, then indexed once at build
+        "mkdir -p /usr/share/fonts/truetype/custom && ln -sf /root/fonts/*.ttf /usr/share/fonts/truetype/custom/",
+        "fc-cache -f && touch /root/.font_cache_ready"
+    ) \
+    .env({"IMAGEMAGICK_BINARY": "/usr/bin/convert"})
+BACKEND_MODULES = ("render_timeline", "text_raster", "media_probe", "moviepy_engine", "ffmpeg_engine", "asset_downloader", "slice_render", "asset_cache", "compositor", "animations", "video_readers", "streaming_upload", "render_dedup", "segment_cache", "audio_mixer", "status_publisher", "tracing", "workspace", "ass_subtitles", "stream_copy")
+image = base_image.add_local_python_source(*BACKEND_MODULES)
+
+# Shared, content-addressed asset cache (see asset_cache.py).
+# Mounted by every function that pulls track media from R2 / stock URLs.
+asset_cache_volume = modal.Volume.from_name("shortsalpha-asset-cache", create_if_missing=True)
+
+# Inputs a warm container runs at once. Jobs work in their own directory (see workspace.py),
+# so they can share a container: mostly-waiting jobs (TTS, Gemini, downloads, uploads) take
+# many, renders few since encoding is CPU-bound.
+IO_CONCURRENT_INPUTS = 8
+RENDER_CONCURRENT_INPUTS = 2
+
+# Imported once when a container starts instead of inside the first request. Functions with
+# enable_memory_snapshot=True capture the process after this block, so later cold starts
+# restore it instead of importing again. The block runs wherever main.py is imported, so
+# each group only loads in containers whose image asks for it (PRELOAD_ENV): renders get
+# the engines, TTS/subtitles the AI clients, everything else (cleanup, video and face analysis) none.
+PRELOAD_ENV = "SHORTSALPHA_PRELOAD"
+render_image = base_image.env({PRELOAD_ENV: "render"}).add_local_python_source(*BACKEND_MODULES)
+ai_image = base_image.env({PRELOAD_ENV: "ai"}).add_local_python_source(*BACKEND_MODULES)
+
+if os.environ.get(PRELOAD_ENV) == "render":
+    with render_image.imports():
+        import numpy
+        import PIL.Image
+        import boto3
+        import moviepy_engine
+        import ffmpeg_engine
+        import slice_render
+        import segment_cache
+        import asset_downloader
+        moviepy_engine.load_moviepy() # moviepy.editor + the Pillow 10 shim
+elif os.environ.get(PRELOAD_ENV) == "ai":
+    with ai_image.imports():
+        import boto3
+        import google.generativeai
+        import edge_tts
 
 
 # Lightweight Image for Web Endpoints (Fast Cold Start)
-light_image = modal.Image.debian_slim().pip_install("fastapi", "pydantic")
+light_image = modal.Image.debian_slim().pip_install("fastapi", "pydantic", "boto3") \
+    .add_local_python_source("asset_cache", "render_dedup") # Timeline hashing for render de-duplication
 
 app = modal.App("shorts-pilot-backend")
 
@@ -53,15 +98,19 @@ class TTSRequest(BaseModel):
     r2_secret_access_key: str
     r2_bucket_name: str
 
-@app.function(image=image, timeout=600)
+@app.function(image=ai_image, timeout=600, allow_concurrent_inputs=IO_CONCURRENT_INPUTS, enable_memory_snapshot=True)
 @web_endpoint(method="POST")
 async def generate_speech(request: TTSRequest):
     import edge_tts
     import os
     import boto3
-    import uuid
     import traceback
+    from tracing import Trace
+    from workspace import Workspace
     
+    trace = Trace("speech", output_key=request.output_key, voice=request.voice)
+    workspace = Workspace("speech")
+    s3 = None
     try:
         print(f"Generating Speech: {request.text[:50]}... Voice: {request.voice} Speed: {request.speed}")
         
@@ -70,18 +119,19 @@ async def generate_speech(request: TTSRequest):
         rate_str = f"{rate_pct:+d}%"
         
         # 1. Generate Raw Audio
-        raw_output_filename = f"raw_speech_{uuid.uuid4()}.mp3"
-        raw_output_file = f"/tmp/{raw_output_filename}"
+        raw_output_file = workspace.path("raw_speech.mp3")
         
+        span = trace.stage("tts", chars=len(request.text))
         communicate = edge_tts.Communicate(request.text, request.voice, rate=rate_str)
         await communicate.save(raw_output_file)
+        span.add_bytes(os.path.getsize(raw_output_file))
         
         # 2. Add Silence Padding (0.3s) using FFmpeg to prevent cutoff
         import subprocess
         
-        output_filename = f"speech_{uuid.uuid4()}.mp3"
-        output_file = f"/tmp/{output_filename}"
+        output_file = workspace.path("speech.mp3")
         
+        trace.stage("pad")
         try:
             # -af apad=pad_dur=0.3 adds 0.3 seconds of silence at the end
             subprocess.run([
@@ -100,15 +150,14 @@ async def generate_speech(request: TTSRequest):
             import shutil
             shutil.copy(raw_output_file, output_file)
 
-        # Get Duration
-        from moviepy.editor import AudioFileClip
-        try:
-            clip = AudioFileClip(output_file)
-            duration = clip.duration
-            clip.close()
+        # Get Duration (ffprobe: no need to load MoviePy for one number)
+        trace.stage("probe")
+        from media_probe import probe_media
+        duration = probe_media(output_file)['duration']
+        if duration:
             print(f"Generated Audio Duration: {duration}s")
-        except Exception as e:
-            print(f"Failed to get duration: {e}")
+        else:
+            print("Failed to get duration")
             duration = 5 # Fallback
         
         # Upload to R2
@@ -119,21 +168,24 @@ async def generate_speech(request: TTSRequest):
         )
         
         print(f"Uploading to R2: {request.output_key}")
+        span = trace.stage("upload")
+        span.add_bytes(os.path.getsize(output_file))
         with open(output_file, "rb") as f:
             s3.upload_fileobj(f, request.r2_bucket_name, request.output_key, ExtraArgs={'ContentType': 'audio/mpeg'})
             
-        # Cleanup
-        if os.path.exists(raw_output_file): os.remove(raw_output_file)
-        if os.path.exists(output_file): os.remove(output_file)
-            
-        return {"status": "success", "key": request.output_key, "duration": duration}
+        trace.end()
+        return {"status": "success", "key": request.output_key, "duration": duration, "trace": trace.summary()}
 
     except Exception as e:
         print(f"TTS Error: {str(e)}")
         traceback.print_exc()
+        trace.end(e)
         # Return error as JSON with 500 status logic handled by client check
         from fastapi import HTTPException
         raise HTTPException(status_code=500, detail=f"Backend Error: {str(e)}")
+    finally:
+        workspace.close() # Both mp3s, whether or not we got as far as the upload
+        trace.emit(s3, request.r2_bucket_name) # s3 is None if we failed before the upload: log only
 
 class RenderRequest(BaseModel):
     video_tracks: list
@@ -148,6 +200,15 @@ class RenderRequest(BaseModel):
     width: int = 1080
     height: int = 1920
     userId: str = None # Added for History Filtering
+    engine: str = "auto" # "auto" | "ffmpeg" | "moviepy"
+    parallel: bool = False # Render GOP-aligned time slices on separate workers
+    preview: bool = False # Quick look: half resolution / 15fps, same layout
+    stream_upload: bool = False # Upload fragmented MP4 parts while encoding (no full file on disk)
+    formats: list = [] # Extra renditions from the same decode, e.g. [{"width": 1080, "height": 1080}, {"width": 1920, "height": 1080, "output_key": "..."}]
+    segment_cache: bool = False # Keep GOP-aligned segments; re-renders encode only the changed ones (see segment_cache.py)
+    dedup: bool = True # Reuse a finished / in-flight render of the identical timeline (see render_dedup.py)
+    captions: str = "bitmap" # "bitmap" (a Pillow layer per text track) | "ass" (one libass subtitle script burned in while encoding, see ass_subtitles.py)
+    stream_copy: bool = True # Cut-only timelines are stream-copied, re-encoding only the boundary GOPs (see stream_copy.py)
 
 
 
@@ -161,132 +222,69 @@ class SubtitleRequest(BaseModel):
     r2_secret_access_key: str
     r2_bucket_name: str
 
-@app.function(image=image, timeout=600)
+@app.function(image=ai_image, timeout=600, volumes={"/cache": asset_cache_volume}, allow_concurrent_inputs=IO_CONCURRENT_INPUTS, enable_memory_snapshot=True)
 def generate_subtitles_logic(request_data: dict):
     # Imports
-    try:
-        from moviepy.editor import AudioFileClip, CompositeAudioClip
-    except ImportError:
-        from moviepy.audio.io.AudioFileClip import AudioFileClip
-        from moviepy.audio.compositing.CompositeAudioClip import CompositeAudioClip
-
-        from moviepy.audio.compositing.CompositeAudioClip import CompositeAudioClip
-
     import os
-    import requests
     import json
     import google.generativeai as genai
     import time
-    # Note: cv2/numpy not strictly needed for subtitles, but if referenced ensure import
+    from asset_downloader import download_tracks
+    from asset_cache import AssetCache
+    from tracing import Trace
+    from workspace import Workspace
+    import audio_mixer
     
     
     video_tracks = request_data.get('video_tracks', [])
     audio_tracks = request_data.get('audio_tracks', [])
     api_key = request_data.get('api_key')
+    r2_creds = request_data.get('r2_creds')
     
     print("Starting Subtitle Generation...")
     
-    local_assets_dir = "/tmp/assets_subs"
-    os.makedirs(local_assets_dir, exist_ok=True)
-
-    # REUSED DOWNLOAD HELPER
-    def download_asset(url, prefix):
-        ext = ".mp4"
-        if "." in url.split("/")[-1]:
-             possible_ext = "." + url.split("/")[-1].split(".")[-1].split("?")[0]
-             if len(possible_ext) < 5: ext = possible_ext
-        filename = f"{prefix}{ext}"
-        path = os.path.join(local_assets_dir, filename)
-        if os.path.exists(path): return path
-        try:
-            r = requests.get(url, stream=True, timeout=30)
-            r.raise_for_status()
-            with open(path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            return path
-        except Exception as e:
-            print(f"DL Failed: {e}")
-            return None
+    workspace = Workspace("subtitles")
+    local_assets_dir = workspace.dir("assets")
 
-    audio_clips = []
     debug_logs = []
+    trace = Trace("subtitles")
+
+    def traced(result, error=None):
+        # Every response carries the per-stage timings
+        trace.end(error)
+        result["trace"] = trace.summary()
+        return result
     
     try:
-        # 1. Extract Audio from Video Tracks
-        for idx, track in enumerate(video_tracks):
-            url = track.get('url') or track.get('src')
-            if not url: continue
-            path = download_asset(url, f"vid_{idx}")
-            if not path: continue
-
-            # Skip images
-            if path.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.gif')):
-                continue
-            
-            try:
-                # OPTIMIZATION: Use ffmpeg directly
-                import subprocess
-                track_audio_path = path.replace(".mp4", f"_{idx}.mp3")
-                subprocess.run([
-                    "ffmpeg", "-y", "-i", path, "-vn", "-acodec", "libmp3lame", "-q:a", "4", track_audio_path
-                ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                
-                if not os.path.exists(track_audio_path):
-                     # Fallback to moviepy? Or just skip
-                     print(f"Warning: FFmpeg failed {idx}")
-                     continue
-
-                clip = AudioFileClip(track_audio_path)
-                
-                start = track.get('start', 0)
-                duration = track.get('duration', 0)
-                offset = track.get('offset', 0)
-                
-                if offset > 0: clip = clip.subclip(offset, clip.duration)
-                if duration > 0 and duration < clip.duration: clip = clip.subclip(0, duration)
-                    
-                clip = clip.set_start(start)
-                clip = clip.volumex(track.get('volume', 1.0))
-                audio_clips.append(clip)
-                
-            except Exception as e:
-                debug_logs.append(f"Error extracting audio {idx}: {e}")
-                print(f"Error extracting audio {idx}: {e}")
-
-        # 2. Extract Audio Tracks (Keep existing logic mostly, just indented)
-        for idx, track in enumerate(audio_tracks):
-            url = track.get('url')
-            if not url: continue
-            path = download_asset(url, f"aud_{idx}")
-            if not path: continue
-            try:
-                clip = AudioFileClip(path)
-                start = track.get('start', 0)
-                duration = track.get('duration', 0)
-                offset = track.get('offset', 0)
-                if offset > 0: clip = clip.subclip(offset, clip.duration)
-                if duration > 0 and duration < clip.duration: clip = clip.subclip(0, duration)
-                clip = clip.set_start(start)
-                clip = clip.volumex(track.get('volume', 1.0))
-                audio_clips.append(clip)
-            except Exception as e:
-                 print(f"Error loading audio {idx}: {e}")
-
-        if not audio_clips:
-            return {"status": "error", "message": "No audio found", "debug_logs": debug_logs}
-
-        # 3. Mix
-        print(f"Mixing {len(audio_clips)} audio clips...")
-        final_audio = CompositeAudioClip(audio_clips)
-        output_audio_path = "/tmp/mixed_audio.mp3"
-        final_audio.write_audiofile(output_audio_path, fps=24000, logger=None)
+        # 0. Download every track concurrently (shared pooled downloader)
+        span = trace.stage("download")
+        video_items, audio_items, download_manifest = download_tracks(
+            video_tracks, audio_tracks, local_assets_dir, cache=AssetCache(volume=asset_cache_volume)
+        )
+        span.add_bytes(sum(m['bytes'] for m in download_manifest if not m.get('cached')))
+        span.set(assets=len(download_manifest), cache_hits=sum(1 for m in download_manifest if m.get('cached')))
+
+        # 1. Mix video + audio tracks in one pass (see audio_mixer.py)
+        # 24kHz is plenty for transcription and keeps the upload small
+        print("Mixing audio...")
+        span = trace.stage("audio_mix")
+        output_audio_path = workspace.path("mixed_audio.mp3")
+        has_audio = audio_mixer.render_audio(
+            video_items, audio_items, output_audio_path,
+            codec_args=['-c:a', 'libmp3lame', '-q:a', '4'], sample_rate=24000, errors=debug_logs
+        )
+        if not has_audio:
+            return traced({"status": "error", "message": "No audio found", "debug_logs": debug_logs, "downloads": download_manifest})
+        span.add_bytes(os.path.getsize(output_audio_path))
         
-        # 4. Gemini Transcription
+        # 2. Gemini Transcription
         print("Uploading to Gemini...")
         genai.configure(api_key=api_key)
         
+        span = trace.stage("gemini_upload")
+        span.add_bytes(os.path.getsize(output_audio_path))
         audio_file = genai.upload_file(path=output_audio_path)
+        trace.stage("gemini_processing")
         while audio_file.state.name == "PROCESSING":
             time.sleep(1)
             audio_file = genai.get_file(audio_file.name)
@@ -317,88 +315,178 @@ def generate_subtitles_logic(request_data: dict):
         IMPORTANT: JSON ONLY. No markdown.
         """
         
+        trace.stage("gemini_generate", model="gemini-2.5-pro")
         response = model.generate_content([audio_file, prompt])
         
         try:
             text = response.text.replace("```json", "").replace("```", "").strip()
             data = json.loads(text)
-            return {"status": "success", "subtitles": data}
+            return traced({"status": "success", "subtitles": data, "downloads": download_manifest})
         except Exception as e:
             print(f"Gemini Parse Error: {e}")
-            return {"status": "error", "message": str(e), "raw": response.text}
+            return traced({"status": "error", "message": str(e), "raw": response.text}, e)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return {"status": "error", "message": f"Global Error: {str(e)}"}
-
-@app.function(image=image, timeout=3600)  # Embedded fonts, no mount arg needed
-def render_video_logic(request_data: dict, r2_creds: dict):
-    # Monkeypatch PIL.Image.ANTIALIAS for MoviePy 1.0.3 compatibility with Pillow 10+
-    import PIL.Image
-    if not hasattr(PIL.Image, 'ANTIALIAS'):
-        PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
-
-    # Configure ImageMagick for TextClip
-    from moviepy.config import change_settings
-    change_settings({"IMAGEMAGICK_BINARY": "/usr/bin/convert"})
-
-    # COMPATIBILITY IMPORTS (v1 vs v2)
-    try:
-        # Try v1.x standard first (Most reliable if successful)
-        from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip, CompositeAudioClip, TextClip, ColorClip, concatenate_videoclips
-    except ImportError:
+        return traced({"status": "error", "message": f"Global Error: {str(e)}"}, e)
+    finally:
+        workspace.close()
+        s3_client = None
         try:
-            # Try v2.x Top-Level (Cleanest for 2.0+)
-            from moviepy import VideoFileClip, AudioFileClip, CompositeVideoClip, CompositeAudioClip, TextClip, ColorClip, concatenate_videoclips
-        except ImportError:
-            # Fallback: Manual v2 submodules (if top-level omits some)
-            print("Trying manual v2 submodule imports...")
-            from moviepy.video.io.VideoFileClip import VideoFileClip
-            from moviepy.audio.io.AudioFileClip import AudioFileClip
-            from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
-            # CompositeAudioClip - try various locations
-            try:
-                from moviepy.audio.compositing.CompositeAudioClip import CompositeAudioClip
-            except ImportError:
-                from moviepy.audio.AudioClip import CompositeAudioClip
-                
-            from moviepy.video.VideoClip import ColorClip, TextClip
-            from moviepy.video.compositing.concatenate import concatenate_videoclips
+            if r2_creds:
+                import boto3
+                s3_client = boto3.client(
+                    's3',
+                    endpoint_url=f"https://{r2_creds['account_id']}.r2.cloudflarestorage.com",
+                    aws_access_key_id=r2_creds['access_key_id'],
+                    aws_secret_access_key=r2_creds['secret_access_key'],
+                    region_name='auto'
+                )
+        except Exception as e:
+            print(f"Trace upload disabled: {e}")
+        trace.emit(s3_client, r2_creds and r2_creds['bucket_name'])
+
+def pick_render_engine(requested_engine, video_items, text_tracks, captions='bitmap'):
+    # auto: FFmpeg graph unless the timeline uses effects only MoviePy can draw
+    import ffmpeg_engine
+    if requested_engine == 'moviepy':
+        return 'moviepy'
+    reasons = ffmpeg_engine.unsupported_features(video_items, text_tracks, captions)
+    if reasons:
+        print(f"FFmpeg graph can't express: {reasons}. Using MoviePy.")
+        return 'moviepy'
+    return 'ffmpeg'
+
+def render_with_engine(engine, video_items, audio_items, text_tracks, outputs, update_status, **render_args):
+    # Runs the chosen engine for every rendition in outputs = [(canvas, output_path)];
+    # a failed FFmpeg graph falls back to MoviePy. Returns the engine actually used.
+    import ffmpeg_engine
+    import moviepy_engine
+    if engine == 'ffmpeg':
+        try:
+            ffmpeg_engine.render_renditions(video_items, audio_items, text_tracks, outputs, update_status, **render_args)
+            return engine
+        except Exception as graph_err:
+            print(f"FFmpeg Graph Engine Failed: {graph_err}. Falling back to MoviePy.")
+    moviepy_engine.render_renditions(video_items, audio_items, text_tracks, outputs, update_status, **render_args)
+    return 'moviepy'
+
+def render_streaming(engine, video_items, audio_items, text_tracks, canvases, keys, s3_client, bucket, update_status, work_dir, **render_args):
+    # Like render_with_engine, but each rendition is encoded straight into an R2
+    # multipart upload (fragmented MP4 through a FIFO in work_dir, see streaming_upload).
+    # A failed FFmpeg graph aborts its uploads; MoviePy then starts fresh ones.
+    # Returns (engine actually used, bytes uploaded per rendition).
+    import ffmpeg_engine
+    import moviepy_engine
+    from streaming_upload import StreamingUpload, STREAM_VIDEO_ARGS
+
+    render_args['extra_video_args'] = (render_args.get('extra_video_args') or []) + STREAM_VIDEO_ARGS
+    render_args['work_dir'] = work_dir
+    attempts = [('ffmpeg', ffmpeg_engine), ('moviepy', moviepy_engine)] if engine == 'ffmpeg' else [('moviepy', moviepy_engine)]
+    for name, module in attempts:
+        uploads = [StreamingUpload(s3_client, bucket, key, work_dir=work_dir) for key in keys]
+        try:
+            outputs = [(canvas, upload.start()) for canvas, upload in zip(canvases, uploads)]
+            module.render_renditions(video_items, audio_items, text_tracks, outputs, update_status, **render_args)
+            return name, [upload.finish() for upload in uploads]
+        except Exception as e:
+            for upload in uploads: upload.abort()
+            if name == 'moviepy': raise
+            print(f"FFmpeg Graph Engine Failed: {e}. Falling back to MoviePy.")
 
+def rendition_keys(output_key, formats, sizes):
+    # R2 key per rendition: output_key for the main one, then each format's own
+    # output_key or "<output_key stem>_<w>x<h><ext>". sizes = [(w, h)] per rendition.
+    import os
+    stem, ext = os.path.splitext(output_key)
+    keys = [output_key]
+    for fmt, (w, h) in zip(formats, sizes[1:]):
+        keys.append(fmt.get('output_key') or f"{stem}_{w}x{h}{ext or '.mp4'}")
+    return keys
+
+def publish_duplicate(s3_client, bucket, entry, follower):
+    # Serves a request from an identical render (render_dedup entry): server-side
+    # copy of every rendition to the follower's own keys, plus its result/status
+    # JSON - the Studio only polls the output_key it asked for.
+    import json
+    import time
+    sizes = [(r['width'], r['height']) for r in entry['renditions']]
+    keys = rendition_keys(follower['output_key'], follower.get('formats') or [], sizes)
+    renditions = []
+    for rendition, key in zip(entry['renditions'], keys):
+        if key != rendition['key']:
+            s3_client.copy_object(
+                Bucket=bucket, Key=key, CopySource={'Bucket': bucket, 'Key': rendition['key']},
+                MetadataDirective='REPLACE', ContentType='video/mp4', ContentDisposition='inline' # Allow Inline Playback (Fixes iOS Player)
+            )
+        renditions.append(dict(rendition, key=key, output_url=f"https://pub-b1a4f641f6b640c9a03f5731f8362854.r2.dev/{key}"))
+
+    script = follower.get('script') or []
+    result_data = dict(
+        entry['result'],
+        output_url=renditions[0]["output_url"],
+        renditions=renditions,
+        key=follower['output_key'],
+        script=script,
+        summary=script[0].get('text', 'Video Render')[:100] if script else "Video Render",
+        timestamp=time.time(),
+        userId=follower.get('userId'),
+        deduplicated_from=entry['output_key']
+    )
+    s3_client.put_object(
+        Bucket=bucket, Key=f"{follower['output_key']}_result.json",
+        Body=json.dumps(result_data), ContentType='application/json'
+    )
+    status_data = {"status": "finished", "message": "Finalizing...", "percent": 100, "timestamp": time.time()}
+    s3_client.put_object(
+        Bucket=bucket, Key=f"{follower['output_key']}_status.json",
+        Body=json.dumps(status_data), ContentType='application/json'
+    )
+    print(f"Reused render {entry['output_key']} for {follower['output_key']}")
+
+@app.function(image=render_image, timeout=3600, volumes={"/cache": asset_cache_volume}, allow_concurrent_inputs=RENDER_CONCURRENT_INPUTS, enable_memory_snapshot=True)  # Embedded fonts, no mount arg needed
+def render_video_logic(request_data: dict, r2_creds: dict):
     # --- IMPORTS ---
     import os
     import boto3
-    import requests
     import json
     import time
-    import subprocess
+    from render_timeline import sort_video_tracks, timeline_duration, render_canvases, PREVIEW_VIDEO_ARGS
+    from asset_downloader import download_tracks
+    from asset_cache import AssetCache
+    from streaming_upload import StreamingUpload, STREAM_MOVFLAGS
+    from status_publisher import StatusPublisher
+    from tracing import Trace
+    from workspace import Workspace, ensure_font_cache
+    from ass_subtitles import caption_mode
+    import slice_render
+    import segment_cache
+    import stream_copy
+    import audio_mixer
+    import render_dedup
     
-    # Runtime Font Cache (since build-time cache misses added files)
-    if not os.path.exists("/tmp/font_cache_init"):
-        print("Initializing Font Cache (Runtime)...")
-        subprocess.run(["fc-cache", "-f", "-v"], check=False)
-        with open("/tmp/font_cache_init", "w") as f: f.write("done")
+    # No-op when the image build indexed the fonts (marker file), else one fc-cache per container
+    ensure_font_cache()
+    captions = caption_mode(request_data.get('captions'))
     
     video_tracks = request_data.get('video_tracks', [])
     audio_tracks = request_data.get('audio_tracks', [])
     text_tracks = request_data.get('text_tracks', []) # Extract Subtitles
-    script = request_data.get('script', [])
     output_key = request_data.get('output_key')
+    requested_engine = request_data.get('engine') or 'auto'
+    preview = bool(request_data.get('preview'))
+    stream_upload = bool(request_data.get('stream_upload'))
+    canvases = render_canvases(request_data) # Main rendition first, then request_data['formats']
+    output_keys = rendition_keys(output_key, request_data.get('formats') or [], [(c.w, c.h) for c in canvases])
     
     print(f"Starting Render (CPU Optimized). Output: {output_key}")
-    print("BACKEND VERSION: 2.6.0 - Hostile Font Environment Fixes") 
+    print("BACKEND VERSION: 2.7.0 - FFmpeg Graph Engine") 
     print(f"Video Tracks: {len(video_tracks)}")
     print(f"Audio Tracks: {len(audio_tracks)}")
-    print(f"Text Tracks: {len(text_tracks)}")
+    print(f"Text Tracks: {len(text_tracks)} (captions: {captions})")
+    print(f"Renditions: {canvases}{' (preview)' if preview else ''}")
     
-    # Debug: List fonts
-    base_path = "/usr/share/fonts/truetype/custom"
-    if os.path.exists(base_path):
-        print(f"Custom Fonts Present: {os.listdir(base_path)}")
-    else:
-        print("CRITICAL ERROR: Custom font directory missing!")
-
     # Setup R2
     s3_client = boto3.client(
         's3',
@@ -408,685 +496,254 @@ def render_video_logic(request_data: dict, r2_creds: dict):
         region_name='auto'
     )
     
-   # ... (Download helper omitted for brevity in diff, assume it exists or use full replace if needed) ...
-    # RE-DECLARING download_asset helper since replace_file_content scope is sticky
-    local_assets_dir = "/tmp/assets"
-    os.makedirs(local_assets_dir, exist_ok=True)
-    
-    # Helper to download
-    def download_asset(url, prefix):
-        # Infer extension
-        ext = ".mp4"
-        if "." in url.split("/")[-1]:
-             possible_ext = "." + url.split("/")[-1].split(".")[-1].split("?")[0]
-             if len(possible_ext) < 5: ext = possible_ext
-        
-        filename = f"{prefix}{ext}"
-        path = os.path.join(local_assets_dir, filename)
-        
-        if os.path.exists(path): return path
-        try:
-            print(f"Downloading {url} to {filename}...")
-            r = requests.get(url, stream=True, timeout=60)
-            r.raise_for_status()
-            with open(path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            size = os.path.getsize(path)
-            print(f"Downloaded {filename}: {size} bytes")
-            if size == 0:
-                print(f"WARNING: Downloaded empty file: {url}")
-                return None
-                
-            return path
-        except Exception as e:
-            print(f"Failed to download {url}: {e}")
-            return None
-
-    # Status Helper
-    def update_status(msg, percent=0, status="processing"):
-        try:
-            status_key = f"{output_key}_status.json"
-            status_data = {"status": status, "message": msg, "percent": percent, "timestamp": time.time()}
+    # Everything this job writes locally, removed when it ends (other renders may share the container)
+    workspace = Workspace("render")
+    local_assets_dir = workspace.dir("assets")
+    cache = AssetCache(volume=asset_cache_volume)
+
+    # Set by the endpoint when de-duplication is on (see render_dedup.py)
+    timeline_key = request_data.get('timeline_hash')
+    dedup = render_dedup.open_dict() if timeline_key else None
+
+    # Per-stage wall/CPU/bytes/RSS (see tracing.py), reported in the status and result manifests
+    trace = Trace("render", output_key=output_key, userId=request_data.get('userId'), preview=preview)
+
+    # Status Helper: runs on the publisher's thread (coalesced, see status_publisher.py)
+    def write_status(status_data):
+        status_data = dict(status_data, trace=trace.summary())
+        status_keys = [f"{output_key}_status.json"]
+        if dedup is not None:
+            # Identical requests attached to this render poll their own keys
+            status_keys += [f"{f['output_key']}_status.json" for f in render_dedup.followers(dedup, timeline_key)]
+        for status_key in status_keys:
             s3_client.put_object(
                 Bucket=r2_creds['bucket_name'],
                 Key=status_key,
                 Body=json.dumps(status_data),
                 ContentType='application/json'
             )
-            print(f"STATUS UPDATE: {msg}")
-        except Exception as e:
-            print(f"Failed to update status: {e}")
+
+    # update_status(msg, percent=0, status="processing") never blocks on R2
+    update_status = StatusPublisher(write_status)
 
     try:
         update_status("Starting render job...", 5)
-        clips_to_composite = []
-        audio_clips = []
+        trace.stage("prepare")
         
-        # 1. Process Video Tracks
-        # SORTING - CRITICAL FOR LAYERING
-        # 1. Track Index (Lower = Bottom)
-        # 2. Type: Video (0) < Image (1). This ensures Background Videos are drawn BEFORE Data/Bubbles.
-        # 3. Start Time
-        video_tracks.sort(key=lambda x: (
-            x.get('trackIndex', 0),
-            0 if str(x.get('type', '')).lower() == 'video' else 1,
-            x.get('start', 0)
-        ))
-
+        # 1. Sort Video Tracks - CRITICAL FOR LAYERING (see render_timeline.sort_video_tracks)
+        sort_video_tracks(video_tracks)
         print("Composite Sort Order:", [(t.get('type'), t.get('trackIndex')) for t in video_tracks])
 
-        max_duration = 0
-        
+        # 2. Download Assets (both engines work on local files)
         update_status("Downloading and processing clips...", 10)
-        for idx, track_data in enumerate(video_tracks):
-            url = track_data.get('url') or track_data.get('src')
-            if not url: continue
-            
-            local_path = download_asset(url, f"vid_{idx}")
-            if not local_path: continue
-            
-            start_time = track_data.get('start', 0)
-            duration = track_data.get('duration', 0)
-            
-            # Robust Load
-            try:
-                # Check if image (explicit type or extension)
-                is_image = track_data.get('type') == 'image' or local_path.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))
-                
-                if is_image:
-                    print(f"Detected Image: {local_path}")
-                    from moviepy.video.VideoClip import ImageClip
-                    clip = ImageClip(local_path)
-                    # Images need explicit duration
-                    if duration <= 0: duration = 5 
-                    clip = clip.set_duration(duration)
-                else:
-                    print(f"Loading Video: {local_path}")
-                    clip = VideoFileClip(local_path)
-            except Exception as e:
-                print(f"Failed to load clip {local_path}: {e}")
-                continue
-            
-            # Helper for Percentage Parsing
-            def parse_dimension(val, total_pixels):
-                if val is None: return None
-                if isinstance(val, (int, float)): return float(val)
-                val_str = str(val).strip()
-                if val_str.endswith('%'):
-                    try:
-                        pct = float(val_str[:-1])
-                        return (pct / 100.0) * total_pixels
-                    except:
-                        return None
-                try:
-                    return float(val_str.replace('px', ''))
-                except:
-                    return None
-
-            if duration > 0 and not isinstance(clip, (ImageClip if 'ImageClip' in locals() else type(None))):
-                 if duration < clip.duration:
-                     clip = clip.subclip(0, duration)
-            
-            clip = clip.set_start(start_time)
-
-            # --- RESIZE & COMPOSE LOGIC ---
-            # Determine if this track needs Custom Layout (Image, Bubble, or Split Screen Video)
-            # Conditions:
-            # 1. It is an Image
-            # 2. It has explicit 'style' props
-            # 3. It has explicit 'width'/'height' props
-            # 4. It has 'x' or 'y' props
-            has_custom_layout = is_image or track_data.get('style') or track_data.get('width') or track_data.get('x') or track_data.get('y')
-
-            if has_custom_layout:
-                 # IMAGE / BUBBLE / SPLIT SCREEN SPECS
-                 style = track_data.get('style', {})
-                 
-                 # 1. Size / Scale
-                 target_w = parse_dimension(track_data.get('width') or style.get('width'), 1080)
-                 target_h = parse_dimension(track_data.get('height') or style.get('height'), 1920)
-                 
-                 scale = float(track_data.get('scale', 1.0) or 1.0)
-
-                 # Resize Strategy
-                 if target_w is not None and target_h is not None:
-                      # If both provided, force resize (distort? or fit?)
-                      # MoviePy resize(newsize=(w,h)) distorts.
-                      # We typically want to cover or contain. 
-                      # For Split Screen, we usually want to resize exactly to the box.
-                      # But let's check aspect ratio.
-                      # If user says width=100%, height=30%, they likely mean "Fit this box"
-                      clip = clip.resize(newsize=(target_w, target_h))
-                 elif target_w is not None:
-                      clip = clip.resize(width=target_w * scale)
-                 elif target_h is not None:
-                      clip = clip.resize(height=target_h * scale)
-                 elif scale != 1.0:
-                      clip = clip.resize(scale)
-
-                 # 2. Rotation
-                 rotation = track_data.get('rotation', 0)
-                 if rotation != 0:
-                     clip = clip.rotate(rotation)
-
-                 # 3. Position
-                 pos_x_val = track_data.get('x') 
-                 pos_y_val = track_data.get('y')
-                 
-                 # Fallback
-                 if pos_x_val is None: pos_x_val = style.get('x') or style.get('left')
-                 if pos_y_val is None: pos_y_val = style.get('y') or style.get('top')
-                 
-                 # Parse Percentages for Position
-                 pos_x = parse_dimension(pos_x_val, 1080)
-                 pos_y = parse_dimension(pos_y_val, 1920)
-
-                 if pos_x is not None and pos_y is not None:
-                     # Absolute Position
-                     clip = clip.set_position((pos_x, pos_y))
-                 elif pos_x is not None:
-                     clip = clip.set_position((pos_x, "center"))
-                 elif pos_y is not None:
-                     clip = clip.set_position(("center", pos_y))
-                 else:
-                     # Default Center
-                     clip = clip.set_position("center")
-            else:
-                # BACKGROUND VIDEO SPECS (Legacy Fallback for Fullscreen)
-                clip = clip.resize(height=1920) 
-                if clip.w < 1080:
-                    clip = clip.resize(width=1080)
-                clip = clip.crop(x1=clip.w/2 - 540, y1=0, width=1080, height=1920)
-            
-            # Apply Volume
-            vol = track_data.get('volume', 1.0)
-            if clip.audio is not None and vol != 1.0:
-                clip = clip.volumex(vol)
-
-            clips_to_composite.append(clip)
-            
-            if start_time + duration > max_duration:
-                max_duration = start_time + duration
-
-        # 2. Process Audio Tracks
-        if audio_tracks:
-            update_status(f"Processing {len(audio_tracks)} audio tracks...", 40)
-            
-        for idx, track_data in enumerate(audio_tracks):
-            url = track_data.get('url') or track_data.get('src')
-            if not url: continue
-            
-            local_path = download_asset(url, f"aud_{idx}")
-
-            if not local_path: continue
-            
-            start_time = track_data.get('start', 0)
-            duration = track_data.get('duration', 0)
-            
+        span = trace.stage("download")
+        video_items, audio_items, download_manifest = download_tracks(
+            video_tracks, audio_tracks, local_assets_dir, cache=cache
+        )
+        span.add_bytes(sum(m['bytes'] for m in download_manifest if not m.get('cached')))
+        span.set(assets=len(download_manifest), cache_hits=sum(1 for m in download_manifest if m.get('cached')))
+        trace.stage("plan")
+
+        # 3. Pick Engine (per job)
+        engine = pick_render_engine(requested_engine, video_items, text_tracks, captions)
+        print(f"Render Engine: {engine} (requested: {requested_engine})")
+
+        output_paths = [workspace.path("render_output.mp4")] + [workspace.path(f"render_output_{n}.mp4") for n in range(1, len(canvases))]
+        encode_args = PREVIEW_VIDEO_ARGS if preview else None
+        uploaded_sizes = None # Set when the renditions were streamed to R2 while encoding
+        total_duration = timeline_duration(video_items, audio_items, text_tracks)
+        parallel = bool(request_data.get('parallel'))
+        windows = slice_render.plan_slices(total_duration) if parallel else []
+        slice_kwargs = {"request_data": request_data, "engine": engine}
+
+        def mix_audio(work_dir):
+            # Full-length soundtrack, mixed once and muxed under the stream-copied video
+            audio_path = os.path.join(work_dir, "audio.m4a")
+            span = trace.stage("audio_mix")
+            if not audio_mixer.render_audio(video_items, audio_items, audio_path, duration=total_duration):
+                return None
+            span.add_bytes(os.path.getsize(audio_path))
+            return audio_path
+
+        def join_renditions(rendition_paths, audio_path, work_dir):
+            # Stream-copies each rendition's slices/segments into its output file, or straight into R2.
+            # Returns the uploaded sizes when streamed, else None.
+            span = trace.stage("join", streamed=stream_upload)
+            if not stream_upload:
+                for paths, output_path in zip(rendition_paths, output_paths):
+                    slice_render.concat_slices(paths, audio_path, output_path, work_dir)
+                    span.add_bytes(os.path.getsize(output_path))
+                return None
+            uploads = [StreamingUpload(s3_client, r2_creds['bucket_name'], key, work_dir=work_dir) for key in output_keys]
             try:
-                clip = AudioFileClip(local_path)
-                if duration > 0 and duration < clip.duration:
-                    clip = clip.subclip(0, duration)
-                clip = clip.set_start(start_time)
-                
-                # Apply Volume
-                vol = track_data.get('volume', 1.0)
-                if vol != 1.0:
-                    clip = clip.volumex(vol)
-                    
-                audio_clips.append(clip)
-                
-                if start_time + duration > max_duration:
-                     max_duration = start_time + duration
-            except Exception as e:
-                print(f"Failed to load audio {local_path}: {e}")
-                continue
-
-        # 3. Process Text Tracks (Subtitles)
-        for track in text_tracks:
+                for paths, upload in zip(rendition_paths, uploads):
+                    slice_render.concat_slices(paths, audio_path, upload.start(), work_dir, movflags=STREAM_MOVFLAGS)
+                sizes = [upload.finish() for upload in uploads]
+                span.add_bytes(sum(sizes))
+                return sizes
+            except Exception:
+                for upload in uploads: upload.abort()
+                raise
+
+        def copy_cuts(cuts):
+            # Cut-only timeline: copied GOPs + re-encoded boundaries, joined like slices.
+            # Returns True when the renditions are done, False to render normally.
+            nonlocal uploaded_sizes
+            update_status("Copying cuts...", 30)
+            span = trace.stage("render", engine="stream_copy", mode="cuts", cuts=len(cuts))
+            cut_dir = workspace.dir("cuts")
             try:
-                text = track.get('text')
-                if not text: continue
-                
-                start = track.get('start', 0)
-                duration = track.get('duration', 2)
-                style = track.get('style', {})
-                
-                # Force Int Font Size (Critical for Pillow)
-                font_size = int(float(style.get('fontSize') or style.get('font_size') or 60))
-                color = style.get('color', 'white')
-                requested_font = style.get('fontFamily') or style.get('font_family') or 'Arial'
-                
-                # Font Logic - Relocated to /root/fonts for safety
-                base_path = "/root/fonts"
-                
-                raw_font_map = {
-                    'Anton': f'{base_path}/Anton-Regular.ttf',
-                    'Bebas Neue': f'{base_path}/BebasNeue-Regular.ttf',
-                    'Montserrat': f'{base_path}/Montserrat-Bold.ttf',
-                    'Montserrat-Black': f'{base_path}/Montserrat-Black.ttf', # Added Black variant
-                    'Poppins': f'{base_path}/Poppins-Bold.ttf',
-                    'Lato': f'{base_path}/Lato-Bold.ttf',
-                    'Oswald': f'{base_path}/Oswald-Bold.ttf',
-                    'Raleway': f'{base_path}/Raleway-Bold.ttf',
-                    'Roboto': '/usr/share/fonts/truetype/roboto/hinted/Roboto-Bold.ttf', 
-                    'Open Sans': '/usr/share/fonts/truetype/open-sans/OpenSans-Bold.ttf',
-                    'Inter': '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf' 
-                }
-                
-                # Case-Insensitive Lookup
-                font_map = {k.lower(): v for k, v in raw_font_map.items()}
-                font_map = {k.lower(): v for k, v in raw_font_map.items()}
-                font_path = font_map.get(str(requested_font).lower())
-
-                # Smart Weight Selection for Montserrat
-                font_weight = style.get('fontWeight') or style.get('font_weight')
-                if str(requested_font).lower() == 'montserrat':
-                    try:
-                        weight_val = int(font_weight) if font_weight else 400
-                        if weight_val >= 800:
-                             font_path = font_map.get('montserrat-black')
-                             print("Selected Montserrat-Black based on weight 900")
-                    except:
-                       pass
-                
-                
-                font_found = False
-                if font_path:
-                    if os.path.exists(font_path):
-                         font = font_path
-                         font_found = True
-                         print(f"Found Custom Font: {font}")
-                    else:
-                         print(f"MISSING Custom Font: {font_path}")
-                         
-                if not font_found:
-                    # Fallback
-                    if os.path.exists("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"):
-                        font = "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-                    else:
-                        font = "Arial"
-                    print(f"Fallback Font: {font}")
-                
-                # Text Transform (Uppercase support)
-                text_transform = style.get('textTransform') or style.get('text_transform')
-                if text_transform == 'uppercase':
-                    text = text.upper()
-                
-                stroke_color = style.get('stroke', '#000000')
-                # Check both keys for stroke width
-                stroke_width = style.get('strokeWidth')
-                if stroke_width is None: stroke_width = style.get('stroke_width')
-                stroke_width = int(stroke_width) if stroke_width is not None else 0
-                
-                print(f"Style Debug: {style}")
-                print(f"Generating Output using PILLOW (Pure Python)...")
-
-                # Helper to render using Pillow
-                def generate_pillow_text(text, font_path, font_size, color, stroke_color, stroke_width, bg_color):
-                     import uuid
-                     import textwrap
-                     from PIL import Image, ImageDraw, ImageFont
-                     
-                     temp_filename = f"/tmp/txt_{uuid.uuid4()}.png"
-                     
-                     # 1. Load Font (ROBUST)
-                     font = None
-                     print(f"DEBUG: Loading font: '{font_path}' Size: {font_size}")
-                     
-                     if font_path and os.path.exists(font_path):
-                         try:
-                            font = ImageFont.truetype(font_path, font_size)
-                         except Exception as e:
-                            print(f"ERROR: Failed to load custom font {font_path}: {e}")
-
-                     if font is None:
-                         # Fallback to system bold font (Vector)
-                         fallback_path = "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-                         if os.path.exists(fallback_path):
-                             print(f"WARNING: Using Fallback System Font: {fallback_path}")
-                             try:
-                                 font = ImageFont.truetype(fallback_path, font_size)
-                             except:
-                                 pass
-                     
-                     if font is None:
-                        print("CRITICAL: All fonts failed. Using bitmap default (Tiny).")
-                        font = ImageFont.load_default()
-
-                     # 2. Pixel-Based Wrapping (Matches CSS/Studio behavior)
-                     # Fixed char limit causes "narrow column" look for small fonts.
-                     # We must wrap based on VIDEO WIDTH (1080p) - PADDING.
-                     
-                     # INCREASED SAFETY MARGIN: 980px (was 850px)
-                     # 1080 - 980 = 100px padding total (~50px each side)
-                     # User wants wider text, less stacking.
-                     MAX_WIDTH_PX = 980 
-                     
-                     words = text.split()
-                     wrapped_lines = []
-                     current_line_words = []
-                     
-                     for word in words:
-                         # Test width effectively
-                         test_line = " ".join(current_line_words + [word])
-                         
-                         try:
-                             # Modern Pillow
-                             line_w = font.getlength(test_line)
-                         except AttributeError:
-                             # Older Pillow
-                             line_w, _ = font.getsize(test_line)
-                         
-                         # Account for stroke width (left + right) in the width calculation
-                         total_w = line_w + (int(stroke_width) * 2)
-
-                         if total_w <= MAX_WIDTH_PX:
-                             current_line_words.append(word)
-                         else:
-                             if current_line_words:
-                                 wrapped_lines.append(" ".join(current_line_words))
-                                 current_line_words = [word] # Start new line with current word
-                             else:
-                                 # One massive word? Force break it or just let it overflow?
-                                 # Let's just put it on the line
-                                 wrapped_lines.append(word)
-                                 current_line_words = []
-                     
-                     if current_line_words:
-                         wrapped_lines.append(" ".join(current_line_words))
-                     
-                     if not wrapped_lines: # Empty text safety
-                         wrapped_lines = [" "]
-
-                     # 3. Calculate Dimensions
-                     dummy_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
-
-                     
-                     # Get Max Width/Height
-                     line_heights = []
-                     max_width = 0
-                     
-                     # Calculate bbox for each line
-                     
-                     total_height = 0
-                     line_spacing = 5 # Tighter line spacing
-                     
-                     valid_lines = []
-                     
-                     for line in wrapped_lines:
-                         # textbbox(xy, text, font=, stroke_width=)
-                         # xy is top-left
-                         try:
-                            bbox = dummy_draw.textbbox((0, 0), line, font=font, stroke_width=int(stroke_width))
-                            w = bbox[2] - bbox[0]
-                            h = bbox[3] - bbox[1]
-                         except AttributeError:
-                             # Old PIL fallback
-                             w, h = dummy_draw.textsize(line, font=font, stroke_width=int(stroke_width))
-                         
-                         max_width = max(max_width, w)
-                         line_heights.append(h)
-                         total_height += h
-                         valid_lines.append(line)
-                     
-                     total_height += (len(valid_lines) - 1) * line_spacing
-                     
-                     # Add padding
-                     padding = 40
-                     img_w = int(max_width + padding * 2)
-                     img_h = int(total_height + padding * 2)
-                     
-                     # 4. Create Image
-                     # Handle bg color
-                     bg_rgba = (0,0,0,0) # Transparent
-                     if bg_color and bg_color != 'transparent':
-                         # Convert color name/hex to rgba? 
-                         # PIL handles common names and hex.
-                         bg_rgba = bg_color 
-                     
-                     img = Image.new('RGBA', (img_w, img_h), bg_rgba)
-                     draw = ImageDraw.Draw(img)
-                     
-                     # 5. Draw Text
-                     current_y = padding
-                     for i, line in enumerate(valid_lines):
-                         # Center text horizontally
-                         # We need line width again
-                         try:
-                            bbox = draw.textbbox((0, 0), line, font=font, stroke_width=int(stroke_width))
-                            line_w = bbox[2] - bbox[0]
-                         except:
-                             line_w, _ = draw.textsize(line, font=font, stroke_width=int(stroke_width))
-                         
-                         x = (img_w - line_w) // 2
-                         
-                         # Draw Stroke & Fill
-                         draw.text(
-                             (x, current_y), 
-                             line, 
-                             font=font, 
-                             fill=color, 
-                             stroke_width=int(stroke_width), 
-                             stroke_fill=stroke_color,
-                             align='center'
-                        )
-                         current_y += line_heights[i] + line_spacing
-                         
-                     img.save(temp_filename)
-                     print(f"PIL Generated: {temp_filename}")
-                     return temp_filename
-
-                img_path = None
-                using_fallback_renderer = False
-                bg_color = 'transparent' # Default for text rendering
-
-                try:
-                    # Attempt 1: Trusted Custom Font + Pillow (Best Quality)
-                    img_path = generate_pillow_text(text, font, font_size, color, stroke_color, stroke_width, bg_color)
-                except Exception as e:
-                    print(f"PIL Custom Font Failed: {e}")
-                    # Attempt 2: System Font + Pillow
-                    try: 
-                        fallback = "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-                        if not os.path.exists(fallback): fallback = "Arial"
-                        img_path = generate_pillow_text(text, fallback, font_size, color, stroke_color, stroke_width, bg_color)
-                        print("Fallback Font Image Generated (PIL)")
-                    except Exception as e2:
-                        print(f"PIL Fallback Failed: {e2}")
-                        using_fallback_renderer = True
-                
-                if not using_fallback_renderer and img_path and os.path.exists(img_path):
-                    from moviepy.editor import ImageClip
-                    txt_clip = ImageClip(img_path).set_duration(duration)
-                else:
-                    # ULTIMATE SAFETY NET: MoviePy Caption (Visible but Ugly)
-                    print("CRITICAL: PIL failed. Reverting to MoviePy 'caption' fallback.")
-                    try:
-                        # This works reliably but ignores strokes/uppercase often
-                        from moviepy.editor import TextClip
-                        txt_clip = TextClip(
-                                text, 
-                                fontsize=font_size, 
-                                color=color, 
-                                font="Arial", 
-                                method='caption',
-                                size=(900, None)
-                        )
-                    except Exception as e3:
-                         print(f"Final Fallback Failed: {e3}")
-                         # Empty clip to prevent crash
-                         from moviepy.editor import ColorClip
-                         txt_clip = ColorClip(size=(100,100), color=(0,0,0,0), duration=duration)
-                
-                txt_clip = txt_clip.set_start(start)
-
-                
-                txt_clip = txt_clip.set_start(start).set_duration(duration)
-                
-                # Positioning Logic
-                # Priority: Root positionX -> Style x -> Default
-                pos_x = track.get('positionX')
-                if pos_x is None: pos_x = style.get('x')
-                
-                pos_y = track.get('positionY')
-                if pos_y is None: pos_y = style.get('y')
-                
-                # Default to Center-Bottom
-                if pos_x is None: pos_x = 0.5
-                if pos_y is None: pos_y = 0.8
-                
-                # Canvas Dimensions
-                W, H = 1080, 1920
-                
-                # Calculate absolute center target
-                target_center_x = pos_x * W
-                target_center_y = pos_y * H
-                
-                # Center Pivot conversion
-                final_x = target_center_x - (txt_clip.w / 2)
-                final_y = target_center_y - (txt_clip.h / 2)
-                
-                # ANIMATION LOGIC
-                anim_type = style.get('animation')
-                
-                if anim_type == 'slide_up':
-                     # Slide from 50px below combined with Fade
-                     txt_clip = txt_clip.set_position(lambda t: (final_x, final_y + 50 * max(0, 1 - t/0.3))).fadein(0.3)
-                     
-                elif anim_type == 'fade':
-                     txt_clip = txt_clip.set_position((final_x, final_y)).fadein(0.3)
-                     
-                elif anim_type == 'pop' or anim_type == 'typewriter': 
-                     # Pop: Scale 0 -> 1 over 0.2s (Simulating pop)
-                     # (Typewriter mapped to Pop for now as v1 fallback for single-image clips)
-                     def pop_scale(t):
-                         if t < 0.25: return t / 0.25
-                         return 1
-                         
-                     # Centered Resize Logic (Compensate for top-left anchor)
-                     w_orig, h_orig = txt_clip.w, txt_clip.h
-                     txt_clip = txt_clip.resize(pop_scale)
-                     
-                     def centered_pos(t):
-                         s = pop_scale(t)
-                         return (
-                             final_x + (w_orig - w_orig*s)/2,
-                             final_y + (h_orig - h_orig*s)/2
-                         )
-                     
-                     txt_clip = txt_clip.set_position(centered_pos)
-                     txt_clip = txt_clip.set_position(centered_pos)
-                     
-                elif anim_type == 'bounce':
-                     # Bounce: Simple vertical oscillation
-                     # y(t) = final_y - 30 * |sin(3*t)|  (Bounces up)
-                     import math
-                     def bounce_pos(t):
-                         return (final_x, final_y - 80 * abs(math.sin(3 * t)))
-                     txt_clip = txt_clip.set_position(bounce_pos)
-                     
-                elif anim_type == 'shake':
-                     # Shake: Fast horizontal oscillation
-                     import math
-                     def shake_pos(t):
-                         return (final_x + 20 * math.sin(20 * t), final_y)
-                     txt_clip = txt_clip.set_position(shake_pos)
-                     
-                     txt_clip = txt_clip.set_position(shake_pos)
-                     
-                elif anim_type == 'swing':
-                     # Swing: Pendulum rotation
-                     # angle(t) = 15 * sin(2*t)
-                     import math
-                     txt_clip = txt_clip.rotate(lambda t: 15 * math.sin(2 * t)).set_position((final_x, final_y))
-
-                elif anim_type == 'glitch':
-                     # Glitch: Jumps randomly
-                     import random
-                     def glitch_pos(t):
-                         # Jump every 0.1s
-                         if int(t * 10) % 5 == 0:
-                             return (final_x + random.randint(-20, 20), final_y + random.randint(-10, 10))
-                         return (final_x, final_y)
-                     txt_clip = txt_clip.set_position(glitch_pos)
-                     
-                else:
-                     txt_clip = txt_clip.set_position((final_x, final_y))
-                
-                clips_to_composite.append(txt_clip)
+                pieces, stats = stream_copy.render_cuts(cuts, canvases[0], cut_dir)
             except Exception as e:
-                print(f"Failed to render text track: {e}")
-
-        if script:
-             pass 
-
-        if not clips_to_composite:
-            print("WARNING: No video clips were loaded! Creating a placeholder.")
-            # Create a placeholder to avoid crash, but log it
-            max_duration = 5
-            bg_clip = ColorClip(size=(1080, 1920), color=(255,0,0), duration=max_duration)
-            clips_to_composite.append(bg_clip)
-
-        # COMPOSITE
-        time.sleep(0.5) # Allow status to propagate
-        update_status("Compositing video layers...", 60)
-        print(f"Compositing {len(clips_to_composite)} video clips...")
-        bg_clip = ColorClip(size=(1080, 1920), color=(0,0,0), duration=max_duration)
-        final_video = CompositeVideoClip([bg_clip] + clips_to_composite)
-        
-        if audio_clips:
-            video_audio = final_video.audio
-            all_audio = [video_audio] + audio_clips if video_audio else audio_clips
-            # Filter None
-            all_audio = [a for a in all_audio if a is not None]
-            if all_audio:
-                final_audio = CompositeAudioClip(all_audio)
-                final_video = final_video.set_audio(final_audio)
-
-        output_path = "/tmp/render_output.mp4"
-        update_status("Encoding final video (this may take a while)...", 75)
-        final_video.write_videofile(
-            output_path, 
-            fps=30, 
-            codec='libx264', 
-            audio_codec='aac',
-            audio_fps=44100,
-            threads=16, # Maximize CPU usage
-            preset='ultrafast', # Maximize Speed 
-            ffmpeg_params=[
-                '-pix_fmt', 'yuv420p',
-                '-profile:v', 'baseline',
-                '-level', '3.0',
-                '-movflags', '+faststart'
-            ], # Maximum iOS Compatibility
-            logger=None # Disable progress bar to prevent deadlocks
-        )
-        
-        # Check generated file size
-        if os.path.exists(output_path):
-            size = os.path.getsize(output_path)
-            print(f"Generated Video Size: {size} bytes")
-            if size < 1000:
-                print("WARNING: Video file is suspiciously small!")
+                print(f"Stream copy failed: {e}. Rendering normally.")
+                span.set(fallback=str(e)[:500])
+                return False
+            span.set(**stats)
+            span.add_bytes(sum(os.path.getsize(p) for p in pieces))
+            update_status("Joining cuts...", 85)
+            uploaded_sizes = join_renditions([pieces], mix_audio(cut_dir), cut_dir)
+            return True
+
+        # Trims and joins only: no pixel changes, so no render (see stream_copy.py)
+        cuts = stream_copy.plan_cuts(video_items, text_tracks, canvases, total_duration) if request_data.get('stream_copy', True) else None
+        if cuts and copy_cuts(cuts):
+            engine = 'stream_copy'
+            print(f"Stream copy: {len(cuts)} cuts, no render needed")
+        elif request_data.get('segment_cache'):
+            # SEGMENTED: reuse the unchanged GOP-aligned segments of earlier renders, encode only the rest
+            trace.stage("segment_lookup")
+            seg_dir = workspace.dir("segments")
+            segments = segment_cache.plan_segments(total_duration)
+            resolve = render_dedup.cached_asset_resolver(cache)
+            seg_keys = [
+                [segment_cache.segment_key(w, video_tracks, text_tracks, canvas, engine, encode_args, resolve, captions) for w in segments]
+                for canvas in canvases
+            ]
+            seg_paths = [[cache.get_blob(segment_cache.blob_name(key)) for key in keys] for keys in seg_keys]
+            hits = [all(paths[n] for paths in seg_paths) for n in range(len(segments))]
+            # Parallel: hand each worker about one slice worth of segments
+            max_segments = max(1, int(round(slice_render.SLICE_SECONDS / segment_cache.SEGMENT_SECONDS))) if parallel else None
+            runs = segment_cache.missing_runs(hits, max_segments)
+            run_windows = [(segments[first][0], segments[last][1]) for first, last in runs]
+            print(f"Segment Cache: {sum(hits)}/{len(segments)} segments reused, {len(runs)} runs to render: {run_windows}")
+            update_status(f"Reusing {sum(hits)}/{len(segments)} segments, rendering the rest...", 30)
+            render_span = trace.stage("render", engine=engine, mode="segments", segments=len(segments), reused=sum(hits))
+
+            def store_run(run_index, run_paths):
+                # One rendered run per rendition -> its segments -> shared cache
+                first, last = runs[run_index]
+                for r, run_path in enumerate(run_paths):
+                    pieces = segment_cache.split_run(run_path, segments, first, last, seg_dir)
+                    for n, piece in zip(range(first, last + 1), pieces):
+                        render_span.add_bytes(os.path.getsize(piece))
+                        seg_paths[r][n] = cache.put_blob(segment_cache.blob_name(seg_keys[r][n]), piece)
+                        os.remove(piece)
+                update_status(f"Rendered segments {first + 1}-{last + 1}/{len(segments)}", 30 + int(50 * (run_index + 1) / len(runs)))
+
+            if parallel and len(runs) > 1:
+                for i, rendition_bytes in enumerate(render_slice_logic.map(run_windows, kwargs=slice_kwargs)):
+                    run_paths = [os.path.join(seg_dir, f"run_{i:03d}_{r}.mp4") for r in range(len(canvases))]
+                    for run_path, run_bytes in zip(run_paths, rendition_bytes):
+                        with open(run_path, "wb") as f: f.write(run_bytes)
+                    store_run(i, run_paths)
+            else:
+                for i, run_window in enumerate(run_windows):
+                    run_paths = [os.path.join(seg_dir, f"run_{i:03d}_{r}.mp4") for r in range(len(canvases))]
+                    render_with_engine(
+                        engine, video_items, [], text_tracks, list(zip(canvases, run_paths)), lambda *args, **kwargs: None,
+                        window=run_window, include_audio=False,
+                        extra_video_args=slice_render.slice_video_args(canvases[0].fps) + (encode_args or []),
+                        progress=trace.frame_marker(update_status.frame_progress(30 + 50 * i / len(runs), 30 + 50 * (i + 1) / len(runs), f"Encoding run {i + 1}/{len(runs)}")),
+                        captions=captions, work_dir=seg_dir
+                    )
+                    store_run(i, run_paths)
+            if runs:
+                cache.commit() # Publish the new segments to every container
+
+            update_status("Joining segments...", 85)
+            uploaded_sizes = join_renditions(seg_paths, mix_audio(seg_dir), seg_dir)
+        elif len(windows) > 1:
+            # PARALLEL: video slices on separate workers, audio mixed once here
+            print(f"Parallel Render: {len(windows)} slices over {total_duration:.2f}s")
+            update_status(f"Rendering {len(windows)} slices in parallel...", 30)
+            slice_dir = workspace.dir("slices")
+
+            audio_path = mix_audio(slice_dir)
+            render_span = trace.stage("render", engine=engine, mode="parallel", slices=len(windows))
+
+            # Each slice worker returns one MP4 per rendition
+            slice_paths = [[] for _ in canvases]
+            for n, rendition_bytes in enumerate(render_slice_logic.map(windows, kwargs=slice_kwargs)):
+                for r, slice_bytes in enumerate(rendition_bytes):
+                    path = os.path.join(slice_dir, f"slice_{n:03d}_{r}.mp4")
+                    with open(path, "wb") as f: f.write(slice_bytes)
+                    render_span.add_bytes(len(slice_bytes))
+                    slice_paths[r].append(path)
+                update_status(f"Rendered slice {n + 1}/{len(windows)}", 30 + int(50 * (n + 1) / len(windows)))
+
+            update_status("Joining slices...", 85)
+            uploaded_sizes = join_renditions(slice_paths, audio_path, slice_dir)
+        elif stream_upload:
+            # Encoder -> FIFO -> multipart upload: done one part after the last frame
+            update_status("Rendering and uploading...", 30)
+            render_span = trace.stage("render_upload", mode="stream")
+            engine, uploaded_sizes = render_streaming(
+                engine, video_items, audio_items, text_tracks, canvases, output_keys,
+                s3_client, r2_creds['bucket_name'], update_status, workspace.root, extra_video_args=encode_args,
+                progress=trace.frame_marker(update_status.frame_progress(75, 95, "Encoding + uploading")), captions=captions
+            )
+            render_span.set(engine=engine)
+            render_span.add_bytes(sum(uploaded_sizes))
         else:
-            print("ERROR: Output file was not created!")
+            # Every rendition from one decode of the sources (FFmpeg graph)
+            render_span = trace.stage("render", mode="single")
+            engine = render_with_engine(
+                engine, video_items, audio_items, text_tracks, list(zip(canvases, output_paths)), update_status,
+                extra_video_args=encode_args, progress=trace.frame_marker(update_status.frame_progress(75, 89)), captions=captions,
+                work_dir=workspace.root
+            )
+            render_span.set(engine=engine)
+            render_span.add_bytes(sum(os.path.getsize(p) for p in output_paths if os.path.exists(p)))
         
-        # Upload
-        print("Uploading rendered video...")
-        update_status("Uploading final video...", 90)
-        s3_client.upload_file(
-            output_path, 
-            r2_creds['bucket_name'], 
-            output_key,
-            ExtraArgs={'ContentType': 'video/mp4', 'ContentDisposition': 'inline'} # Allow Inline Playback (Fixes iOS Player)
-        )
+        if uploaded_sizes is None:
+            # Check generated file size
+            for output_path in output_paths:
+                if os.path.exists(output_path):
+                    size = os.path.getsize(output_path)
+                    print(f"Generated Video Size: {size} bytes ({output_path})")
+                    if size < 1000:
+                        print("WARNING: Video file is suspiciously small!")
+                else:
+                    print(f"ERROR: Output file was not created! ({output_path})")
+
+            # Upload
+            print("Uploading rendered video...")
+            update_status("Uploading final video...", 90)
+            span = trace.stage("upload")
+            for output_path, key in zip(output_paths, output_keys):
+                span.add_bytes(os.path.getsize(output_path))
+                s3_client.upload_file(
+                    output_path, 
+                    r2_creds['bucket_name'], 
+                    key,
+                    ExtraArgs={'ContentType': 'video/mp4', 'ContentDisposition': 'inline'} # Allow Inline Playback (Fixes iOS Player)
+                )
+        else:
+            print(f"Streamed Video Sizes: {uploaded_sizes} bytes")
+        trace.end()
+
+        renditions = []
+        for canvas, key in zip(canvases, output_keys):
+            renditions.append({
+                "key": key,
+                "output_url": f"https://pub-b1a4f641f6b640c9a03f5731f8362854.r2.dev/{key}",
+                "width": canvas.w,
+                "height": canvas.h
+            })
             
         # Upload Result JSON (Corrected for History API)
         result_key = f"{output_key}_result.json"
-        public_url = f"https://pub-b1a4f641f6b640c9a03f5731f8362854.r2.dev/{output_key}"
+        public_url = renditions[0]["output_url"]
         
         # summary from script (first 100 chars of first item)
         summary_text = "Video Render"
@@ -1096,6 +753,15 @@ def render_video_logic(request_data: dict, r2_creds: dict):
         result_data = {
             "status": "completed",
             "output_url": public_url,
+            "engine": engine,
+            "captions": captions,
+            "preview": preview,
+            "width": canvases[0].w,
+            "height": canvases[0].h,
+            "renditions": renditions,
+            "stream_upload": uploaded_sizes is not None,
+            "downloads": download_manifest,
+            "trace": trace.summary(),
             "key": output_key,
             "script": request_data.get('script', []),
             "summary": summary_text,
@@ -1104,6 +770,7 @@ def render_video_logic(request_data: dict, r2_creds: dict):
         }
         
         print(f"Uploading result manifest to {result_key}...")
+        trace.stage("publish")
         s3_client.put_object(
             Bucket=r2_creds['bucket_name'],
             Key=result_key,
@@ -1111,27 +778,94 @@ def render_video_logic(request_data: dict, r2_creds: dict):
             ContentType='application/json'
         )
 
+        if dedup is not None:
+            # Answer identical requests from now on (and hand the output to those that attached meanwhile).
+            # Also recorded under the hash with asset identities from the now-warm cache, so the
+            # next press matches even if the endpoint saw these assets uncached this time.
+            try:
+                content_key = render_dedup.timeline_hash(request_data, render_dedup.cached_asset_resolver(cache))
+                shared_result = {k: v for k, v in result_data.items() if k not in ('downloads', 'key', 'script', 'summary', 'timestamp', 'userId')}
+                entry, followers = render_dedup.finish(dedup, [timeline_key, content_key], output_key, renditions, shared_result)
+                for follower in followers:
+                    try:
+                        publish_duplicate(s3_client, r2_creds['bucket_name'], entry, follower)
+                    except Exception as e:
+                        print(f"Failed to publish render to {follower['output_key']}: {e}")
+            except Exception as e:
+                print(f"Render de-dup bookkeeping failed: {e}")
+
         print("Render Success!")
+        trace.end()
         update_status("Finalizing...", 100, status="finished")
-        return {"status": "completed", "key": output_key}
+        return {"status": "completed", "key": output_key, "keys": output_keys}
 
     except Exception as e:
         print(f"Render Failed: {e}")
         import traceback
         traceback.print_exc()
+        if dedup is not None:
+            try:
+                render_dedup.release(dedup, timeline_key, modal.current_function_call_id())
+            except Exception as release_err:
+                print(f"Failed to release render de-dup entry: {release_err}")
+        trace.end(e)
+        update_status(f"Render failed: {e}", status="failed")
         return {"status": "failed", "error": str(e)}
+    finally:
+        update_status.close() # Writes the last status before the container can go away
+        workspace.close()
+        trace.emit(s3_client, r2_creds['bucket_name'])
+
+@app.function(image=render_image, timeout=1800, volumes={"/cache": asset_cache_volume}, enable_memory_snapshot=True)
+def render_slice_logic(window: list, request_data: dict, engine: str):
+    # Renders ONE GOP-aligned time slice [t0, t1) of the timeline (video only - the
+    # coordinator mixes audio once over the full duration) for every rendition and
+    # returns the MP4 bytes of each, in render_canvases order.
+    from render_timeline import sort_video_tracks, render_canvases, PREVIEW_VIDEO_ARGS
+    from asset_downloader import download_tracks
+    from asset_cache import AssetCache
+    from workspace import Workspace
+    from ass_subtitles import caption_mode
+    import slice_render
+
+    t0, t1 = window
+    canvases = render_canvases(request_data)
+    print(f"Rendering slice {t0:.2f}s - {t1:.2f}s with {engine} on {canvases}")
+
+    video_tracks = sort_video_tracks(list(request_data.get('video_tracks', [])))
+    text_tracks = request_data.get('text_tracks', [])
+
+    with Workspace("slice") as workspace:
+        video_items, _, _ = download_tracks(
+            video_tracks, [], workspace.dir("assets"), window=(t0, t1), cache=AssetCache(volume=asset_cache_volume)
+        )
+        outputs = [(canvas, workspace.path(f"slice_{r}.mp4")) for r, canvas in enumerate(canvases)]
+        render_with_engine(
+            engine, video_items, [], text_tracks, outputs, lambda *args, **kwargs: None,
+            window=(t0, t1), include_audio=False,
+            extra_video_args=slice_render.slice_video_args(canvases[0].fps) + (PREVIEW_VIDEO_ARGS if request_data.get('preview') else []),
+            captions=caption_mode(request_data.get('captions')), work_dir=workspace.root
+        )
+        slices = []
+        for _, output_path in outputs:
+            with open(output_path, "rb") as f:
+                slices.append(f.read())
+        return slices
 
-@app.function(image=image, gpu="T4", timeout=1800)
+@app.function(image=image, gpu="T4", timeout=1800, volumes={"/cache": asset_cache_volume}, allow_concurrent_inputs=IO_CONCURRENT_INPUTS) # No memory snapshot: GPU containers can't restore one
 def process_video_logic(video_url: str, output_key: str, api_key: str, r2_credentials: dict):
     # ... (Rest of logic identical to before)
     import ffmpeg
-    import requests
     import os
     import time
     import json
     import boto3
     import google.generativeai as genai
     import traceback
+    from asset_downloader import download_asset
+    from asset_cache import AssetCache
+    from tracing import Trace
+    from workspace import Workspace
     
     # Setup R2 Client
     def get_r2_client():
@@ -1150,8 +884,12 @@ def process_video_logic(video_url: str, output_key: str, api_key: str, r2_creden
     error_key = f"{base_name}_error.json"
     
     print(f"Processing video: {video_url}")
+    trace = Trace("analysis", output_key=output_key)
+    workspace = Workspace("analysis")
+    r2 = None
     
     try:
+        trace.stage("prepare")
         r2 = get_r2_client()
         
         # 0. Upload STARTED marker
@@ -1165,26 +903,31 @@ def process_video_logic(video_url: str, output_key: str, api_key: str, r2_creden
         # Configure Gemini
         genai.configure(api_key=api_key)
         
-        local_input = "/tmp/input.mp4"
-        local_output = "/tmp/output.mp4"
-        json_output_path = "/tmp/result.json"
+        local_input = workspace.path("input.mp4")
         
-        # 1. Download Video
-        try:
-            response = requests.get(video_url, stream=True, timeout=60)
-            response.raise_for_status()
-            with open(local_input, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print("Download complete.")
-        except Exception as e:
-            raise RuntimeError(f"Download failed: {str(e)}")
+        # 1. Download Video (through the shared asset cache)
+        span = trace.stage("download")
+        cache = AssetCache(volume=asset_cache_volume)
+        cache.reload()
+        download_manifest = []
+        downloaded = download_asset(video_url, "input", workspace.root, download_manifest, cache=cache)
+        cache.commit()
+        if not downloaded:
+            raise RuntimeError("Download failed")
+        span.add_bytes(download_manifest[0]['bytes'])
+        span.set(cached=download_manifest[0].get('cached', False))
+        if downloaded != local_input:
+            os.replace(downloaded, local_input)
+        print("Download complete.")
 
         # 2. Upload to Gemini File API
         print("Uploading to Gemini File API...")
+        span = trace.stage("gemini_upload")
+        span.add_bytes(os.path.getsize(local_input))
         video_file = genai.upload_file(path=local_input)
         
         # Wait for processing
+        trace.stage("gemini_processing")
         while video_file.state.name == "PROCESSING":
             time.sleep(2)
             video_file = genai.get_file(video_file.name)
@@ -1208,8 +951,13 @@ def process_video_logic(video_url: str, output_key: str, api_key: str, r2_creden
         - 'virality_score' (number)
         """
         
+        span = trace.stage("gemini_generate", model="gemini-2.5-pro")
         response = model.generate_content([video_file, prompt], request_options={"timeout": 600})
         print(f"Gemini usage: {response.usage_metadata}")
+        try:
+            span.set(prompt_tokens=response.usage_metadata.prompt_token_count, output_tokens=response.usage_metadata.candidates_token_count)
+        except Exception:
+            pass
         
         # 4. Parse Result
         result_text = response.text.replace("```json", "").replace("```", "").strip()
@@ -1224,10 +972,12 @@ def process_video_logic(video_url: str, output_key: str, api_key: str, r2_creden
             print(f"Skipped TTS: {e}")
             
         # 6. Save Result to R2
+        trace.end()
         final_result_data = {
             "status": "completed",
             "video_url": video_url,
             "analysis": analysis_result_json, # Use the parsed and potentially augmented JSON
+            "trace": trace.summary(),
             "timestamp": time.time()
         }
         
@@ -1241,10 +991,12 @@ def process_video_logic(video_url: str, output_key: str, api_key: str, r2_creden
         
     except Exception as e:
         print(f"Error processing video: {e}")
+        trace.end(e)
         # Save error to R2
         error_data = {
             "error": str(e), 
             "traceback": traceback.format_exc(),
+            "trace": trace.summary(),
             "status": "failed"
         }
         try:
@@ -1257,7 +1009,10 @@ def process_video_logic(video_url: str, output_key: str, api_key: str, r2_creden
             print("Uploaded ERROR marker.")
         except Exception as upload_err:
             print(f"Failed to upload error marker: {upload_err}")
-            
+    finally:
+        workspace.close()
+
+    trace.emit(r2, r2_credentials['bucket_name'])
     return {"status": "finished"}
 
 @app.function(image=light_image)
@@ -1275,7 +1030,7 @@ def process_video(item: VideoRequest):
     call = process_video_logic.spawn(item.video_url, item.output_key, item.api_key, r2_creds)
     return {"status": "started", "call_id": call.object_id}
 
-@app.function(image=light_image)
+@app.function(image=light_image, volumes={"/cache": asset_cache_volume}) # Asset cache: content identities for the timeline hash
 @web_endpoint(method="POST")
 def render_video(item: RenderRequest):
     r2_creds = {
@@ -1291,11 +1046,66 @@ def render_video(item: RenderRequest):
         "text_tracks": item.text_tracks, # Fixed: Forward text_tracks
         "script": item.script,
         "output_key": item.output_key,
-        "userId": item.userId # Forward to logic
+        "userId": item.userId, # Forward to logic
+        "engine": item.engine,
+        "parallel": item.parallel,
+        "preview": item.preview,
+        "width": item.width,
+        "height": item.height,
+        "formats": item.formats,
+        "stream_upload": item.stream_upload,
+        "segment_cache": item.segment_cache,
+        "captions": item.captions,
+        "stream_copy": item.stream_copy
     }
     
+    if not item.dedup:
+        call = render_video_logic.spawn(request_data, r2_creds)
+        return {"status": "rendering_started", "call_id": call.object_id}
+
+    # De-duplicate: identical timeline already rendered / rendering? (see render_dedup.py)
+    import boto3
+    import render_dedup
+    from asset_cache import AssetCache
+
+    cache = AssetCache(volume=asset_cache_volume)
+    cache.reload()
+    try:
+        timeline_key = render_dedup.timeline_hash(request_data, render_dedup.validated_asset_resolver(cache, request_data))
+    except render_dedup.UnconfirmedAsset as e:
+        print(f"Not de-duplicating: can't confirm what {e} holds now")
+        call = render_video_logic.spawn(request_data, r2_creds)
+        return {"status": "rendering_started", "call_id": call.object_id}
+    request_data["timeline_hash"] = timeline_key
+    dedup = render_dedup.open_dict()
+    follower = {"output_key": item.output_key, "formats": item.formats, "userId": item.userId, "script": item.script}
+
+    entry = render_dedup.lookup(dedup, timeline_key)
+    if entry and entry['status'] == 'running':
+        render_dedup.attach(dedup, timeline_key, follower)
+        # It may have finished between the two reads: then serve the output ourselves (below)
+        entry = render_dedup.lookup(dedup, timeline_key)
+        if entry and entry['status'] == 'running':
+            print(f"Timeline {timeline_key[:12]} is already rendering ({entry['call_id']}): attached {item.output_key}")
+            return {"status": "rendering_started", "call_id": entry['call_id'], "deduplicated": True, "timeline_hash": timeline_key}
+
+    if entry and entry['status'] == 'finished':
+        try:
+            s3_client = boto3.client(
+                's3',
+                endpoint_url=f"https://{r2_creds['account_id']}.r2.cloudflarestorage.com",
+                aws_access_key_id=r2_creds['access_key_id'],
+                aws_secret_access_key=r2_creds['secret_access_key'],
+                region_name='auto'
+            )
+            publish_duplicate(s3_client, r2_creds['bucket_name'], entry, follower)
+            return {"status": "finished", "deduplicated": True, "timeline_hash": timeline_key}
+        except Exception as e:
+            print(f"Reusing render {entry['output_key']} failed: {e}. Rendering again.") # e.g. output already cleaned up
+
     call = render_video_logic.spawn(request_data, r2_creds)
-    return {"status": "rendering_started", "call_id": call.object_id}
+    render_dedup.claim(dedup, timeline_key, call.object_id, item.output_key)
+    return {"status": "rendering_started", "call_id": call.object_id, "timeline_hash": timeline_key}
 
 @app.function(image=light_image, timeout=600)
 @web_endpoint(method="POST")
@@ -1303,7 +1113,14 @@ def generate_subtitles(item: SubtitleRequest):
      request_data = {
         "video_tracks": item.video_tracks,
         "audio_tracks": item.audio_tracks,
-        "api_key": item.api_key
+        "api_key": item.api_key,
+        # Only used to store the job's trace (traces/...)
+        "r2_creds": {
+            "account_id": item.r2_account_id,
+            "access_key_id": item.r2_access_key_id,
+            "secret_access_key": item.r2_secret_access_key,
+            "bucket_name": item.r2_bucket_name
+        }
     }
      result = generate_subtitles_logic.remote(request_data)
      return result
@@ -1348,6 +1165,7 @@ def cleanup_old_files():
         deleted_count = 0
         now = datetime.utcnow()
         retention_period = timedelta(hours=48) 
+        trace_retention_period = timedelta(days=30) # Job traces (tracing.py) are kept for aggregation
 
         for page in page_iterator:
             if 'Contents' not in page:
@@ -1364,7 +1182,7 @@ def cleanup_old_files():
                 
                 # Check age
                 age = now - last_modified
-                if age > retention_period:
+                if age > (trace_retention_period if key.startswith("traces/") else retention_period):
                     # Broader Cleanup: Delete everything old that isn't stock
                     # This includes uploads/, outputs/, status json files, etc.
                     print(f"Deleting old file: {key} (Age: {age})")
@@ -1378,7 +1196,7 @@ def cleanup_old_files():
         import traceback
         traceback.print_exc()
 
-@app.function(image=image, timeout=600, cpu=8.0, memory=8192)
+@app.function(image=image, timeout=600, cpu=8.0, memory=8192, enable_memory_snapshot=True)
 @web_endpoint(method="POST")
 async def analyze_faces(file: UploadFile = File(...)):
     import tempfile
@@ -1386,13 +1204,17 @@ async def analyze_faces(file: UploadFile = File(...)):
     import os
     import cv2
     import mediapipe as mp
+    from tracing import Trace
     
     print(f"Analyzing faces in video: {file.filename}")
+    trace = Trace("faces", filename=file.filename)
 
     # Save uploaded file
+    span = trace.stage("receive")
     with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video:
         shutil.copyfileobj(file.file, temp_video)
         temp_video_path = temp_video.name
+    span.add_bytes(os.path.getsize(temp_video_path))
         
     try:
         # Determine if MediaPipe is available (for main thread logging/decision)
@@ -1485,9 +1307,12 @@ async def analyze_faces(file: UploadFile = File(...)):
 
             # Upload Video
             print("Uploading video to Gemini...")
+            span = trace.stage("gemini_upload")
+            span.add_bytes(os.path.getsize(video_path))
             video_file = genai.upload_file(path=video_path)
             
             # Wait for processing
+            trace.stage("gemini_processing")
             while video_file.state.name == "PROCESSING":
                 print('.', end='', flush=True)
                 time.sleep(1)
@@ -1542,6 +1367,7 @@ async def analyze_faces(file: UploadFile = File(...)):
             - Provide tracking data every 0.5 seconds.
             """
             
+            trace.stage("gemini_generate", model=model.model_name)
             response = model.generate_content(
                 [prompt, video_file],
                 generation_config={"response_mime_type": "application/json"}
@@ -1592,6 +1418,7 @@ async def analyze_faces(file: UploadFile = File(...)):
         diarization_result = gemini_result.get("diarization", [])
         
         # Calculate Real Duration using OpenCV
+        trace.stage("probe")
         import cv2
         real_duration = 60
         try:
@@ -1609,20 +1436,24 @@ async def analyze_faces(file: UploadFile = File(...)):
         max_faces_detected = 2 # Assume 2 for podcast mode if Gemini succeeds
         suggested_layout = "split" if max_faces_detected > 1 else "focus"
 
+        trace.end()
         return {
             "duration": duration,
             "max_faces_detected": max_faces_detected,
             "suggested_layout": suggested_layout,
             "tracking_data": face_tracking,
-            "diarization": diarization_result
+            "diarization": diarization_result,
+            "trace": trace.summary()
         }
 
     except Exception as e:
         print(f"Analysis Error: {str(e)}")
         import traceback
         traceback.print_exc()
-        return {"error": str(e)}
+        trace.end(e)
+        return {"error": str(e), "trace": trace.summary()}
     finally:
+        trace.emit() # No R2 credentials here: log only
         # Cleanup
         if 'cap' in locals() and cap.isOpened(): cap.release()
         try:
@@ -0,0 +1,77 @@
+# ffprobe helper. Results are cached per file: a render probes the same
+# asset several times (engine selection, graph building, audio mixing).
+import os
+import json
+import subprocess
+import threading
+
+_probe_cache = {}
+_probe_lock = threading.Lock() # Concurrent jobs in one container share the cache
+
+
+def probe_media(path):
+    """
+    Returns {"duration", "width", "height", "fps", "has_video", "has_audio"} for a local file.
+    width/height are display dimensions (rotation metadata applied, like ffmpeg's autorotate).
+    Missing values are None / False. Never raises.
+    """
+    # Key on (path, size, mtime): warm containers reuse names like vid_0.mp4 for other files
+    try:
+        st = os.stat(path)
+        cache_key = (path, st.st_size, st.st_mtime)
+    except OSError:
+        cache_key = (path, None, None)
+    with _probe_lock:
+        cached = _probe_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    info = {"duration": None, "width": None, "height": None, "fps": None, "has_video": False, "has_audio": False}
+    try:
+        out = subprocess.run([
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration:stream=codec_type,width,height,avg_frame_rate,duration:stream_tags=rotate:stream_side_data=rotation",
+            "-of", "json", path
+        ], check=True, capture_output=True, text=True, timeout=60).stdout
+        data = json.loads(out or "{}")
+
+        for stream in data.get('streams', []):
+            if stream.get('codec_type') == 'video' and not info['has_video']:
+                info['has_video'] = True
+                info['width'] = stream.get('width')
+                info['height'] = stream.get('height')
+                try:
+                    num, den = stream.get('avg_frame_rate', '0/0').split('/')
+                    info['fps'] = float(num) / float(den) if float(den) else None
+                except Exception:
+                    pass
+                # Phone footage: portrait stored as landscape + rotation metadata
+                rotation = (stream.get('tags') or {}).get('rotate')
+                for side_data in stream.get('side_data_list') or []:
+                    if side_data.get('rotation') is not None:
+                        rotation = side_data['rotation']
+                try:
+                    if rotation is not None and int(float(rotation)) % 180 != 0:
+                        info['width'], info['height'] = info['height'], info['width']
+                except (TypeError, ValueError):
+                    pass
+            elif stream.get('codec_type') == 'audio':
+                info['has_audio'] = True
+
+        duration = (data.get('format') or {}).get('duration')
+        if duration is not None:
+            info['duration'] = float(duration)
+    except Exception as e:
+        print(f"Probe Failed for {path}: {e}")
+
+    with _probe_lock:
+        _probe_cache[cache_key] = info
+    return info
+
+
+def forget_probes(directory):
+    """Drops cached results for files under directory (a finished job's workspace)."""
+    prefix = os.path.join(directory, "")
+    with _probe_lock:
+        for key in [k for k in _probe_cache if k[0].startswith(prefix)]:
+            del _probe_cache[key]
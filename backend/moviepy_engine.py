@@ -0,0 +1,310 @@
+# MoviePy render engine (frame-by-frame compositing in Python).
+# Slow, but supports every effect the Studio can produce, so it is the
+# fallback whenever the FFmpeg graph engine can't express a timeline.
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+
+from render_timeline import DEFAULT_CANVAS, is_image_track, has_custom_layout, resolve_custom_layout, text_anchor, background_video_filter, video_clip_span, track_offset, timeline_duration
+from media_probe import probe_media
+from video_readers import DecoderPool, decoder_clip
+from text_raster import resolve_text_style, render_text_array
+from compositor import index_composite, write_composite
+from animations import animated_text_clip, animation_seed, BitmapLRU, BITMAP_CACHE_BYTES
+from ass_subtitles import caption_filter
+from streaming_upload import is_stream_output
+import audio_mixer
+
+
+@lru_cache(maxsize=None)
+def load_moviepy():
+    # Once per process (main.py calls it at container start, see image.imports()).
+    # The image pins moviepy==1.0.3, so there is one import path to try.
+    # Monkeypatch PIL.Image.ANTIALIAS for MoviePy 1.0.3 compatibility with Pillow 10+
+    import PIL.Image
+    if not hasattr(PIL.Image, 'ANTIALIAS'):
+        PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
+
+    # Configure ImageMagick for TextClip (also set in the image env, for local runs)
+    from moviepy.config import change_settings
+    change_settings({"IMAGEMAGICK_BINARY": "/usr/bin/convert"})
+
+    from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip, CompositeAudioClip, TextClip, ColorClip, ImageClip
+    return {
+        "VideoFileClip": VideoFileClip, "AudioFileClip": AudioFileClip,
+        "CompositeVideoClip": CompositeVideoClip, "CompositeAudioClip": CompositeAudioClip,
+        "TextClip": TextClip, "ColorClip": ColorClip, "ImageClip": ImageClip
+    }
+
+
+def _load_video(track_data, local_path, duration, decoders, canvas):
+    """
+    Video layer decoded by ffmpeg at the output fps. Fullscreen backgrounds come out
+    of the decoder already cover-scaled and cropped to the canvas; custom layouts
+    keep the source size (MoviePy resizes them below). Picture only: the
+    soundtrack is mixed separately (audio_mixer).
+    """
+    info = probe_media(local_path)
+    if not info['has_video'] or not info['width'] or not info['height']:
+        raise ValueError("no decodable video stream")
+
+    span = video_clip_span(track_data, local_path)
+    if span is None:
+        raise ValueError("offset is past the end of the source")
+    clip_duration = span[1] - span[0]
+    offset = track_offset(track_data)
+    # Timeline span: the pool starts the decoder just before it and closes it after
+    start = track_data.get('start', 0)
+
+    if has_custom_layout(track_data, False):
+        decoder = decoders.open(local_path, (info['width'], info['height']), offset=offset, fps=canvas.fps, start=start, duration=clip_duration)
+    else:
+        decoder = decoders.open(local_path, (canvas.w, canvas.h), background_video_filter(canvas), offset=offset, fps=canvas.fps, start=start, duration=clip_duration)
+    return decoder_clip(decoder, clip_duration)
+
+
+def _clip_to_rgba(clip):
+    # Fallback text clips (TextClip / ColorClip) -> one RGBA bitmap for the animation engine
+    import numpy as np
+    frame = clip.get_frame(0)
+    if frame.shape[2] == 4:
+        return frame.astype('uint8')
+    alpha = 255 * clip.mask.get_frame(0) if clip.mask is not None else np.full(frame.shape[:2], 255)
+    return np.dstack([frame, alpha]).astype('uint8')
+
+
+def build_composite(video_items, audio_items, text_tracks, update_status, decoders, canvas=DEFAULT_CANVAS, captions='bitmap'):
+    """
+    Builds the MoviePy CompositeVideoClip (picture only) for the timeline.
+    video_items / audio_items: [(track_data, local_path)] (video_items already layer-sorted).
+    decoders: DecoderPool owning the ffmpeg readers of the video tracks (caller closes it).
+    canvas: output size / fps / layout scale (render_timeline.Canvas).
+    """
+    mp = load_moviepy()
+    ImageClip, CompositeVideoClip, ColorClip = mp['ImageClip'], mp['CompositeVideoClip'], mp['ColorClip']
+
+    clips_to_composite = []
+    max_duration = 0
+
+    # 1. Process Video Tracks
+    for track_data, local_path in video_items:
+        start_time = track_data.get('start', 0)
+        duration = track_data.get('duration', 0)
+
+        # Robust Load
+        is_image = is_image_track(track_data, local_path)
+        try:
+            if is_image:
+                print(f"Detected Image: {local_path}")
+                clip = ImageClip(local_path)
+                # Images need explicit duration
+                if duration <= 0: duration = 5
+                clip = clip.set_duration(duration)
+            else:
+                print(f"Loading Video: {local_path}")
+                clip = _load_video(track_data, local_path, duration, decoders, canvas)
+        except Exception as e:
+            print(f"Failed to load clip {local_path}: {e}")
+            continue
+
+        clip = clip.set_start(start_time)
+
+        # --- RESIZE & COMPOSE LOGIC ---
+        if has_custom_layout(track_data, is_image):
+            # IMAGE / BUBBLE / SPLIT SCREEN SPECS
+            layout = resolve_custom_layout(track_data, canvas)
+
+            # 1. Size / Scale
+            size = layout['size']
+            if size is not None:
+                if size[0] == 'box':
+                    # MoviePy resize(newsize=(w,h)) distorts - Split Screen wants the exact box.
+                    clip = clip.resize(newsize=(size[1], size[2]))
+                elif size[0] == 'width':
+                    clip = clip.resize(width=size[1])
+                elif size[0] == 'height':
+                    clip = clip.resize(height=size[1])
+                else:
+                    clip = clip.resize(size[1])
+
+            # 2. Rotation
+            if layout['rotation'] != 0:
+                clip = clip.rotate(layout['rotation'])
+
+            # 3. Position
+            pos_x, pos_y = layout['position']
+            if pos_x == "center" and pos_y == "center":
+                # Default Center
+                clip = clip.set_position("center")
+            else:
+                clip = clip.set_position((pos_x, pos_y))
+        # else: BACKGROUND VIDEO - already scaled/cropped to the canvas by its decoder
+
+        clips_to_composite.append(clip)
+
+        if start_time + duration > max_duration:
+            max_duration = start_time + duration
+
+    # 2. Audio Tracks: mixed by audio_mixer, they only extend the timeline here
+    for track_data, local_path in audio_items:
+        start_time = track_data.get('start', 0)
+        duration = track_data.get('duration', 0)
+        if start_time + duration > max_duration:
+            max_duration = start_time + duration
+
+    # 3. Process Text Tracks (Subtitles; ASS captions are burned in by the encoder instead, see _render)
+    bitmaps = BitmapLRU(BITMAP_CACHE_BYTES) # Resampled caption frames, freed with this composite
+    for track in (text_tracks if captions != 'ass' else []):
+        try:
+            spec = resolve_text_style(track, canvas)
+            if not spec: continue
+
+            start, duration = spec['start'], spec['duration']
+            print(f"Style Debug: {spec['style']}")
+            print("Generating Output using PILLOW (Pure Python)...")
+
+            # Cached RGBA array (no PNG round trip)
+            img_array = render_text_array(spec)
+
+            if img_array is None:
+                # ULTIMATE SAFETY NET: MoviePy Caption (Visible but Ugly)
+                print("CRITICAL: PIL failed. Reverting to MoviePy 'caption' fallback.")
+                try:
+                    # This works reliably but ignores strokes/uppercase often
+                    txt_clip = mp['TextClip'](
+                            spec['text'],
+                            fontsize=max(1, int(spec['font_size'] * canvas.scale)),
+                            color=spec['color'],
+                            font="Arial",
+                            method='caption',
+                            size=(int(900 * canvas.scale), None)
+                    )
+                except Exception as e3:
+                    print(f"Final Fallback Failed: {e3}")
+                    # Empty clip to prevent crash
+                    txt_clip = ColorClip(size=(100,100), color=(0,0,0,0), duration=duration)
+                img_array = _clip_to_rgba(txt_clip)
+
+            # Calculate absolute center target, then convert to top-left pivot
+            pos_x, pos_y = text_anchor(track, spec['style'])
+            final_x = pos_x * canvas.w - (img_array.shape[1] / 2)
+            final_y = pos_y * canvas.h - (img_array.shape[0] / 2)
+
+            # ANIMATION: precomputed per-frame transforms (see animations.py)
+            txt_clip = animated_text_clip(
+                img_array, spec['animation'], start, duration, final_x, final_y,
+                seed=animation_seed(spec['text'], start), canvas=canvas, bitmaps=bitmaps
+            )
+            clips_to_composite.append(txt_clip)
+        except Exception as e:
+            print(f"Failed to render text track: {e}")
+
+    # ASS captions have no layer here, but they still count as visuals and set the length
+    burned_captions = [t for t in text_tracks if t.get('text')] if captions == 'ass' else []
+    for track in burned_captions:
+        max_duration = max(max_duration, track.get('start', 0) + track.get('duration', 2))
+
+    if not clips_to_composite and not burned_captions:
+        print("WARNING: No video clips were loaded! Creating a placeholder.")
+        # Create a placeholder to avoid crash, but log it
+        max_duration = 5
+        clips_to_composite.append(ColorClip(size=(canvas.w, canvas.h), color=(255,0,0), duration=max_duration))
+
+    # COMPOSITE
+    update_status("Compositing video layers...", 60)
+    print(f"Compositing {len(clips_to_composite)} video clips...")
+    bg_clip = ColorClip(size=(canvas.w, canvas.h), color=(0,0,0), duration=max_duration)
+    # Each frame only visits the layers active at t (same order as the sort above)
+    return index_composite(CompositeVideoClip([bg_clip] + clips_to_composite))
+
+
+def render(video_items, audio_items, text_tracks, output_path, update_status, window=None, include_audio=True, extra_video_args=None, canvas=DEFAULT_CANVAS, progress=None, captions='bitmap', work_dir=None):
+    """
+    Renders the timeline with MoviePy.
+    window: (t0, t1) to render only part of the timeline (default: everything).
+    extra_video_args: appended to the x264 ffmpeg_params (e.g. fixed GOP for slices).
+    canvas: output size / fps (render_timeline.Canvas, e.g. a preview canvas).
+    captions: 'bitmap' (Pillow layers) or 'ass' (libass in the encoder, see ass_subtitles).
+    """
+    render_renditions(video_items, audio_items, text_tracks, [(canvas, output_path)], update_status,
+                      window=window, include_audio=include_audio, extra_video_args=extra_video_args, progress=progress,
+                      captions=captions, work_dir=work_dir)
+
+
+def render_renditions(video_items, audio_items, text_tracks, outputs, update_status, window=None, include_audio=True, extra_video_args=None, progress=None, captions='bitmap', work_dir=None):
+    """
+    Renders every rendition in outputs = [(canvas, output_path)].
+    MoviePy composites one canvas per pass, so each rendition is a separate render
+    (only timelines the FFmpeg graph can't express end up here); the soundtrack
+    is mixed once and muxed into all of them.
+    progress: optional progress(frames_done, total_frames) over all renditions.
+    work_dir: where the render's scratch directory goes (the job's workspace; default: the system temp dir).
+    """
+    scratch_dir = tempfile.mkdtemp(prefix="mpaudio_", dir=work_dir)
+    try:
+        audio_path = None
+        if include_audio:
+            update_status("Mixing audio...", 40)
+            audio_path = os.path.join(scratch_dir, "audio.m4a")
+            mix_window = window or (0, timeline_duration(video_items, audio_items, text_tracks))
+            if not audio_mixer.render_audio(video_items, audio_items, audio_path, window=mix_window):
+                audio_path = None
+
+        for r, (canvas, output_path) in enumerate(outputs):
+            # Renditions encode one after another: count their frames as one run
+            rendition_progress = None
+            if progress is not None:
+                rendition_progress = lambda done, total, r=r: progress(r * total + done, len(outputs) * total)
+            decoders = DecoderPool()
+            try:
+                _render(video_items, audio_items if include_audio else [], text_tracks, output_path, update_status,
+                        window, audio_path, extra_video_args, decoders, canvas, rendition_progress,
+                        captions=captions, work_dir=scratch_dir)
+            finally:
+                decoders.close()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _render(video_items, audio_items, text_tracks, output_path, update_status, window, audio_path, extra_video_args, decoders, canvas, progress=None, captions='bitmap', work_dir=None):
+    # audio_path: premixed soundtrack of the window (or None for silent output)
+    final_video = build_composite(video_items, audio_items, text_tracks, update_status, decoders, canvas, captions)
+    ffmpeg_params = [
+        '-pix_fmt', 'yuv420p',
+        '-profile:v', 'baseline',
+        '-level', '3.0',
+        '-movflags', '+faststart'
+    ] + (extra_video_args or []) # Maximum iOS Compatibility
+    if captions == 'ass':
+        # The encoder burns every caption in one pass (both write paths start output time at window[0])
+        chain = caption_filter(text_tracks, canvas, work_dir or os.path.dirname(output_path) or ".",
+                               f"captions_{canvas.w}x{canvas.h}", window)
+        if chain:
+            ffmpeg_params += ['-vf', chain]
+
+    update_status("Encoding final video (this may take a while)...", 75)
+    try:
+        # Fast path: in-place NumPy compositing straight into an ffmpeg rawvideo pipe
+        write_composite(final_video, output_path, canvas.fps, ffmpeg_params, window=window, audio_path=audio_path, progress=progress, clock=decoders.advance)
+        return
+    except Exception as e:
+        if is_stream_output(output_path, extra_video_args):
+            # Part of the output is already uploaded: render_streaming starts over with fresh uploads
+            print(f"Frame compositor failed ({e}) writing to a streaming upload")
+            raise
+        print(f"Frame compositor failed ({e}). Falling back to MoviePy write_videofile...")
+
+    if window is not None:
+        final_video = final_video.subclip(window[0], window[1])
+
+    final_video.write_videofile(
+        output_path,
+        fps=canvas.fps,
+        codec='libx264',
+        audio=audio_path or False, # A filename is muxed as-is (-acodec copy)
+        threads=16, # Maximize CPU usage
+        preset='ultrafast', # Maximize Speed
+        ffmpeg_params=ffmpeg_params,
+        logger=None # Disable progress bar to prevent deadlocks
+    )
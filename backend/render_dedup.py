@@ -0,0 +1,217 @@
+# Render de-duplication.
+# Pressing Render twice (or re-rendering an unchanged project) must not start a
+# second render_video_logic. Each request is reduced to a hash of its canonical
+# timeline - tracks in render order, asset identities instead of (signed) URLs,
+# styles, resolution and renditions - and a shared modal.Dict remembers, per hash:
+#   {hash}            -> {status: running|finished, call_id, output_key, renditions, result, timestamp}
+#   {hash}:followers  -> [{output_key, formats, userId, script}] requests attached to the running render
+# The Dict has no compare-and-set, so two truly simultaneous requests can still
+# both render; that is the rare case and only costs the duplicate work.
+import json
+import time
+import hashlib
+
+from asset_cache import normalize_url
+
+DEDUP_DICT = "shortsalpha-render-dedup"
+VALIDATE_TIMEOUT = 10 # Seconds per URL check at the endpoint
+VALIDATE_WORKERS = 8
+FINISHED_MAX_AGE = 24 * 3600 # cleanup_old_files deletes outputs after 48h; stay well inside that
+RUNNING_MAX_AGE = 3600 # render_video_logic timeout
+
+# Editor-only fields: they don't change a single output pixel
+COSMETIC_KEYS = ('id', 'name', 'label', 'thumbnail', 'selected')
+# Request fields that shape the output (engine/parallel/stream_upload/stream_copy only change how it is produced)
+OUTPUT_FIELDS = ('width', 'height', 'preview', 'captions')
+URL_FIELDS = ('url', 'src') # Where a track's media comes from (asset_downloader reads url, else src)
+
+
+def _video_order(track):
+    # Same key as render_timeline.sort_video_tracks (stable sort, so ties keep request order)
+    return (track.get('trackIndex', 0), 0 if str(track.get('type', '')).lower() == 'video' else 1, track.get('start', 0))
+
+
+def canonical_track(track, resolve):
+    canonical = {k: v for k, v in track.items() if k not in COSMETIC_KEYS and v is not None}
+    for field in URL_FIELDS:
+        if canonical.get(field):
+            canonical[field] = resolve(canonical[field])
+    return canonical
+
+
+def cached_asset_resolver(cache):
+    """
+    Asset identity from the shared asset cache: the blob name is sha256(url + ETag)
+    or sha256(content), so it changes when the object does. Uncached URLs fall
+    back to the normalized URL (signature params stripped). Only as current as the
+    cache: use it once the job has downloaded (and so revalidated) its assets,
+    validated_asset_resolver before that.
+    """
+    def resolve(url):
+        entry = cache.lookup(url)
+        if entry:
+            return "blob:" + entry['blob']
+        return normalize_url(url)
+    return resolve
+
+
+class UnconfirmedAsset(Exception):
+    """A track URL whose current content can't be identified: the request is rendered without de-duplication."""
+
+
+def url_validator(url, timeout=VALIDATE_TIMEOUT):
+    """
+    ETag (else Last-Modified + size) of the object behind url, from a 1-byte ranged
+    GET (presigned URLs are signed for GET only, so no HEAD). None if it sends neither.
+    """
+    from urllib.request import Request, urlopen
+    with urlopen(Request(url, headers={"Range": "bytes=0-0"}), timeout=timeout) as r:
+        etag = r.headers.get("ETag")
+        modified = r.headers.get("Last-Modified")
+        size = r.headers.get("Content-Range", "").rpartition("/")[2] or r.headers.get("Content-Length")
+    if etag:
+        return etag
+    if modified and size and size != "*":
+        return f"{modified}|{size}"
+    return None
+
+
+def track_urls(request_data):
+    return list(dict.fromkeys(
+        t[field] for kind in ('video_tracks', 'audio_tracks', 'text_tracks')
+        for t in request_data.get(kind) or [] for field in URL_FIELDS if t.get(field)
+    ))
+
+
+def validated_asset_resolver(cache, request_data):
+    """
+    Like cached_asset_resolver, for requests whose assets haven't been fetched yet:
+    every URL of request_data is checked against its origin first (in parallel), so
+    an object replaced behind the same URL gets a new identity. A cached blob is
+    used only while its ETag still matches. Raises UnconfirmedAsset if a URL can't
+    be checked or has no validator.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def check(url):
+        if not url.lower().startswith(("http://", "https://")):
+            return None
+        try:
+            return url_validator(url)
+        except Exception as e:
+            print(f"Dedup: can't validate {normalize_url(url)}: {e}")
+            return None
+
+    urls = track_urls(request_data)
+    with ThreadPoolExecutor(max_workers=VALIDATE_WORKERS) as pool:
+        validators = dict(zip(urls, pool.map(check, urls)))
+
+    def resolve(url):
+        validator = validators.get(url)
+        if validator is None:
+            raise UnconfirmedAsset(normalize_url(url))
+        entry = cache.lookup(url)
+        if entry and entry.get('etag') == validator:
+            return "blob:" + entry['blob'] # Same identity the render records (see cached_asset_resolver)
+        return normalize_url(url) + "#" + validator
+    return resolve
+
+
+def canonical_timeline(request_data, resolve=normalize_url):
+    """The parts of a render request that decide the output, in a stable order."""
+    video = sorted(request_data.get('video_tracks') or [], key=_video_order)
+    # The mix is a sum, so audio order is irrelevant: sort by content
+    audio = sorted(
+        (canonical_track(t, resolve) for t in request_data.get('audio_tracks') or []),
+        key=lambda t: json.dumps(t, sort_keys=True, default=str)
+    )
+    canonical = {
+        "video_tracks": [canonical_track(t, resolve) for t in video],
+        "audio_tracks": audio,
+        # Text is drawn in request order (later tracks on top), so keep it
+        "text_tracks": [canonical_track(t, resolve) for t in request_data.get('text_tracks') or []],
+        # Extra renditions, minus where they get uploaded
+        "formats": [{k: v for k, v in f.items() if k != 'output_key'} for f in request_data.get('formats') or []]
+    }
+    for field in OUTPUT_FIELDS:
+        canonical[field] = request_data.get(field)
+    return canonical
+
+
+def timeline_hash(request_data, resolve=normalize_url):
+    blob = json.dumps(canonical_timeline(request_data, resolve), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def open_dict():
+    import modal
+    return modal.Dict.from_name(DEDUP_DICT, create_if_missing=True)
+
+
+def _followers_key(key):
+    return f"{key}:followers"
+
+
+def lookup(dedup, key):
+    """Returns the entry for a hash if it is still usable (a live render or a fresh output), else None."""
+    entry = dedup.get(key)
+    if not entry:
+        return None
+    age = time.time() - entry.get('timestamp', 0)
+    if entry.get('status') == 'finished':
+        return entry if age < FINISHED_MAX_AGE else None
+    if age > RUNNING_MAX_AGE or not _call_running(entry.get('call_id')):
+        return None
+    return entry
+
+
+def _call_running(call_id):
+    # get(timeout=0) raises a timeout while the call is still going; returns (or raises) once it ended
+    from modal.functions import FunctionCall
+    from modal.exception import TimeoutError as CallTimeout
+    try:
+        FunctionCall.from_id(call_id).get(timeout=0)
+    except CallTimeout:
+        return True
+    except Exception:
+        return False # Crashed / cancelled
+    return False # Finished, but never recorded a result (failed render)
+
+
+def claim(dedup, key, call_id, output_key):
+    dedup.put(key, {"status": "running", "call_id": call_id, "output_key": output_key, "timestamp": time.time()})
+
+
+def attach(dedup, key, follower):
+    # Read-modify-write: a follower added concurrently can be lost (it then simply keeps polling until timeout)
+    followers = dedup.get(_followers_key(key)) or []
+    followers.append(follower)
+    dedup.put(_followers_key(key), followers)
+
+
+def followers(dedup, key):
+    return dedup.get(_followers_key(key)) or []
+
+
+def finish(dedup, keys, output_key, renditions, result):
+    """Records a finished render under every hash it answers for. Returns (entry, attached followers) and clears the latter."""
+    entry = {"status": "finished", "output_key": output_key, "renditions": renditions, "result": result, "timestamp": time.time()}
+    attached = []
+    for key in dict.fromkeys(keys):
+        dedup.put(key, entry)
+        try:
+            attached += dedup.pop(_followers_key(key))
+        except KeyError:
+            pass
+    return entry, attached
+
+
+def release(dedup, key, call_id):
+    """A failed render gives its hash back, so the next press renders again."""
+    entry = dedup.get(key)
+    if entry and entry.get('status') == 'running' and entry.get('call_id') == call_id:
+        dedup.pop(key)
+        try:
+            dedup.pop(_followers_key(key))
+        except KeyError:
+            pass
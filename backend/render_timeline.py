@@ -0,0 +1,285 @@
+# Timeline helpers shared by the render engines (MoviePy + FFmpeg graph).
+# Both engines MUST agree on ordering and layout, so anything that decides
+# "where/when does this layer go" lives here instead of inside an engine.
+
+from media_probe import probe_media
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Canvas defaults (Studio is designed in 1080x1920 @ 30fps)
+CANVAS_W = 1080
+CANVAS_H = 1920
+FPS = 30
+
+# Preview renders: half resolution, half frame rate (~4x fewer pixels, 2x fewer frames)
+PREVIEW_SCALE = 0.5
+PREVIEW_FPS = 15
+# Looser rate control for previews: fewer bits to entropy-code and upload
+PREVIEW_VIDEO_ARGS = ['-crf', '30']
+
+
+class Canvas:
+    """
+    The raster a timeline is rendered onto. Track coordinates are authored in the
+    Studio's 1080x1920 space; every pixel quantity (px positions and sizes, font
+    sizes, stroke widths, animation offsets) is multiplied by `scale`, percentages
+    resolve against the real size, so a smaller canvas draws the same layout.
+    """
+
+    def __init__(self, width=CANVAS_W, height=CANVAS_H, fps=FPS):
+        self.w = int(width)
+        self.h = int(height)
+        self.fps = fps
+        self.scale = min(self.w / CANVAS_W, self.h / CANVAS_H)
+
+    def __repr__(self):
+        return f"Canvas({self.w}x{self.h} @ {self.fps}fps, scale {self.scale:g})"
+
+
+DEFAULT_CANVAS = Canvas()
+
+
+def _even(val):
+    # libx264 + yuv420p need even dimensions
+    return max(2, int(round(val / 2.0)) * 2)
+
+
+def preview_canvas(canvas=DEFAULT_CANVAS):
+    """Reduced-resolution, reduced-fps version of canvas with the same layout."""
+    return Canvas(_even(canvas.w * PREVIEW_SCALE), _even(canvas.h * PREVIEW_SCALE), PREVIEW_FPS)
+
+
+def render_canvas(request_data, output_format=None):
+    """
+    Canvas for a render job (request_data as forwarded by the render endpoint), or
+    for one entry of its 'formats' list ({"width": 1080, "height": 1080}).
+    """
+    output_format = output_format or request_data
+    try:
+        width = _even(float(output_format.get('width') or CANVAS_W))
+        height = _even(float(output_format.get('height') or CANVAS_H))
+    except (TypeError, ValueError):
+        print(f"Invalid output size {output_format.get('width')}x{output_format.get('height')}, using {CANVAS_W}x{CANVAS_H}")
+        width, height = CANVAS_W, CANVAS_H
+    canvas = Canvas(width, height)
+    if request_data.get('preview'):
+        return preview_canvas(canvas)
+    return canvas
+
+
+def render_canvases(request_data):
+    """Canvas of every rendition: the request's own width/height first, then each of 'formats'."""
+    return [render_canvas(request_data)] + [render_canvas(request_data, f) for f in request_data.get('formats') or []]
+
+
+def sort_video_tracks(video_tracks):
+    # SORTING - CRITICAL FOR LAYERING
+    # 1. Track Index (Lower = Bottom)
+    # 2. Type: Video (0) < Image (1). This ensures Background Videos are drawn BEFORE Data/Bubbles.
+    # 3. Start Time
+    video_tracks.sort(key=lambda x: (
+        x.get('trackIndex', 0),
+        0 if str(x.get('type', '')).lower() == 'video' else 1,
+        x.get('start', 0)
+    ))
+    return video_tracks
+
+
+def is_image_track(track_data, local_path):
+    # Check if image (explicit type or extension)
+    return track_data.get('type') == 'image' or local_path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def track_offset(track_data):
+    # Seconds into the source where the track begins (trimmed clips). Images ignore it.
+    try:
+        return max(0.0, float(track_data.get('offset', 0) or 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def track_volume(track_data):
+    # Gain of the track's audio (missing, null or malformed: unchanged)
+    volume = track_data.get('volume')
+    if volume is None:
+        return 1.0
+    try:
+        return float(volume) # 0 mutes (so no "or 1.0")
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def outside_window(track_data, window):
+    """
+    True if a track can't be visible in window (t0, t1). Judged from the request
+    alone (no probing), so tracks without a known duration are never ruled out.
+    """
+    if window is None: return False
+    start = float(track_data.get('start', 0) or 0)
+    duration = float(track_data.get('duration', 0) or 0)
+    return start >= window[1] or (duration > 0 and start + duration <= window[0])
+
+
+def video_clip_span(track_data, local_path):
+    """
+    (start, end) a video/image layer occupies on the timeline, or None if unreadable.
+    Images default to 5s; videos play for 'duration' but never past the end of the
+    source (counted from the track's offset).
+    """
+    start = float(track_data.get('start', 0) or 0)
+    duration = float(track_data.get('duration', 0) or 0)
+    if is_image_track(track_data, local_path):
+        # Images need explicit duration
+        return start, start + (duration if duration > 0 else 5)
+
+    info = probe_media(local_path)
+    if not info['has_video']:
+        return None
+    if info['duration']:
+        src_duration = info['duration'] - track_offset(track_data)
+        if src_duration <= 0:
+            return None # Offset past the end of the source
+    else:
+        src_duration = duration
+    return start, start + (duration if 0 < duration < src_duration else src_duration)
+
+
+def timeline_duration(video_items, audio_items, text_tracks):
+    """
+    Length of the final video, matching MoviePy's CompositeVideoClip:
+    the longest of every track's start+duration and every layer's actual end.
+    """
+    ends = []
+    has_visuals = False
+    for track_data, local_path in video_items:
+        start = float(track_data.get('start', 0) or 0)
+        duration = float(track_data.get('duration', 0) or 0)
+        span = video_clip_span(track_data, local_path)
+        if span is None: continue
+        has_visuals = True
+        ends.append(span[1])
+        if not is_image_track(track_data, local_path):
+            ends.append(start + duration)
+
+    for track_data, local_path in audio_items:
+        ends.append(float(track_data.get('start', 0) or 0) + float(track_data.get('duration', 0) or 0))
+
+    for track in text_tracks:
+        if not track.get('text'): continue
+        has_visuals = True
+        ends.append(float(track.get('start', 0) or 0) + float(track.get('duration', 2) or 0))
+
+    if not has_visuals:
+        # Placeholder clip (see engines)
+        return 5
+    return max(ends + [0])
+
+
+def background_video_filter(canvas=DEFAULT_CANVAS, fps=None):
+    """
+    FFmpeg filter chain for fullscreen (background) videos: cover-scale to fill the
+    canvas, crop centered horizontally and top aligned. Optional fps conversion.
+    """
+    w, h = canvas.w, canvas.h
+    chain = f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h}:(iw-{w})/2:0,setsar=1"
+    if fps:
+        chain += f",fps={fps}"
+    return chain
+
+
+def has_custom_layout(track_data, is_image):
+    # Determine if this track needs Custom Layout (Image, Bubble, or Split Screen Video)
+    # Conditions:
+    # 1. It is an Image
+    # 2. It has explicit 'style' props
+    # 3. It has explicit 'width'/'height' props
+    # 4. It has 'x' or 'y' props
+    return bool(is_image or track_data.get('style') or track_data.get('width') or track_data.get('x') or track_data.get('y'))
+
+
+def parse_dimension(val, total_pixels, scale=1.0):
+    # Helper for Percentage Parsing ("50%", "120px", 300)
+    # Percentages are of total_pixels; pixel values are Studio px, multiplied by scale (see Canvas)
+    if val is None: return None
+    if isinstance(val, (int, float)): return float(val) * scale
+    val_str = str(val).strip()
+    if val_str.endswith('%'):
+        try:
+            pct = float(val_str[:-1])
+            return (pct / 100.0) * total_pixels
+        except:
+            return None
+    try:
+        return float(val_str.replace('px', '')) * scale
+    except:
+        return None
+
+
+def resolve_custom_layout(track_data, canvas=DEFAULT_CANVAS):
+    """
+    Resolves size/rotation/position for an Image, Bubble or Split Screen track.
+    Returns a dict with:
+      size: ('box', w, h) | ('width', w) | ('height', h) | ('scale', s) | None
+            (in canvas pixels; unsized layers get ('scale', canvas.scale) on a scaled canvas)
+      rotation: degrees (counter-clockwise, MoviePy convention)
+      position: (x, y) where each axis is a float (top-left px) or "center"
+    """
+    style = track_data.get('style', {}) or {}
+
+    # 1. Size / Scale
+    target_w = parse_dimension(track_data.get('width') or style.get('width'), canvas.w, canvas.scale)
+    target_h = parse_dimension(track_data.get('height') or style.get('height'), canvas.h, canvas.scale)
+
+    scale = float(track_data.get('scale', 1.0) or 1.0)
+
+    # Resize Strategy
+    # If both provided, force resize to the box (Split Screen "fit this box")
+    size = None
+    if target_w is not None and target_h is not None:
+        size = ('box', target_w, target_h)
+    elif target_w is not None:
+        size = ('width', target_w * scale)
+    elif target_h is not None:
+        size = ('height', target_h * scale)
+    elif scale * canvas.scale != 1.0:
+        # Source pixels are Studio pixels too: shrink them with the canvas
+        size = ('scale', scale * canvas.scale)
+
+    # 2. Rotation
+    rotation = track_data.get('rotation', 0) or 0
+
+    # 3. Position
+    pos_x_val = track_data.get('x')
+    pos_y_val = track_data.get('y')
+
+    # Fallback
+    if pos_x_val is None: pos_x_val = style.get('x') or style.get('left')
+    if pos_y_val is None: pos_y_val = style.get('y') or style.get('top')
+
+    # Parse Percentages for Position
+    pos_x = parse_dimension(pos_x_val, canvas.w, canvas.scale)
+    pos_y = parse_dimension(pos_y_val, canvas.h, canvas.scale)
+
+    return {
+        "size": size,
+        "rotation": rotation,
+        "position": (
+            pos_x if pos_x is not None else "center",
+            pos_y if pos_y is not None else "center"
+        )
+    }
+
+
+def text_anchor(track, style):
+    # Positioning Logic
+    # Priority: Root positionX -> Style x -> Default (Center-Bottom)
+    # Returns the normalized (0-1) CENTER of the text block.
+    pos_x = track.get('positionX')
+    if pos_x is None: pos_x = style.get('x')
+
+    pos_y = track.get('positionY')
+    if pos_y is None: pos_y = style.get('y')
+
+    if pos_x is None: pos_x = 0.5
+    if pos_y is None: pos_y = 0.8
+    return pos_x, pos_y
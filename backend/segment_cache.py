@@ -0,0 +1,93 @@
+# Segment cache for re-renders.
+# With segment_cache on, the video is encoded on slice_render's fixed GOP grid and
+# kept as SEGMENT_SECONDS segments. Each segment is keyed by a hash of everything
+# that draws into its window - the layers active in it (render order, asset
+# identities), the canvas, engine and encoder settings - and stored by that name
+# in the shared asset cache. A re-render encodes only the runs of segments whose
+# key changed and stream-copies the rest through the concat demuxer, with one
+# audio mix over the full timeline (as for parallel slices).
+import os
+import json
+import hashlib
+import subprocess
+
+from render_timeline import outside_window
+from render_dedup import canonical_track
+from slice_render import GOP_SECONDS, plan_slices
+
+SEGMENT_SECONDS = 2 * GOP_SECONDS
+# Bump when the engines' output changes, so stale segments are never mixed into new renders
+SEGMENT_VERSION = 1
+
+
+def plan_segments(total_duration):
+    """[(t0, t1)] on the GOP grid; identical for every render of the same duration."""
+    return plan_slices(total_duration, SEGMENT_SECONDS)
+
+
+def segment_key(window, video_tracks, text_tracks, canvas, engine, encode_args, resolve, captions='bitmap'):
+    """
+    Hash of what renders window (t0, t1). video_tracks must be in render order;
+    tracks without a known duration count as active everywhere after their start.
+    """
+    layers = {
+        "version": SEGMENT_VERSION,
+        "window": [round(window[0], 3), round(window[1], 3)],
+        "video_tracks": [canonical_track(t, resolve) for t in video_tracks if not outside_window(t, window)],
+        "text_tracks": [canonical_track(t, resolve) for t in text_tracks if not outside_window(t, window)],
+        "canvas": [canvas.w, canvas.h, canvas.fps],
+        "engine": engine,
+        "encode_args": list(encode_args or [])
+    }
+    if captions != 'bitmap':
+        # Only added when set, so segments cached before caption modes keep their keys
+        layers["captions"] = captions
+    blob = json.dumps(layers, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def blob_name(key):
+    return f"segment_{key}.mp4"
+
+
+def missing_runs(hits, max_segments=None):
+    """
+    Groups the segments that must be rendered (hits[n] is False) into runs of
+    consecutive indices [(first, last)], so each run is one encode.
+    max_segments caps the run length (parallel workers).
+    """
+    runs = []
+    for n, hit in enumerate(hits):
+        if hit: continue
+        if runs and runs[-1][1] == n - 1 and (max_segments is None or n - runs[-1][0] < max_segments):
+            runs[-1] = (runs[-1][0], n)
+        else:
+            runs.append((n, n))
+    return runs
+
+
+def split_run(run_path, segments, first, last, work_dir):
+    """
+    Stream-copies a rendered run (video only, starting at segments[first][0]) into
+    one file per segment. The cut points are on the forced keyframe grid, so every
+    piece starts with an IDR frame. Returns the segment paths.
+    """
+    t0 = segments[first][0]
+    prefix = os.path.join(work_dir, f"split_{first:04d}_")
+    paths = [f"{prefix}{n:04d}.mp4" for n in range(last - first + 1)]
+    if first == last:
+        os.replace(run_path, paths[0])
+        return paths
+
+    cut_times = ",".join(f"{segments[n][0] - t0:.3f}" for n in range(first + 1, last + 1))
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', run_path,
+        '-map', '0:v', '-c', 'copy', '-f', 'segment', '-segment_times', cut_times,
+        '-reset_timestamps', '1', '-segment_format', 'mp4', f"{prefix}%04d.mp4"
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Segment split failed: {proc.stderr[-2000:]}")
+    if not all(os.path.exists(p) for p in paths):
+        raise RuntimeError(f"Segment split of {run_path} produced fewer than {len(paths)} segments")
+    return paths
@@ -0,0 +1,65 @@
+# Time-sliced rendering helpers.
+# The timeline is cut into GOP-aligned slices that separate workers encode
+# (video only, fixed GOP so every slice starts on an IDR frame). The slices are
+# then joined with the concat demuxer WITHOUT re-encoding and muxed with one
+# audio mix of the full timeline, so there are no audio glitches at the seams.
+import os
+import subprocess
+
+from render_timeline import FPS
+
+GOP_SECONDS = 2
+GOP_FRAMES = GOP_SECONDS * FPS
+SLICE_SECONDS = 10 # Target slice length (rounded to whole GOPs)
+
+
+def slice_video_args(fps=FPS):
+    # Fixed GOP, no scene-cut keyframes: slice boundaries always land on a keyframe.
+    # Appended to each engine's normal x264 settings so every slice has identical stream parameters.
+    gop_frames = int(round(GOP_SECONDS * fps))
+    return [
+        '-g', str(gop_frames), '-keyint_min', str(gop_frames), '-sc_threshold', '0',
+        '-force_key_frames', f'expr:gte(t,n_forced*{GOP_SECONDS})'
+    ]
+
+
+SLICE_VIDEO_ARGS = slice_video_args()
+
+
+def plan_slices(total_duration, slice_seconds=SLICE_SECONDS):
+    """Splits [0, total_duration) into windows whose boundaries are multiples of the GOP length."""
+    gops_per_slice = max(1, int(round(slice_seconds / GOP_SECONDS)))
+    slice_len = gops_per_slice * GOP_SECONDS
+
+    windows = []
+    t0 = 0
+    while t0 < total_duration:
+        t1 = min(t0 + slice_len, total_duration)
+        windows.append((t0, t1))
+        t0 += slice_len
+
+    # Don't ship a sliver as its own job - fold it into the previous slice
+    if len(windows) > 1 and windows[-1][1] - windows[-1][0] < GOP_SECONDS:
+        last = windows.pop()
+        windows[-1] = (windows[-1][0], last[1])
+    return windows
+
+
+def concat_slices(slice_paths, audio_path, output_path, work_dir, movflags='+faststart'):
+    """
+    Stream-copies the slices into one MP4 and muxes the full-length audio (if any).
+    movflags: '+faststart' for a file, fragmented flags when output_path is a pipe (see streaming_upload).
+    """
+    list_path = os.path.join(work_dir, "slices.txt")
+    with open(list_path, "w") as f:
+        for path in slice_paths:
+            f.write(f"file '{path}'\n")
+
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path:
+        cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+    cmd += ['-c', 'copy', '-movflags', movflags, output_path]
+
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Slice concat failed: {proc.stderr[-2000:]}")
@@ -0,0 +1,100 @@
+# Background publisher for render progress (`{output_key}_status.json`).
+# The render thread only records the latest state; a daemon thread writes it at
+# most every MIN_INTERVAL seconds, so a burst of updates (e.g. one per encoded
+# frame) costs one PUT and a slow R2 round trip never stalls encoding.
+import time
+import threading
+
+MIN_INTERVAL = 2.0 # Seconds between writes (the Studio polls every few seconds)
+
+
+class StatusPublisher:
+    """
+        publisher = StatusPublisher(write)   # write(status_data) does the actual PUT(s)
+        publisher.update("Downloading...", 10)
+        progress = publisher.frame_progress(75, 89)
+        ...engine calls progress(frames_done, frames_total)...
+        publisher.close()                    # flushes the last state synchronously
+    Percent never goes backwards while processing (engines report their own milestones).
+    """
+
+    def __init__(self, write, min_interval=MIN_INTERVAL):
+        self.write = write
+        self.min_interval = min_interval
+        self.state = None # Latest status_data not written yet
+        self.percent = 0
+        self.last_write = 0.0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="status-publisher", daemon=True)
+        self.thread.start()
+
+    def update(self, msg, percent=0, status="processing", **extra):
+        """Records the latest status. Never blocks on I/O. Terminal states are written right away."""
+        with self.cond:
+            if status == "processing":
+                percent = max(self.percent, percent)
+            self.percent = percent
+            self.state = dict({"status": status, "message": msg, "percent": percent, "timestamp": time.time()}, **extra)
+            self.cond.notify()
+        print(f"STATUS UPDATE: {msg}")
+
+    # Usable wherever an update_status(msg, percent=0, status="processing") callback is expected
+    __call__ = update
+
+    def frame_progress(self, lo, hi, label="Encoding"):
+        """
+        Returns progress(done, total) for an encoder: maps frames to percent lo..hi,
+        reports frames and an ETA from the rate observed so far. Cheap enough to call per frame.
+        """
+        started = {}
+
+        def progress(done, total):
+            now = time.time()
+            if not started:
+                started.update(t=now, done=done)
+            total = max(total, 1)
+            done = min(done, total)
+            eta = None
+            elapsed = now - started['t']
+            if elapsed > 0 and done > started['done']:
+                eta = (total - done) * elapsed / (done - started['done'])
+            msg = f"{label}: {done}/{total} frames" + (f", ~{int(eta + 0.5)}s left" if eta is not None else "")
+            with self.cond:
+                percent = max(self.percent, int(lo + (hi - lo) * done / total))
+                self.percent = percent
+                self.state = {
+                    "status": "processing", "message": msg, "percent": percent, "timestamp": now,
+                    "frames": done, "total_frames": total, "eta_seconds": None if eta is None else round(eta, 1)
+                }
+                self.cond.notify()
+        return progress
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.state is None and not self.closed:
+                    self.cond.wait()
+                if self.state is None:
+                    return # Closed and drained
+                wait = self.last_write + self.min_interval - time.time()
+                terminal = self.state['status'] != "processing"
+                if wait > 0 and not terminal and not self.closed:
+                    self.cond.wait(wait) # Coalesce: newer updates replace state meanwhile
+                    continue
+                state, self.state = self.state, None
+                self.last_write = time.time()
+            self._write(state)
+
+    def _write(self, state):
+        try:
+            self.write(state)
+        except Exception as e:
+            print(f"Failed to update status: {e}")
+
+    def close(self):
+        """Stops the thread after writing the latest state (if any)."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
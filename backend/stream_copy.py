@@ -0,0 +1,225 @@
+# Fast path for cut-only timelines.
+# A timeline made of fullscreen video tracks played back to back - no text, images,
+# overlaps, gaps or extra renditions - whose sources already are H.264 at the
+# canvas size and frame rate needs no pixel changes: every output frame is a
+# source frame. Such a timeline is produced without decoding the bulk of it:
+#   [cut start, first keyframe)       re-encoded (only the frames of the cut)
+#   [first keyframe, last keyframe)   stream-copied, whole GOPs
+#   [last keyframe, cut end)          re-encoded
+# Every piece carries its SPS/PPS in-band (h264_mp4toannexb for copies, x264
+# repeat-headers for re-encodes), so pieces from different encoders can follow
+# each other in one stream. The pieces are joined like parallel slices (concat
+# demuxer + one audio mix, see slice_render.concat_slices) once the joined stream
+# has the planned frame count (counted from packets: decoding it all would cost
+# most of the time saved). Any failure means a normal render.
+import os
+import json
+import subprocess
+
+from render_timeline import is_image_track, has_custom_layout, video_clip_span, track_offset
+
+FRAME_TOLERANCE = 0.25 # Frames: timestamps this close count as equal
+# Not ultrafast: its feature set signals Constrained Baseline whatever the source's profile is
+BOUNDARY_ENCODE_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '16', '-pix_fmt', 'yuv420p', '-x264-params', 'repeat-headers=1']
+X264_PROFILES = {'constrained baseline': 'baseline', 'baseline': 'baseline', 'main': 'main', 'high': 'high'}
+
+
+def source_stream(path):
+    """The first video stream of path as ffprobe reports it (+ 'rotation'), or None."""
+    try:
+        out = subprocess.run([
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_name,profile,level,pix_fmt,width,height,r_frame_rate,avg_frame_rate,sample_aspect_ratio,field_order'
+                             ':stream_tags=rotate:stream_side_data=rotation',
+            '-of', 'json', path
+        ], check=True, capture_output=True, text=True, timeout=60).stdout
+        streams = json.loads(out or "{}").get('streams') or []
+    except Exception as e:
+        print(f"Stream copy probe failed for {path}: {e}")
+        return None
+    if not streams:
+        return None
+    stream = streams[0]
+    rotation = (stream.get('tags') or {}).get('rotate')
+    for side_data in stream.get('side_data_list') or []:
+        if side_data.get('rotation') is not None:
+            rotation = side_data['rotation']
+    stream['rotation'] = int(float(rotation or 0)) % 360
+    return stream
+
+
+def _rate(value):
+    try:
+        num, den = str(value).split('/')
+        return float(num) / float(den) if float(den) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _copy_blocker(stream, canvas):
+    # Why frames of this source can't be copied into canvas' output as they are, or None
+    if stream is None:
+        return "unreadable video"
+    if stream.get('codec_name') != 'h264' or str(stream.get('profile', '')).lower() not in X264_PROFILES:
+        return f"{stream.get('codec_name')} {stream.get('profile')}"
+    if stream.get('pix_fmt') != 'yuv420p':
+        return f"pixel format {stream.get('pix_fmt')}"
+    if stream.get('rotation'):
+        return "rotated"
+    if (stream.get('width'), stream.get('height')) != (canvas.w, canvas.h):
+        return f"{stream.get('width')}x{stream.get('height')} source"
+    if stream.get('sample_aspect_ratio') not in (None, '1:1', '0:1'):
+        return f"sample aspect ratio {stream.get('sample_aspect_ratio')}"
+    if stream.get('field_order') not in (None, 'progressive', 'unknown'):
+        return "interlaced"
+    fps, avg_fps = _rate(stream.get('r_frame_rate')), _rate(stream.get('avg_frame_rate'))
+    if not fps or abs(fps - canvas.fps) > 0.01 or (avg_fps and abs(avg_fps - fps) > 0.01):
+        return f"{stream.get('avg_frame_rate')} fps"
+    return None
+
+
+def plan_cuts(video_items, text_tracks, canvases, total_duration):
+    """
+    [{"path", "start", "end"}] (source seconds, in timeline order) when the timeline
+    is only cuts of sources that can be copied as they are, else None.
+    """
+    def reject(reason):
+        print(f"Stream copy: not a cut-only timeline ({reason})")
+        return None
+
+    if len(canvases) != 1:
+        return reject("extra renditions")
+    canvas = canvases[0]
+    if any(t.get('text') for t in text_tracks):
+        return reject("text tracks")
+
+    spans = []
+    for track_data, local_path in video_items:
+        span = video_clip_span(track_data, local_path)
+        if span is None:
+            continue # Unreadable track: the engines skip it too
+        if is_image_track(track_data, local_path):
+            return reject("image tracks")
+        if has_custom_layout(track_data, False):
+            return reject("positioned video")
+        spans.append((span[0], span[1], track_data, local_path))
+    if not spans:
+        return reject("no video")
+
+    # Back to back from 0 to the end: no gaps (black) and no overlaps (layers)
+    spans.sort(key=lambda s: s[0])
+    tolerance = FRAME_TOLERANCE / canvas.fps
+    cursor = 0.0
+    for start, end, _, _ in spans:
+        if abs(start - cursor) > tolerance:
+            return reject("gaps or overlapping video")
+        cursor = end
+    if abs(cursor - total_duration) > tolerance:
+        return reject("audio outlasts the video")
+
+    blockers = {}
+    cuts = []
+    for start, end, track_data, local_path in spans:
+        if local_path not in blockers:
+            blockers[local_path] = _copy_blocker(source_stream(local_path), canvas)
+        if blockers[local_path]:
+            return reject(f"{os.path.basename(local_path)}: {blockers[local_path]}")
+        offset = track_offset(track_data)
+        cuts.append({"path": local_path, "start": offset, "end": offset + (end - start)})
+    return cuts
+
+
+def _video_frames(path):
+    # [(pts_seconds, is_keyframe)] of every video packet, in presentation order
+    out = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path
+    ], check=True, capture_output=True, text=True, timeout=600).stdout
+    frames = []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(',')
+        try:
+            frames.append((float(pts), 'K' in flags))
+        except ValueError:
+            pass # Packets without a timestamp
+    frames.sort()
+    return frames
+
+
+def _run(cmd, what):
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{what} failed: {proc.stderr[-2000:]}")
+    return proc.stdout
+
+
+def split_cut(frames, start, end, fps):
+    """
+    (head, copy, tail) frame index ranges of the cut [start, end) over frames: the
+    copy runs from the first keyframe to the last keyframe (or the cut's end, when
+    the next source frame is a keyframe or there is none). Ranges may be empty.
+    """
+    tolerance = FRAME_TOLERANCE / fps
+    first = next((i for i, (pts, _) in enumerate(frames) if pts >= start - tolerance), len(frames))
+    last = next((i for i, (pts, _) in enumerate(frames) if pts >= end - tolerance), len(frames))
+    # GOP starts inside the cut, plus its end when a GOP ends exactly there
+    bounds = [i for i in range(first, last) if frames[i][1]]
+    if last == len(frames) or frames[last][1]:
+        bounds.append(last)
+    if len(bounds) < 2:
+        return (first, last), (last, last), (last, last) # No whole GOP inside: re-encode it all
+    copy_start, copy_end = bounds[0], bounds[-1]
+    return (first, copy_start), (copy_start, copy_end), (copy_end, last)
+
+
+def render_cuts(cuts, canvas, work_dir):
+    """
+    Writes the pieces of every cut to work_dir and checks that they join into one
+    stream of the planned length. Returns the piece paths in order, plus a stats
+    dict (frames copied / re-encoded). Raises on any failure.
+    """
+    pieces = []
+    stats = {"copied_frames": 0, "encoded_frames": 0}
+    frame_lists = {}
+    tolerance = FRAME_TOLERANCE / canvas.fps
+    for n, cut in enumerate(cuts):
+        path = cut['path']
+        if path not in frame_lists:
+            frame_lists[path] = _video_frames(path)
+        frames = frame_lists[path]
+        # Boundaries get the copied GOPs' profile and level: the first piece's header describes the whole output
+        stream = source_stream(path)
+        profile_args = ['-profile:v', X264_PROFILES[str(stream.get('profile')).lower()]]
+        if (stream.get('level') or 0) >= 10: # (9 is level 1b)
+            profile_args += ['-level:v', f"{stream['level'] / 10:g}"]
+
+        for kind, (a, b) in zip(("head", "copy", "tail"), split_cut(frames, cut['start'], cut['end'], canvas.fps)):
+            if b <= a:
+                continue
+            piece = os.path.join(work_dir, f"cut_{n:03d}_{kind}.mp4")
+            if kind == "copy":
+                # Input seek lands on the keyframe; the microsecond keeps rounding from picking the previous one
+                cmd = ['-ss', f"{frames[a][0] + 1e-6:.6f}", '-i', path, '-map', '0:v:0', '-c', 'copy', '-bsf:v', 'h264_mp4toannexb']
+                stats['copied_frames'] += b - a
+            else:
+                # Accurate seek: decoding starts at the GOP before and discards up to the cut
+                cmd = ['-ss', f"{max(0.0, frames[a][0] - tolerance):.6f}", '-i', path, '-map', '0:v:0'] + \
+                      BOUNDARY_ENCODE_ARGS + profile_args
+                stats['encoded_frames'] += b - a
+            _run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error'] + cmd + ['-frames:v', str(b - a), '-an', piece],
+                 f"Stream copy {kind} of cut {n}")
+            pieces.append((piece, b - a))
+
+    # The check: the concat demuxer reads every planned frame (a copy that started on
+    # the wrong keyframe or ran past its GOP shows up as a different count)
+    list_path = os.path.join(work_dir, "cuts.txt")
+    with open(list_path, "w") as f:
+        for piece, _ in pieces:
+            f.write(f"file '{piece}'\n")
+    out = _run(['ffprobe', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-select_streams', 'v:0',
+                '-count_packets', '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0'], "Stream copy check")
+    counted = int(out.strip() or 0)
+    expected = sum(count for _, count in pieces)
+    if counted != expected:
+        raise RuntimeError(f"Stream copy check: {counted} frames joined, {expected} planned")
+    return [piece for piece, _ in pieces], stats
@@ -0,0 +1,159 @@
+# Streaming upload of the encoder output to R2 (S3 multipart) while it encodes.
+# The encoder writes fragmented MP4 (moov up front, then self-contained
+# moof/mdat fragments) into a FIFO instead of a file. A reader thread cuts the
+# byte stream into fixed-size parts and uploads them as they fill up, so the job
+# is done one part upload after the last frame, and the full file never lands
+# on local disk.
+import os
+import stat
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PART_SIZE = 8 * 1024 * 1024 # R2 wants every part but the last to be the same size (S3 minimum is 5 MiB)
+MAX_PARTS_IN_FLIGHT = 4 # Bounds memory to ~PART_SIZE * (MAX_PARTS_IN_FLIGHT + 1)
+READ_SIZE = 1024 * 1024
+
+# Fragmented MP4 needs no seek back to the start (+faststart does), so it can go
+# down a pipe; it still plays progressively. Overrides the engines' -movflags.
+# A fragment is flushed at every keyframe and at least every FRAGMENT_SECONDS
+# (x264's default GOP is ~8s, which would hold back whole short videos).
+FRAGMENT_SECONDS = 1
+STREAM_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+STREAM_VIDEO_ARGS = ['-movflags', STREAM_MOVFLAGS, '-frag_duration', str(FRAGMENT_SECONDS * 1000000)]
+
+
+def is_stream_output(path, extra_video_args=None):
+    """
+    True if an encoder writing to path feeds a StreamingUpload (a FIFO, or fragmented
+    MP4 args). Such output can't be written again: the reader is gone after the first
+    writer closes, and the parts already uploaded hold its prefix.
+    """
+    if STREAM_MOVFLAGS in (extra_video_args or []):
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+class StreamingUpload:
+    """
+    One multipart upload fed through a FIFO.
+        upload = StreamingUpload(s3_client, bucket, key)
+        path = upload.start()   # give this to the encoder as its output file
+        ...encode...
+        size = upload.finish()  # or upload.abort() if encoding failed
+    """
+
+    def __init__(self, s3_client, bucket, key, content_type='video/mp4', work_dir="/tmp"):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.path = os.path.join(work_dir, f"stream_{uuid.uuid4().hex}.mp4")
+        self.upload_id = None
+        self.parts = []
+        self.bytes = 0
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        """Creates the multipart upload + FIFO and starts the reader. Returns the FIFO path."""
+        response = self.s3.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key,
+            ContentType=self.content_type, ContentDisposition='inline' # Allow Inline Playback (Fixes iOS Player)
+        )
+        self.upload_id = response['UploadId']
+        os.mkfifo(self.path)
+        self.thread = threading.Thread(target=self._pump, name=f"upload-{os.path.basename(self.key)}", daemon=True)
+        self.thread.start()
+        return self.path
+
+    def _upload_part(self, number, body):
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=body
+        )
+        return {"PartNumber": number, "ETag": response['ETag']}
+
+    def _pump(self):
+        # Reader thread: FIFO -> fixed-size parts -> upload_part (a few in flight)
+        slots = threading.Semaphore(MAX_PARTS_IN_FLIGHT)
+        futures = []
+
+        def done(future):
+            slots.release()
+            if future.exception() is not None and self.error is None:
+                self.error = future.exception()
+
+        def submit(pool, body):
+            slots.acquire()
+            future = pool.submit(self._upload_part, len(futures) + 1, bytes(body))
+            futures.append(future)
+            future.add_done_callback(done)
+
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_PARTS_IN_FLIGHT) as pool:
+                # Blocks until the encoder opens its output (or finish/abort releases us)
+                with open(self.path, 'rb', buffering=0) as fifo:
+                    buf = bytearray()
+                    for chunk in iter(lambda: fifo.read(READ_SIZE), b''):
+                        self.bytes += len(chunk)
+                        if self.error is not None:
+                            continue # Upload failed: keep draining so the encoder never blocks on a full pipe
+                        buf += chunk
+                        while len(buf) >= PART_SIZE:
+                            submit(pool, buf[:PART_SIZE])
+                            del buf[:PART_SIZE]
+                    if self.error is None and (buf or not futures):
+                        submit(pool, buf) # Last (short) part
+            if self.error is None:
+                self.parts = [f.result() for f in futures]
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def _release_reader(self):
+        # If nothing ever opened the FIFO for writing, the reader is stuck in open(): pair it with an empty writer
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            pass # Reader already done (ENXIO) or FIFO gone
+
+    def _stop(self):
+        if self.thread is not None:
+            while self.thread.is_alive():
+                # Retry: the reader may not have reached open() yet
+                self._release_reader()
+                self.thread.join(0.1)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def finish(self):
+        """Waits for the last part and completes the upload. Returns the number of bytes uploaded."""
+        self._stop()
+        if self.error is not None:
+            self.abort()
+            raise RuntimeError(f"Streaming upload of {self.key} failed: {self.error}")
+        if self.bytes == 0:
+            self.abort()
+            raise RuntimeError(f"Streaming upload of {self.key} failed: encoder wrote nothing")
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+        self.upload_id = None
+        print(f"Streamed {self.bytes} bytes to {self.key} in {len(self.parts)} parts")
+        return self.bytes
+
+    def abort(self):
+        """Drops the upload (no partial object is left behind)."""
+        self._stop()
+        if self.upload_id is None: return
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            print(f"Failed to abort multipart upload {self.key}: {e}")
+        self.upload_id = None
@@ -0,0 +1,332 @@
+# Text overlay rendering (Pillow). Shared by the MoviePy and FFmpeg engines
+# so captions look identical whichever engine renders the job.
+import os
+from functools import lru_cache
+
+from render_timeline import CANVAS_W, DEFAULT_CANVAS
+
+# Font Logic - Relocated to /root/fonts for safety
+FONT_DIR = "/root/fonts"
+FALLBACK_FONT = "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
+
+RAW_FONT_MAP = {
+    'Anton': f'{FONT_DIR}/Anton-Regular.ttf',
+    'Bebas Neue': f'{FONT_DIR}/BebasNeue-Regular.ttf',
+    'Montserrat': f'{FONT_DIR}/Montserrat-Bold.ttf',
+    'Montserrat-Black': f'{FONT_DIR}/Montserrat-Black.ttf', # Added Black variant
+    'Poppins': f'{FONT_DIR}/Poppins-Bold.ttf',
+    'Lato': f'{FONT_DIR}/Lato-Bold.ttf',
+    'Oswald': f'{FONT_DIR}/Oswald-Bold.ttf',
+    'Raleway': f'{FONT_DIR}/Raleway-Bold.ttf',
+    'Roboto': '/usr/share/fonts/truetype/roboto/hinted/Roboto-Bold.ttf',
+    'Open Sans': '/usr/share/fonts/truetype/open-sans/OpenSans-Bold.ttf',
+    'Inter': '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf'
+}
+
+# Case-Insensitive Lookup
+FONT_MAP = {k.lower(): v for k, v in RAW_FONT_MAP.items()}
+
+# INCREASED SAFETY MARGIN: 980px (was 850px)
+# 1080 - 980 = 100px padding total (~50px each side)
+MAX_WIDTH_PX = 980
+LINE_SPACING = 5 # Tighter line spacing
+PADDING = 40
+
+
+def resolve_font(style):
+    requested_font = style.get('fontFamily') or style.get('font_family') or 'Arial'
+    font_path = FONT_MAP.get(str(requested_font).lower())
+
+    # Smart Weight Selection for Montserrat
+    font_weight = style.get('fontWeight') or style.get('font_weight')
+    if str(requested_font).lower() == 'montserrat':
+        try:
+            weight_val = int(font_weight) if font_weight else 400
+            if weight_val >= 800:
+                font_path = FONT_MAP.get('montserrat-black')
+                print("Selected Montserrat-Black based on weight 900")
+        except:
+            pass
+
+    if font_path:
+        if os.path.exists(font_path):
+            print(f"Found Custom Font: {font_path}")
+            return font_path
+        print(f"MISSING Custom Font: {font_path}")
+
+    # Fallback
+    font = FALLBACK_FONT if os.path.exists(FALLBACK_FONT) else "Arial"
+    print(f"Fallback Font: {font}")
+    return font
+
+
+def resolve_text_style(track, canvas=DEFAULT_CANVAS):
+    """
+    Normalizes a text track into everything needed to rasterize + place it.
+    Sizes stay in Studio pixels; 'scale' (canvas.scale) is applied when rasterizing.
+    Returns None for empty tracks.
+    """
+    text = track.get('text')
+    if not text: return None
+
+    style = track.get('style', {}) or {}
+
+    # Text Transform (Uppercase support)
+    text_transform = style.get('textTransform') or style.get('text_transform')
+    if text_transform == 'uppercase':
+        text = text.upper()
+
+    # Check both keys for stroke width
+    stroke_width = style.get('strokeWidth')
+    if stroke_width is None: stroke_width = style.get('stroke_width')
+
+    # Colors are part of the bitmap cache key - keep them hashable
+    color = style.get('color', 'white')
+    stroke_color = style.get('stroke', '#000000')
+    if isinstance(color, list): color = tuple(color)
+    if isinstance(stroke_color, list): stroke_color = tuple(stroke_color)
+
+    return {
+        "text": text,
+        "start": track.get('start', 0),
+        "duration": track.get('duration', 2),
+        # Force Int Font Size (Critical for Pillow)
+        "font_size": int(float(style.get('fontSize') or style.get('font_size') or 60)),
+        "color": color,
+        "font": resolve_font(style),
+        "stroke_color": stroke_color,
+        "stroke_width": int(stroke_width) if stroke_width is not None else 0,
+        # Canvas width minus the same side margins as 1080 - MAX_WIDTH_PX, in Studio pixels
+        "max_width": int(round(canvas.w / canvas.scale)) - (CANVAS_W - MAX_WIDTH_PX),
+        "scale": canvas.scale,
+        "animation": style.get('animation'),
+        "style": style
+    }
+
+
+# --- CACHES ---
+# Word-by-word subtitles render hundreds of overlays per job with a handful of
+# fonts and a lot of repeated words, so fonts, word widths and finished bitmaps
+# are memoized (per container; warm containers keep them across jobs).
+FONT_CACHE_SIZE = 64
+ADVANCE_CACHE_SIZE = 65536
+BITMAP_CACHE_SIZE = 256 # ~1000x200 RGBA worst case each
+WRAP_EXACT_MARGIN_PX = 8 # Re-measure lines this close to the wrap width exactly (kerning)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font_path, font_size):
+    """ImageFont for (path, size): custom font -> system bold font -> Pillow bitmap default."""
+    from PIL import ImageFont
+
+    # 1. Load Font (ROBUST)
+    print(f"DEBUG: Loading font: '{font_path}' Size: {font_size}")
+    if font_path and os.path.exists(font_path):
+        try:
+            return ImageFont.truetype(font_path, font_size)
+        except Exception as e:
+            print(f"ERROR: Failed to load custom font {font_path}: {e}")
+
+    # Fallback to system bold font (Vector)
+    if os.path.exists(FALLBACK_FONT):
+        print(f"WARNING: Using Fallback System Font: {FALLBACK_FONT}")
+        try:
+            return ImageFont.truetype(FALLBACK_FONT, font_size)
+        except:
+            pass
+
+    print("CRITICAL: All fonts failed. Using bitmap default (Tiny).")
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=ADVANCE_CACHE_SIZE)
+def text_advance(font_path, font_size, text):
+    # Horizontal advance of a word / line in pixels (cached per font)
+    font = load_font(font_path, font_size)
+    try:
+        # Modern Pillow
+        return font.getlength(text)
+    except AttributeError:
+        # Older Pillow
+        return font.getsize(text)[0]
+
+
+def wrap_text(text, font_path, font_size, stroke_width, max_width=MAX_WIDTH_PX):
+    """
+    Pixel-Based Wrapping (Matches CSS/Studio behavior).
+    Fixed char limit causes "narrow column" look for small fonts.
+    We must wrap based on VIDEO WIDTH (1080p) - PADDING.
+    Line width is built from cached word advances (linear in word count); only
+    lines within WRAP_EXACT_MARGIN_PX of the limit are measured as a whole string.
+    """
+    space_w = text_advance(font_path, font_size, " ")
+    # Account for stroke width (left + right) in the width calculation
+    limit = max_width - int(stroke_width) * 2
+
+    wrapped_lines = []
+    current_line_words = []
+    current_w = 0.0
+
+    for word in text.split():
+        word_w = text_advance(font_path, font_size, word)
+        line_w = current_w + space_w + word_w if current_line_words else word_w
+
+        fits = line_w <= limit
+        if abs(line_w - limit) <= WRAP_EXACT_MARGIN_PX:
+            # Close call: kerning across words matters, measure the real string
+            fits = text_advance(font_path, font_size, " ".join(current_line_words + [word])) <= limit
+
+        if fits:
+            current_line_words.append(word)
+            current_w = line_w
+        else:
+            if current_line_words:
+                wrapped_lines.append(" ".join(current_line_words))
+                current_line_words = [word] # Start new line with current word
+                current_w = word_w
+            else:
+                # One massive word? Let's just put it on the line
+                wrapped_lines.append(word)
+                current_line_words = []
+                current_w = 0.0
+
+    if current_line_words:
+        wrapped_lines.append(" ".join(current_line_words))
+
+    if not wrapped_lines: # Empty text safety
+        wrapped_lines = [" "]
+    return wrapped_lines
+
+
+@lru_cache(maxsize=BITMAP_CACHE_SIZE)
+def rasterize_text(text, font_path, font_size, color, stroke_color, stroke_width, bg_color, max_width=MAX_WIDTH_PX, scale=1.0):
+    """
+    Renders text to an RGBA uint8 numpy array (H, W, 4).
+    font_size / stroke_width / max_width are Studio pixels; the bitmap is drawn at
+    scale (canvas.scale) with the line breaks of the full-size layout, so a
+    preview wraps exactly like the final render.
+    Cached by every argument; the returned array is shared and read-only.
+    """
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    wrapped_lines = wrap_text(text, font_path, font_size, stroke_width, max_width)
+    if scale != 1:
+        font_size = max(1, int(font_size * scale))
+        stroke_width = int(round(int(stroke_width) * scale))
+    font = load_font(font_path, font_size)
+    line_spacing = int(round(LINE_SPACING * scale))
+    padding = int(round(PADDING * scale))
+
+    # 3. Calculate Dimensions
+    dummy_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+
+    line_heights = []
+    line_widths = []
+    text_width = 0
+    total_height = 0
+
+    for line in wrapped_lines:
+        # textbbox(xy, text, font=, stroke_width=), xy is top-left
+        try:
+            bbox = dummy_draw.textbbox((0, 0), line, font=font, stroke_width=int(stroke_width))
+            w = bbox[2] - bbox[0]
+            h = bbox[3] - bbox[1]
+        except AttributeError:
+            # Old PIL fallback
+            w, h = dummy_draw.textsize(line, font=font, stroke_width=int(stroke_width))
+
+        text_width = max(text_width, w)
+        line_widths.append(w)
+        line_heights.append(h)
+        total_height += h
+
+    total_height += (len(wrapped_lines) - 1) * line_spacing
+
+    # Add padding
+    img_w = int(text_width + padding * 2)
+    img_h = int(total_height + padding * 2)
+
+    # 4. Create Image
+    bg_rgba = (0,0,0,0) # Transparent
+    if bg_color and bg_color != 'transparent':
+        # PIL handles common names and hex.
+        bg_rgba = bg_color
+
+    img = Image.new('RGBA', (img_w, img_h), bg_rgba)
+    draw = ImageDraw.Draw(img)
+
+    # 5. Draw Text
+    current_y = padding
+    for i, line in enumerate(wrapped_lines):
+        # Center text horizontally
+        x = (img_w - line_widths[i]) // 2
+
+        # Draw Stroke & Fill
+        draw.text(
+            (x, current_y),
+            line,
+            font=font,
+            fill=color,
+            stroke_width=int(stroke_width),
+            stroke_fill=stroke_color,
+            align='center'
+        )
+        current_y += line_heights[i] + line_spacing
+
+    arr = np.asarray(img).copy()
+    arr.flags.writeable = False
+    return arr
+
+
+# Helper to render using Pillow
+def generate_pillow_text(text, font_path, font_size, color, stroke_color, stroke_width, bg_color, max_width=MAX_WIDTH_PX, scale=1.0, work_dir="/tmp"):
+    # The FFmpeg engine needs files as inputs. Identical bitmaps share one PNG per
+    # work_dir (named after the style), so the files go away with the job's directory
+    import hashlib
+    from PIL import Image
+
+    key = (text, font_path, font_size, color, stroke_color, stroke_width, bg_color, max_width, scale)
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]
+    temp_filename = os.path.join(work_dir, f"txt_{digest}.png")
+    if os.path.exists(temp_filename):
+        return temp_filename
+
+    arr = rasterize_text(*key)
+    Image.fromarray(arr, 'RGBA').save(temp_filename)
+    print(f"PIL Generated: {temp_filename}")
+    return temp_filename
+
+
+def _with_font_fallback(spec, bg_color, render):
+    try:
+        # Attempt 1: Trusted Custom Font + Pillow (Best Quality)
+        return render(spec['text'], spec['font'], spec['font_size'], spec['color'], spec['stroke_color'], spec['stroke_width'], bg_color, spec['max_width'], spec['scale'])
+    except Exception as e:
+        print(f"PIL Custom Font Failed: {e}")
+
+    # Attempt 2: System Font + Pillow
+    try:
+        fallback = FALLBACK_FONT if os.path.exists(FALLBACK_FONT) else "Arial"
+        result = render(spec['text'], fallback, spec['font_size'], spec['color'], spec['stroke_color'], spec['stroke_width'], bg_color, spec['max_width'], spec['scale'])
+        print("Fallback Font Image Generated (PIL)")
+        return result
+    except Exception as e2:
+        print(f"PIL Fallback Failed: {e2}")
+        return None
+
+
+def render_text_array(spec, bg_color='transparent'):
+    """
+    Renders a resolved text spec (see resolve_text_style) to a cached RGBA numpy array.
+    Returns None if every Pillow attempt failed. No disk round trip (MoviePy ImageClip takes arrays).
+    """
+    return _with_font_fallback(spec, bg_color, rasterize_text)
+
+
+def render_text_png(spec, work_dir, bg_color='transparent'):
+    """
+    Renders a resolved text spec (see resolve_text_style) to a transparent PNG in work_dir.
+    Returns the PNG path, or None if every Pillow attempt failed.
+    """
+    return _with_font_fallback(spec, bg_color, lambda *args: generate_pillow_text(*args, work_dir=work_dir))
@@ -0,0 +1,249 @@
+# Per-stage timing for jobs (render, analysis, subtitles, TTS, face analysis).
+# A Trace is a list of spans. Each span records wall time, CPU time of this
+# process and of the ffmpeg children it waited for, bytes moved (set by the
+# caller: downloaded, encoded, uploaded...) and peak RSS of this process (per
+# span where the kernel lets us reset it) and of its largest child so far. The summary goes into
+# the job's _result.json / _status.json; the spans go out as JSONL (one object
+# per line) to the Modal log ("TRACE {...}") and, with R2 credentials, to
+# traces/{date}/{job}/{trace_id}.jsonl for aggregation.
+# CPU time and RSS are per process: when other jobs run in the same container
+# (concurrent inputs) a span says so ("concurrent": n) and doesn't reset the peak.
+# "cold" marks the first job of a container process (it paid, or restored, the start-up);
+# marks are one-off milestones such as "first_frame", in seconds since the job started.
+import json
+import time
+import uuid
+import resource
+import threading
+from contextlib import contextmanager
+
+TRACE_PREFIX = "traces/"
+TRACE_LOG_TAG = "TRACE"
+
+_running = set() # Traces with an open span, in this process
+_running_lock = threading.Lock()
+_jobs_started = 0 # Traces created in this process
+
+
+def _cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def _reset_peak_rss():
+    # Linux >= 4.0: resets VmHWM so the next read is this span's peak, not the process lifetime's
+    try:
+        with open("/proc/self/clear_refs", "w") as f: f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    # VmHWM (resettable) when available, else the lifetime high-water mark (ru_maxrss is KiB on Linux)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Span:
+    """One timed stage. add_bytes() / set() may be called while it runs."""
+
+    def __init__(self, name, depth, trace_started, concurrent=0, **attrs):
+        self.name = name
+        self.depth = depth
+        self.attrs = attrs
+        self.concurrent = concurrent # Other jobs running when the span started
+        self.bytes = 0
+        self.error = None
+        self.record = None # Filled in by end()
+        self.started = time.time()
+        self.offset = self.started - trace_started
+        self.wall0 = time.perf_counter()
+        self.cpu0 = _cpu_seconds(resource.getrusage(resource.RUSAGE_SELF))
+        self.child_cpu0 = _cpu_seconds(resource.getrusage(resource.RUSAGE_CHILDREN))
+        # Nested spans share the process high-water mark, so only top-level spans reset it,
+        # and only while no other job's spans depend on it
+        self.rss_reset = depth == 0 and not concurrent and _reset_peak_rss()
+
+    def add_bytes(self, n):
+        self.bytes += int(n or 0)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def snapshot(self):
+        """The span's record: final once ended, time so far while running."""
+        if self.record is not None:
+            return self.record
+        record = {
+            "name": self.name,
+            "depth": self.depth,
+            "start_s": round(self.offset, 3),
+            "wall_s": round(time.perf_counter() - self.wall0, 3),
+            "cpu_s": round(_cpu_seconds(resource.getrusage(resource.RUSAGE_SELF)) - self.cpu0, 3),
+            # Subprocesses (ffmpeg) count once they have been waited for
+            "child_cpu_s": round(_cpu_seconds(resource.getrusage(resource.RUSAGE_CHILDREN)) - self.child_cpu0, 3),
+            "bytes": self.bytes,
+            "peak_rss_mb": _peak_rss_mb(),
+            "peak_rss_scope": "span" if self.rss_reset else "process",
+            # Largest waited-for child (e.g. an ffmpeg encode) since the process started.
+            # A child starts out sharing our pages, so this is at least our RSS when it was spawned.
+            "child_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        }
+        if self.concurrent:
+            record["concurrent"] = self.concurrent
+        if self.attrs:
+            record.update(self.attrs)
+        if self.error is not None:
+            record["error"] = self.error
+        return record
+
+    def end(self, error=None):
+        if self.record is None:
+            if error is not None:
+                self.error = str(error)
+            self.record = self.snapshot()
+        return self.record
+
+
+class Trace:
+    """
+        trace = Trace("render", output_key=output_key)
+        trace.stage("download")             # ends the previous stage, starts this one
+        ...
+        with trace.span("gemini") as span:  # explicit (nestable) span
+            span.add_bytes(size)
+        trace.end()                         # ends the open stage
+        result_data["trace"] = trace.summary()
+        trace.emit(s3_client, bucket)
+    Thread-safe for summary() calls from the status publisher.
+    """
+
+    def __init__(self, job, **attrs):
+        self.job = job
+        self.trace_id = uuid.uuid4().hex
+        self.attrs = attrs
+        self.started = time.time()
+        global _jobs_started
+        with _running_lock:
+            self.cold = _jobs_started == 0
+            _jobs_started += 1
+        self.marks = {} # Milestone -> seconds since started
+        self.spans = [] # Started spans, in order
+        self.open = [] # Stack of running spans
+        self.lock = threading.Lock()
+
+    def _start(self, name, **attrs):
+        with _running_lock:
+            _running.add(self)
+            concurrent = len(_running) - 1
+        with self.lock:
+            span = Span(name, len(self.open), self.started, concurrent, **attrs)
+            self.spans.append(span)
+            self.open.append(span)
+        return span
+
+    def _idle(self):
+        # Called with self.lock held, after spans were closed
+        if not self.open:
+            with _running_lock:
+                _running.discard(self)
+
+    def _end(self, span, error=None):
+        with self.lock:
+            span.end(error)
+            if span in self.open:
+                self.open.remove(span)
+            self._idle()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = self._start(name, **attrs)
+        try:
+            yield span
+        except BaseException as e:
+            self._end(span, e)
+            raise
+        self._end(span)
+
+    def stage(self, name, **attrs):
+        """Sequential top-level stages: ends whatever stage is open and starts name."""
+        self.end()
+        return self._start(name, **attrs)
+
+    def mark(self, name):
+        """Records a milestone (seconds since the job started); the first call wins."""
+        with self.lock:
+            self.marks.setdefault(name, round(time.time() - self.started, 3))
+
+    def frame_marker(self, progress, name="first_frame"):
+        """Wraps an encoder's progress(done, total) so the first finished frame is marked."""
+        def wrapped(done, total):
+            if done > 0 and name not in self.marks:
+                self.mark(name)
+            return progress(done, total)
+        return wrapped
+
+    def end(self, error=None):
+        """Ends every open span (innermost first); error is recorded on them."""
+        with self.lock:
+            while self.open:
+                self.open.pop().end(error)
+            self._idle()
+
+    def summary(self):
+        """Compact per-stage view for the job manifests (running spans show their time so far)."""
+        with self.lock:
+            stages = [span.snapshot() if span.record is not None else dict(span.snapshot(), running=True) for span in self.spans]
+            current = self.open[-1].name if self.open else None
+            marks = dict(self.marks)
+        return {
+            "trace_id": self.trace_id,
+            "wall_s": round(time.time() - self.started, 3),
+            "cold": self.cold,
+            "stage": current,
+            "marks": marks,
+            "stages": stages
+        }
+
+    def lines(self):
+        """JSONL records: one per span, then the whole job."""
+        summary = self.summary()
+        base = {"trace_id": self.trace_id, "job": self.job, "timestamp": self.started}
+        base.update(self.attrs)
+        records = [dict(base, kind="span", **stage) for stage in summary['stages']]
+        top = [s for s in summary['stages'] if s['depth'] == 0]
+        records.append(dict(
+            base, kind="job", wall_s=summary['wall_s'], cold=summary['cold'],
+            **{f"{name}_s": t for name, t in summary['marks'].items()},
+            cpu_s=round(sum(s['cpu_s'] for s in top), 3),
+            child_cpu_s=round(sum(s['child_cpu_s'] for s in top), 3),
+            bytes=sum(s['bytes'] for s in top),
+            peak_rss_mb=max([s['peak_rss_mb'] for s in top] or [0]),
+            child_peak_rss_mb=max([s['child_peak_rss_mb'] for s in top] or [0]),
+            error=next((s['error'] for s in summary['stages'] if s.get('error')), None)
+        ))
+        return [json.dumps(r, default=str, separators=(',', ':')) for r in records]
+
+    def emit(self, s3_client=None, bucket=None):
+        """Logs the JSONL trace and uploads it to R2 when a client is given. Never raises."""
+        try:
+            self.end()
+            lines = self.lines()
+            for line in lines:
+                print(f"{TRACE_LOG_TAG} {line}")
+            if s3_client is not None and bucket:
+                day = time.strftime("%Y-%m-%d", time.gmtime(self.started))
+                key = f"{TRACE_PREFIX}{day}/{self.job}/{self.trace_id}.jsonl"
+                s3_client.put_object(
+                    Bucket=bucket, Key=key, Body="\n".join(lines) + "\n", ContentType='application/x-ndjson'
+                )
+                return key
+        except Exception as e:
+            print(f"Failed to emit trace: {e}")
+        return None
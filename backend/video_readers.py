@@ -0,0 +1,230 @@
+# Video source decoding for the MoviePy engine.
+# Instead of VideoFileClip + per-frame resize()/crop() in Python, each source is
+# decoded by an ffmpeg process whose filter chain already scales, crops and
+# converts to the output fps, so frames arrive ready to composite.
+# A DecoderPool keeps memory bounded by the number of layers on screen, not by
+# the number of tracks: a decoder's ffmpeg process and frame buffer exist only
+# from just before its clip starts until it ends, and at most max_open run at once.
+# Tracks showing the same source at the same time (split-screen crops of one
+# interview) share one decoder: each gets a TrackView and resizes/crops the shared frame.
+import os
+import subprocess
+from collections import OrderedDict
+
+from render_timeline import FPS
+
+SEEK_AHEAD_FRAMES = 2 * FPS # Further forward than this: reopen with a seek instead of decoding through
+MAX_OPEN_DECODERS = 8 # Running ffmpeg readers per render (more only if more layers are on screen at once)
+PREFETCH_SECONDS = 0.5 # Start a decoder this long before its clip, so spawn + seek overlap the frames before
+
+
+class SourceDecoder:
+    """
+    Sequential rawvideo (rgb24) reader for one source through an ffmpeg filter chain.
+    size: (w, h) of the frames the chain produces. Frame k is at source time offset + k / fps.
+    Seeks are input seeks (-ss before -i): jump to the nearest keyframe, then decode
+    and discard up to the exact time, so a trimmed excerpt never decodes the whole source.
+    get_frame returns a reused buffer: copy it if you need it past the next call.
+    Nothing is allocated or spawned until the first frame (or a pool prefetch).
+    pool / start / end: the owning DecoderPool and the clip's timeline span.
+    """
+
+    def __init__(self, path, size, vf=None, offset=0.0, fps=FPS, pool=None, start=0.0, end=None):
+        self.path = path
+        self.size = (int(size[0]), int(size[1]))
+        self.fps = fps
+        self.offset = float(offset or 0)
+        self.vf = f"{vf},fps={fps}" if vf else f"fps={fps}"
+        self.pool = pool
+        self.start = float(start or 0)
+        self.end = end
+        self.proc = None
+        self.pos = 0 # Index of the next frame the pipe delivers
+        self.buffer = None
+        self.view = None
+        self.has_frame = False
+        self.last_used = None # Pool clock of the last get_frame
+        self.key = None # Sharing key (set by DecoderPool)
+        self.tracks = 1 # Tracks drawing from this decoder
+
+    def _open(self, index):
+        import numpy as np
+
+        self._stop()
+        if self.buffer is None:
+            self.buffer = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+            self.view = memoryview(self.buffer).cast('B')
+            self.has_frame = False
+        t = self.offset + index / self.fps
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if t > 0:
+            cmd += ['-ss', f"{t:.6f}"]
+        cmd += ['-i', self.path, '-an', '-sn', '-vf', self.vf, '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=len(self.view))
+        self.pos = index
+        if self.pool is not None:
+            self.pool._started(self)
+
+    def prefetch(self, index=0):
+        """Starts the ffmpeg process ahead of the first get_frame (no-op if running)."""
+        if self.proc is None:
+            self._open(index)
+
+    def _read(self):
+        # Fill the buffer with the next frame. False at end of stream (buffer keeps the last frame).
+        got = 0
+        while got < len(self.view):
+            n = self.proc.stdout.readinto(self.view[got:])
+            if not n:
+                self._stop() # Reap ffmpeg now; the buffer keeps the last frame
+                return False
+            got += n
+        self.pos += 1
+        self.has_frame = True
+        return True
+
+    def get_frame(self, t):
+        if self.pool is not None:
+            self.pool.touch(self, self.start + t)
+        index = int(self.fps * t + 0.00001) # Same rounding as MoviePy's reader
+        if self.has_frame and index == self.pos - 1:
+            return self.buffer
+        if self.proc is None and self.has_frame and index >= self.pos:
+            return self.buffer # Source ended: hold the last frame
+        if self.proc is None or index < self.pos or index - self.pos > SEEK_AHEAD_FRAMES:
+            self._open(index)
+        while self.pos <= index:
+            if not self._read():
+                break # Past the end: hold the last frame
+        return self.buffer
+
+    def _stop(self):
+        # Ends the ffmpeg process (the frame buffer stays)
+        if self.proc is None: return
+        try:
+            self.proc.stdout.close()
+            self.proc.kill()
+            self.proc.wait()
+        except Exception:
+            pass
+        self.proc = None
+        if self.pool is not None:
+            self.pool._stopped(self)
+
+    def close(self):
+        """Ends the process and frees the frame buffer. A later get_frame reopens with a seek."""
+        self._stop()
+        self.buffer = None
+        self.view = None
+        self.has_frame = False
+
+
+class TrackView:
+    """One track's window onto a (possibly shared) SourceDecoder: maps clip time to decoder time."""
+
+    def __init__(self, decoder, start):
+        self.decoder = decoder
+        self.start = float(start or 0)
+        self.size = decoder.size
+        self.fps = decoder.fps
+
+    def get_frame(self, t):
+        # decoder.start moves earlier if a track starting before this one joins later
+        return self.decoder.get_frame(t + self.start - self.decoder.start)
+
+
+class DecoderPool:
+    """
+    Owns every SourceDecoder of one render and decides when each one runs.
+    The clock is the timeline time of the frame being rendered: advance(t) (once per
+    frame, from the frame writer) or any decoder's get_frame moves it forward.
+      - decoders whose clip ended by the clock are closed (process and buffer);
+      - decoders whose clip starts within PREFETCH_SECONDS are started early;
+      - above max_open running decoders, the least recently used one that is not
+        on screen in the current frame is stopped (it reopens with a seek if needed).
+    """
+
+    def __init__(self, max_open=MAX_OPEN_DECODERS):
+        self.max_open = max_open
+        self.decoders = []
+        self.running = OrderedDict() # decoder -> None, least recently used first
+        self.clock = None
+        self.peak_open = 0
+        self.spawned = 0
+
+    def open(self, path, size, vf=None, offset=0.0, fps=FPS, start=0.0, duration=None):
+        """
+        Returns a TrackView for a clip at timeline [start, start + duration). Nothing runs yet.
+        A clip overlapping another one of the same file, filter chain and source/timeline
+        alignment joins that decoder (its span grows to cover both) instead of opening its own.
+        """
+        start = float(start or 0)
+        offset = float(offset or 0)
+        end = None if duration is None else start + float(duration)
+        key = (os.path.realpath(path), (int(size[0]), int(size[1])), vf, fps, round(offset - start, 6))
+        for decoder in self.decoders:
+            if decoder.key != key: continue
+            if (end is not None and end <= decoder.start) or (decoder.end is not None and decoder.end <= start): continue
+            if start < decoder.start:
+                decoder.start, decoder.offset = start, offset # Same alignment, so the same source frames
+            decoder.end = None if end is None or decoder.end is None else max(decoder.end, end)
+            decoder.tracks += 1
+            return TrackView(decoder, start)
+        decoder = SourceDecoder(path, size, vf, offset, fps, pool=self, start=start, end=end)
+        decoder.key = key
+        self.decoders.append(decoder)
+        return TrackView(decoder, start)
+
+    def touch(self, decoder, t):
+        if self.clock is None or t > self.clock:
+            self.advance(t)
+        decoder.last_used = self.clock
+        if decoder in self.running:
+            self.running.move_to_end(decoder)
+
+    def advance(self, t):
+        if self.clock is not None and t <= self.clock:
+            return
+        self.clock = t
+        for decoder in self.decoders:
+            if decoder.end is not None and decoder.end <= t:
+                if decoder.buffer is not None:
+                    decoder.close() # Clip is over (renders only move forward)
+            elif decoder.proc is None and decoder.buffer is None and decoder.start - PREFETCH_SECONDS <= t < decoder.start:
+                if len(self.running) < self.max_open:
+                    decoder.prefetch()
+
+    def _started(self, decoder):
+        self.spawned += 1
+        self.running[decoder] = None
+        self.running.move_to_end(decoder)
+        if len(self.running) > self.max_open:
+            # Stop the least recently used decoder that isn't drawing the current frame
+            victim = next((d for d in self.running if d is not decoder and d.last_used != self.clock), None)
+            if victim is not None:
+                victim.close()
+        self.peak_open = max(self.peak_open, len(self.running))
+
+    def _stopped(self, decoder):
+        self.running.pop(decoder, None)
+
+    def close(self):
+        for decoder in self.decoders:
+            decoder.close()
+        if self.decoders:
+            tracks = sum(d.tracks for d in self.decoders)
+            print(f"Decoders: {len(self.decoders)} sources for {tracks} tracks, {self.spawned} ffmpeg processes, peak {self.peak_open} running (cap {self.max_open})")
+        self.decoders = []
+
+
+def decoder_clip(decoder, duration):
+    """MoviePy VideoClip pulling frames from a SourceDecoder (or a TrackView of one)."""
+    from moviepy.video.VideoClip import VideoClip
+
+    # VideoClip(make_frame) would decode frame 0 just to learn the size - at build
+    # time, for every track. The decoder already knows it, so nothing runs until rendering.
+    clip = VideoClip(duration=duration)
+    clip.make_frame = decoder.get_frame
+    clip.size = decoder.size
+    clip.fps = decoder.fps
+    return clip
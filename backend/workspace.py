@@ -0,0 +1,89 @@
+# Per-invocation scratch directories. Jobs used to write fixed paths (/tmp/assets,
+# /tmp/render_output.mp4, /tmp/mixed_audio.mp3...), so two inputs running in one
+# container (allow_concurrent_inputs) would overwrite each other's files.
+# Every job now works under WORK_ROOT/{job}_{id}/ and the directory goes away
+# when the job ends, whether it succeeded or not.
+import os
+import time
+import uuid
+import shutil
+import threading
+import subprocess
+
+WORK_ROOT = "/tmp/jobs"
+STALE_SECONDS = 2 * 3600 # Longer than any job's timeout: left behind by a killed input
+FONT_CACHE_MARKER = "/root/.font_cache_ready" # Written by the image build (see main.py), else by the first job
+
+_font_cache_lock = threading.Lock()
+
+
+class Workspace:
+    """
+        workspace = Workspace("render")
+        try:
+            assets_dir = workspace.path("assets")
+            ...
+        finally:
+            workspace.close()   # or: with Workspace("render") as workspace: ...
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.root = os.path.join(WORK_ROOT, f"{job}_{uuid.uuid4().hex[:12]}")
+        sweep_stale()
+        os.makedirs(self.root)
+
+    def path(self, *parts):
+        """Path inside the workspace (parent directories are created, the file is not)."""
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def dir(self, *parts):
+        """Directory inside the workspace, created if missing."""
+        path = os.path.join(self.root, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        # Probe results for files that no longer exist (paths are never reused)
+        from media_probe import forget_probes
+        forget_probes(self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sweep_stale(max_age=STALE_SECONDS):
+    # A timed-out input can be cancelled before its finally block runs
+    try:
+        names = os.listdir(WORK_ROOT)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        path = os.path.join(WORK_ROOT, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                print(f"Removing stale workspace {path}")
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def ensure_font_cache():
+    # Normally a no-op: the image is built with the font cache. Images built without it get
+    # one run per container; concurrent first jobs wait for it instead of racing it
+    with _font_cache_lock:
+        if os.path.exists(FONT_CACHE_MARKER) or not shutil.which("fc-cache"):
+            return
+        print("Initializing Font Cache (Runtime)...")
+        subprocess.run(["fc-cache", "-f"], check=False)
+        try:
+            with open(FONT_CACHE_MARKER, "w") as f: f.write("done")
+        except OSError as e:
+            print(f"Font cache marker not written: {e}")